@@ -0,0 +1,122 @@
+"""Benchmark for the Python UDF of the Snowflake version of the split_line component.
+
+Runs the batch function of `components/split_line/src/split_lines.py`
+on the synthetic lines of `split_line_udf.py` and, if Node.js is available,
+compares its time and results with the JavaScript UDF of the BigQuery version.
+Both must return the same segments (up to 1e-9 degrees). Which one is faster
+depends on the number of lines (the Python UDF pays a fixed cost per batch),
+so these local times only hint at the times in Snowflake:
+
+    $ python benchmarks/split_line_python.py --lines 100 --vertices 1000 --crossings 50
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+ROOT_FOLDER = os.path.dirname(BENCHMARKS_FOLDER)
+sys.path.insert(0, BENCHMARKS_FOLDER)
+sys.path.insert(0, os.path.join(ROOT_FOLDER, "components", "split_line", "src"))
+
+import numpy as np  # noqa: E402
+import shapely  # noqa: E402
+
+from split_line_udf import current_udf, synthetic_line  # noqa: E402
+from split_lines import split_lines  # noqa: E402
+
+RUNNER = r"""
+const fs = require("fs");
+const input = JSON.parse(fs.readFileSync(process.argv[2], "utf-8"));
+const udf = new Function("line_geojson", "pts", "tolerance", input.udf);
+const args = input.lines.map(l => [
+  JSON.stringify({ type: "LineString", coordinates: l.line }),
+  l.points.map(c => ({ x: c[0], y: c[1] })),
+]);
+let best = Infinity, results;
+for (let round = 0; round < input.repeat; round++) {
+  const start = process.hrtime.bigint();
+  results = args.map(a => udf(a[0], a[1], input.tolerance));
+  best = Math.min(best, Number(process.hrtime.bigint() - start) / 1e6);
+}
+console.log(JSON.stringify({
+  time: best,
+  segments: results.map(segments => segments.map(s => s.coords.map(p => [p.x, p.y]))),
+}));
+"""
+
+
+def run_udf(lines, tolerance, repeat):
+    """Best time (ms) and results of the JavaScript UDF."""
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        input_file = os.path.join(tmp_folder, "input.json")
+        runner_file = os.path.join(tmp_folder, "runner.js")
+        with open(input_file, "w") as f:
+            json.dump(
+                {"udf": current_udf(), "tolerance": tolerance, "repeat": repeat, "lines": lines},
+                f,
+            )
+        with open(runner_file, "w") as f:
+            f.write(RUNNER)
+        process = subprocess.run(
+            ["node", runner_file, input_file], stdout=subprocess.PIPE, check=True
+        )
+    result = json.loads(process.stdout)
+    return result["time"], result["segments"]
+
+
+def same_segments(segments, expected):
+    if len(segments) != len(expected):
+        return False
+    return all(
+        len(a) == len(b) and np.allclose(a, b, rtol=0, atol=1e-9)
+        for a, b in zip(segments, expected)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", help="Number of lines", type=int, default=100)
+    parser.add_argument("--vertices", help="Vertices per line", type=int, default=1000)
+    parser.add_argument("--crossings", help="Crossing points per line", type=int, default=50)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-n", "--repeat", help="Runs per implementation", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lines = [synthetic_line(args.vertices, args.crossings, rng) for _ in range(args.lines)]
+    geometries = shapely.linestrings([line["line"] for line in lines])
+    points = [line["points"] for line in lines]
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        results = split_lines(geometries, points, args.tolerance)
+        times.append((time.perf_counter() - start) * 1000)
+    segments = sum(len(r) for r in results)
+    summary = (
+        f"{args.lines} lines x {args.vertices} vertices, {args.crossings} crossings: "
+        f"{min(times):.0f} ms"
+    )
+    if shutil.which("node") is None:
+        print(f"{summary}, {segments} segments (Node.js not found, not compared)")
+        return
+
+    udf_time, udf_results = run_udf(lines, args.tolerance, args.repeat)
+    print(
+        f"{summary} (JavaScript UDF {udf_time:.0f} ms, row at a time), {segments} segments"
+    )
+    different = sum(not same_segments(r, e) for r, e in zip(results, udf_results))
+    if different:
+        print(f"The results of {different} lines differ from the JavaScript UDF")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Benchmark for the `splitLineAtPoints` JavaScript UDF of the split_line component.
+
+Reads the UDF from `components/split_line/src/split_line_at_points.js` and runs it with
+Node.js on long synthetic lines crossed at many points, compared with the
+previous implementation (which took and returned WKT text, and projected every
+point onto every segment of the line). Both implementations must return the
+same segments:
+
+    $ python benchmarks/split_line_udf.py --vertices 5000 --crossings 500
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UDF_FILE = os.path.join(
+    ROOT_FOLDER, "components", "split_line", "src", "split_line_at_points.js"
+)
+
+LEGACY_UDF = r"""function parsePoint(wkt) {
+  try {
+    var inner = wkt.replace(/^POINT\\(/, "").replace(/\\)$/, "");
+    var parts = inner.split(" ");
+    return { x: parseFloat(parts[0]), y: parseFloat(parts[1]) };
+  } catch (err) {
+    return null;
+  }
+}
+
+function parseLine(wkt) {
+  var inner = wkt.replace(/^LINESTRING\\(/, "").replace(/\\)$/, "");
+  var parts = inner.split(",");
+  return parts.map(function(part) {
+    var coords = part.trim().split(" ");
+    return { x: parseFloat(coords[0]), y: parseFloat(coords[1]) };
+  });
+}
+
+function lineWKT(points) {
+  return "LINESTRING(" + points.map(pt => pt.x + " " + pt.y).join(", ") + ")";
+}
+
+function distance(a, b) {
+  var dx = b.x - a.x, dy = b.y - a.y;
+  return Math.sqrt(dx * dx + dy * dy);
+}
+
+function interpolatePoint(line, d) {
+  var cum = 0;
+  for (var i = 0; i < line.length - 1; i++) {
+    var a = line[i], b = line[i+1];
+    var segLen = distance(a, b);
+    if (cum + segLen >= d) {
+      var t = (d - cum) / segLen;
+      return { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
+    }
+    cum += segLen;
+  }
+  return line[line.length - 1];
+}
+
+function cumulativeDistances(line) {
+  var cum = [0];
+  for (var i = 1; i < line.length; i++) {
+    cum.push(cum[i - 1] + distance(line[i - 1], line[i]));
+  }
+  return cum;
+}
+
+function splitLineAtPoints(line_wkt, pts_wkt, tolerance) {
+  tolerance = tolerance || 1e-6;
+  var line = parseLine(line_wkt);
+  var cum = cumulativeDistances(line);
+  var totalLength = cum[cum.length - 1];
+  var projections = [];
+
+  pts_wkt.forEach(function(ptWKT) {
+    var pt = parsePoint(ptWKT);
+    if (pt === null) return;
+    var bestProj = null;
+    var bestError = 1e9;
+    for (var i = 0; i < line.length - 1; i++) {
+      var a = line[i], b = line[i+1];
+      var segLen = distance(a, b);
+      if (segLen === 0) continue;
+
+      var t = ((pt.x - a.x) * (b.x - a.x) + (pt.y - a.y) * (b.y - a.y)) / (segLen * segLen);
+      t = Math.max(0, Math.min(1, t));
+      var proj = { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
+      var err = distance(pt, proj);
+      
+      if (err < bestError) {
+        bestError = err;
+        bestProj = cum[i] + t * segLen;
+      }
+    }
+    if (bestProj !== null) {
+      projections.push(bestProj);
+    }
+  });
+
+  projections.push(0);
+  projections.push(totalLength);
+  projections.sort((a, b) => a - b);
+
+  var unique = projections.filter((d, i) => i === 0 || Math.abs(d - projections[i - 1]) > tolerance);
+  var segments = [];
+  for (var i = 0; i < unique.length - 1; i++) {
+    var d_start = unique[i];
+    var d_end = unique[i+1];
+    var segPoints = [interpolatePoint(line, d_start)];
+
+    for (var j = 0; j < cum.length; j++) {
+      if (cum[j] > d_start && cum[j] < d_end) {
+        segPoints.push(line[j]);
+      }
+    }
+
+    segPoints.push(interpolatePoint(line, d_end));
+    segments.push({ segmentid: i, segment_wkt: lineWKT(segPoints) });
+  }
+
+  return segments;
+}
+
+return splitLineAtPoints(line_wkt, pts_wkt, tolerance);
+"""
+
+RUNNER = """
+const fs = require("fs");
+const input = JSON.parse(fs.readFileSync(process.argv[2], "utf8"));
+const current = new Function("line_geojson", "pts", "tolerance", input.current);
+const legacy = new Function("line_wkt", "pts_wkt", "tolerance", input.legacy);
+// arguments as passed by the SQL code of each implementation
+const currentArgs = input.lines.map(l => [
+  JSON.stringify({ type: "LineString", coordinates: l.line }),
+  l.points.map(c => ({ x: c[0], y: c[1] })),
+]);
+const legacyArgs = input.lines.map(l => [
+  "LINESTRING(" + l.line.map(c => c[0] + " " + c[1]).join(", ") + ")",
+  l.points.map(c => "POINT(" + c[0] + " " + c[1] + ")"),
+]);
+function measure(udf, args) {
+  const start = process.hrtime.bigint();
+  const results = args.map(a => udf(a[0], a[1], input.tolerance));
+  return [Number(process.hrtime.bigint() - start) / 1e6, results];
+}
+function toWKT(results) {
+  return results.map(segments => segments.map(s => ({
+    segmentid: s.segmentid,
+    segment_wkt: "LINESTRING(" + s.coords.map(p => p.x + " " + p.y).join(", ") + ")",
+  })));
+}
+// best of several alternating rounds, the first ones warming up the JIT compiler
+let currentTime = Infinity, legacyTime = Infinity, currentResults, legacyResults;
+for (let round = 0; round < input.repeat; round++) {
+  let time;
+  [time, currentResults] = measure(current, currentArgs);
+  currentTime = Math.min(currentTime, time);
+  [time, legacyResults] = measure(legacy, legacyArgs);
+  legacyTime = Math.min(legacyTime, time);
+}
+console.log(JSON.stringify({
+  current: currentTime,
+  legacy: legacyTime,
+  equal: JSON.stringify(toWKT(currentResults)) === JSON.stringify(legacyResults),
+  segments: currentResults.reduce((n, r) => n + r.length, 0),
+}));
+"""
+
+
+def _sql_string_value(literal):
+    """Value of the body of a BigQuery triple-quoted string."""
+    return re.sub(r"\\(.)", r"\1", literal)
+
+
+def current_udf():
+    with open(UDF_FILE, "r") as f:
+        return f.read()
+
+
+def synthetic_line(vertices, crossings, rng):
+    """A winding line (in degrees, like a highway) and points where other lines cross it."""
+    x, y, heading = rng.uniform(-10, 10), rng.uniform(-10, 10), rng.uniform(0, 2 * math.pi)
+    line = [(x, y)]
+    for _ in range(vertices - 1):
+        heading += rng.gauss(0, 0.3)
+        step = rng.uniform(0.0001, 0.001)
+        x, y = x + step * math.cos(heading), y + step * math.sin(heading)
+        line.append((x, y))
+    points = []
+    for _ in range(crossings):
+        i = rng.randrange(vertices - 1)
+        t = rng.random()
+        (ax, ay), (bx, by) = line[i], line[i + 1]
+        # intersections computed by the warehouse are not exactly on the line
+        points.append(
+            [
+                ax + t * (bx - ax) + rng.gauss(0, 1e-9),
+                ay + t * (by - ay) + rng.gauss(0, 1e-9),
+            ]
+        )
+    return {"line": line, "points": points}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", help="Number of lines", type=int, default=10)
+    parser.add_argument("--vertices", help="Vertices per line", type=int, default=5000)
+    parser.add_argument("--crossings", help="Crossing points per line", type=int, default=500)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-n", "--repeat", help="Runs per implementation", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lines = [synthetic_line(args.vertices, args.crossings, rng) for _ in range(args.lines)]
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        input_file = os.path.join(tmp_folder, "input.json")
+        runner_file = os.path.join(tmp_folder, "runner.js")
+        with open(input_file, "w") as f:
+            json.dump(
+                {
+                    "current": current_udf(),
+                    "legacy": _sql_string_value(LEGACY_UDF),
+                    "tolerance": args.tolerance,
+                    "repeat": args.repeat,
+                    "lines": lines,
+                },
+                f,
+            )
+        with open(runner_file, "w") as f:
+            f.write(RUNNER)
+        process = subprocess.run(
+            ["node", runner_file, input_file], stdout=subprocess.PIPE, check=True
+        )
+    result = json.loads(process.stdout)
+    print(
+        f"{args.lines} lines x {args.vertices} vertices, {args.crossings} crossings: "
+        f"{result['current']:.0f} ms (previous implementation {result['legacy']:.0f} ms, "
+        f"{result['legacy'] / result['current']:.1f}x), {result['segments']} segments"
+    )
+    if not result["equal"]:
+        print("The results of both implementations differ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
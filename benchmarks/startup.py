@@ -0,0 +1,124 @@
+"""Startup benchmark for the `carto_extension.py` script.
+
+Runs the `check` and `package` actions in fresh interpreters and reports the
+median wall time and the number of modules imported by the script (on top of
+the ones a bare interpreter imports). They run on a temporary copy of the
+extension, whose `extension.zip` is removed before each run, so `package`
+always builds the package instead of finding it up to date. It exits with a
+non-zero code if any of the optional limits is exceeded, so it can be used in
+a pre-commit hook:
+
+    $ python benchmarks/startup.py --max-seconds 0.5 --max-imports 150
+"""
+
+from statistics import median
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSION_FILES = ["carto_extension.py", "metadata.json", "components", "icons"]
+ACTIONS = ["check", "package"]
+
+
+def _copy_extension(folder):
+    """Copy the files the extension is built from to a folder."""
+    for name in EXTENSION_FILES:
+        source = os.path.join(ROOT_FOLDER, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(folder, name))
+        else:
+            shutil.copy2(source, folder)
+
+
+def _remove_package(folder):
+    try:
+        os.remove(os.path.join(folder, "extension.zip"))
+    except FileNotFoundError:
+        pass
+
+
+def _count_imports(command, folder=ROOT_FOLDER):
+    """Number of modules imported by a command, as reported by -X importtime."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        cwd=folder,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    lines = process.stderr.decode("utf-8").splitlines()
+    return len([line for line in lines if line.startswith("import time:")]) - 1
+
+
+def _wall_time(command, folder):
+    _remove_package(folder)
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable] + command,
+        cwd=folder,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def run(actions, repeat):
+    baseline_imports = _count_imports(["-c", "pass"])
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        _copy_extension(folder)
+        command = [os.path.join(folder, "carto_extension.py")]
+        for action in actions:
+            times = [_wall_time(command + [action], folder) for _ in range(repeat)]
+            _remove_package(folder)
+            results[action] = {
+                "seconds": median(times),
+                "imports": _count_imports(command + [action], folder) - baseline_imports,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "actions", nargs="*", help=f"Actions to benchmark ({', '.join(ACTIONS)})"
+    )
+    parser.add_argument(
+        "-n", "--repeat", help="Runs per action", type=int, default=5
+    )
+    parser.add_argument(
+        "--max-seconds", help="Fail if an action is slower than this", type=float
+    )
+    parser.add_argument(
+        "--max-imports",
+        help="Fail if an action imports more modules than this",
+        type=int,
+    )
+    args = parser.parse_args()
+    for action in args.actions:
+        if action not in ACTIONS:
+            parser.error(f"Action '{action}' can not be benchmarked")
+
+    results = run(args.actions or ACTIONS, args.repeat)
+    failed = False
+    for action, result in results.items():
+        print(
+            f"{action}: {result['seconds'] * 1000:.0f} ms, "
+            f"{result['imports']} imported modules"
+        )
+        if args.max_seconds is not None and result["seconds"] > args.max_seconds:
+            print(f"  '{action}' is slower than {args.max_seconds} s")
+            failed = True
+        if args.max_imports is not None and result["imports"] > args.max_imports:
+            print(f"  '{action}' imports more than {args.max_imports} modules")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Micro-benchmark for the `${variable}` substitution of `carto_extension.py`.
+
+Compares `substitute_vars` and `substitute_lines` with the previous
+implementation (one `str.replace` over the whole text per variable occurrence)
+on a large NDJSON input, substituted line by line as test tables are uploaded,
+and on a large SQL script, substituted at once as deploy scripts are:
+
+    $ python benchmarks/substitution.py --rows 200000
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from carto_extension import substitute_lines, substitute_vars  # noqa: E402
+
+VARIABLES = {
+    "BENCH_PROJECT": "my-project",
+    "BENCH_DATASET": "my_dataset",
+    "BENCH_LABEL": "benchmark",
+}
+
+
+def legacy_substitute_vars(text):
+    pattern = r"\${([a-zA-Z0-9_]+)}"
+    for variable in re.findall(pattern, text, re.MULTILINE):
+        env_var_value = os.getenv(variable)
+        if env_var_value is None:
+            raise ValueError(f"Environment variable {variable} is not set")
+        text = text.replace(f"${{{variable}}}", env_var_value)
+    return text
+
+
+def ndjson_lines(rows):
+    lines = []
+    for i in range(rows):
+        if i % 10 == 0:
+            lines.append(
+                f'{{"id": {i}, "label": "${{BENCH_LABEL}}", '
+                f'"geom": "LINESTRING({i} 0, {i} 1, {i + 1} 1)"}}\n'
+            )
+        else:
+            lines.append(
+                f'{{"id": {i}, "label": "static", '
+                f'"geom": "LINESTRING({i} 0, {i} 1, {i + 1} 1)"}}\n'
+            )
+    return lines
+
+
+def sql_script(statements):
+    return "".join(
+        f"INSERT INTO `${{BENCH_PROJECT}}.${{BENCH_DATASET}}.table_{i}` "
+        f"SELECT * FROM `${{BENCH_PROJECT}}.${{BENCH_DATASET}}.source` "
+        f"WHERE label = '${{BENCH_LABEL}}';\n"
+        for i in range(statements)
+    )
+
+
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", help="NDJSON rows", type=int, default=100000)
+    parser.add_argument("--statements", help="SQL statements", type=int, default=5000)
+    parser.add_argument("-n", "--repeat", help="Runs per case", type=int, default=3)
+    args = parser.parse_args()
+    os.environ.update(VARIABLES)
+
+    lines = ndjson_lines(args.rows)
+    sql = sql_script(args.statements)
+    assert list(substitute_lines(lines)) == [legacy_substitute_vars(l) for l in lines]
+    assert substitute_vars(sql) == legacy_substitute_vars(sql)
+
+    cases = [
+        (
+            f"NDJSON, {args.rows} lines",
+            lambda: [legacy_substitute_vars(line) for line in lines],
+            lambda: list(substitute_lines(lines)),
+        ),
+        (
+            f"SQL, {args.statements} statements",
+            lambda: legacy_substitute_vars(sql),
+            lambda: substitute_vars(sql),
+        ),
+    ]
+    for name, legacy, current in cases:
+        legacy_time = measure(legacy, args.repeat)
+        current_time = measure(current, args.repeat)
+        print(
+            f"{name}: {current_time * 1000:.1f} ms "
+            f"(previous implementation {legacy_time * 1000:.1f} ms, "
+            f"{legacy_time / current_time:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,101 @@
-from dotenv import load_dotenv, dotenv_values
-from google.cloud import bigquery
+# Warehouse drivers (google-cloud-bigquery, snowflake-connector-python),
+# shapely, python-dotenv and urllib.request are imported inside the functions
+# that use them, so that actions like `check` and `package` start without
+# loading them and the module can be imported by other tools.
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from sys import argv
 from textwrap import dedent, indent
 from uuid import uuid4
 import argparse
 import base64
-from shapely import wkt
+import copy
+import gzip
 import hashlib
+import importlib.util
 import json
+import math
 import os
+import random
 import re
-import snowflake.connector
+import tempfile
+import threading
+import time
 import zipfile
 import io
-import urllib.request
+import itertools
 
 WORKFLOWS_TEMP_SCHEMA = "WORKFLOWS_TEMP"
 EXTENSIONS_TABLENAME = "WORKFLOWS_EXTENSIONS"
 WORKFLOWS_TEMP_PLACEHOLDER = "@@workflows_temp@@"
+VARIABLE_PATTERN = re.compile(r"\$\{([a-zA-Z0-9_]+)\}")
+INLINE_SOURCE_PATTERN = re.compile(r"@@([\w-]+\.[\w.]+)@@")
+BUILD_CACHE_FOLDER = ".build_cache"
+BUILD_CACHE_VERSION = 4
+TEST_TABLE_FINGERPRINT_PREFIX = "carto_extension_fingerprint:"
+RESULTS_BATCH_SIZE = 10000
+FIXTURE_FORMATS = ["json", "ndjson.gz"]
+DEPLOY_SCRIPT_SIZE_LIMIT = 1024 * 1024  # query text limit of BigQuery and Snowflake
+PACKAGE_HASH_PREFIX = "carto_extension_source:"
+PACKAGE_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+WATCH_INTERVAL = 0.5  # seconds between checks for changes
+WATCH_DEBOUNCE = 0.3  # seconds without changes before rebuilding
+SCHEMA_SAMPLE_ROWS = 1000  # rows of the test tables used to infer their schema
+SCHEMA_CACHE_VERSION = 1
+BENCH_THRESHOLD = 1.5  # ratio to the baseline above which a benchmark regresses
+# warehouse statistics, which don't depend on the machine running the benchmarks
+BENCH_METRICS = ["bytes_processed", "slot_ms", "bytes_scanned", "execution_ms"]
+BENCH_TIMING_METRICS = ["seconds"]  # only compared with the baseline on request
+LOCAL_ENGINE_FILE = "local.py"  # Python implementation run by the local backend
+CLEAN_MIN_AGE = 24 * 3600  # seconds before clean removes the output of a test run
+WKT_PREFIX_PATTERN = re.compile(
+    r"\s*(SRID=\d+;\s*)?(POINT|LINESTRING|POLYGON|MULTIPOINT|MULTILINESTRING|"
+    r"MULTIPOLYGON|GEOMETRYCOLLECTION)\s*(ZM|Z|M)?\s*(\(|EMPTY)",
+    re.IGNORECASE,
+)
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}$")
+DATETIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$")
+TIMESTAMP_PATTERN = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?\s*(Z|UTC|[+-]\d{2}(:?\d{2})?)$"
+)
+SF_DATA_TYPES = {
+    "INT64": "NUMBER",
+    "FLOAT64": "FLOAT",
+    "BOOL": "BOOLEAN",
+    "STRING": "VARCHAR",
+    "DATE": "DATE",
+    "DATETIME": "TIMESTAMP_NTZ",
+    "TIMESTAMP": "TIMESTAMP_TZ",
+    "GEOGRAPHY": "GEOGRAPHY",
+}
+
+verbose = False
+
+sf_client_local = threading.local()
+instrumentation = None  # records of the warehouse calls, if they are instrumented
+instrumentation_start = None
+instrumentation_local = threading.local()
+bq_client_instance = None
+build_cache = None
+build_cache_modified = False
+encoded_images = {}
 
-load_dotenv()
 
-bq_workflows_temp = f"`{os.getenv('BQ_TEST_PROJECT')}.{os.getenv('BQ_TEST_DATASET')}`"
-sf_workflows_temp = f"{os.getenv('SF_TEST_DATABASE')}.{os.getenv('SF_TEST_SCHEMA')}"
+def bq_workflows_temp():
+    return f"`{os.getenv('BQ_TEST_PROJECT')}.{os.getenv('BQ_TEST_DATASET')}`"
 
-sf_client_instance = None
-bq_client_instance = None
+
+def sf_workflows_temp():
+    return f"{os.getenv('SF_TEST_DATABASE')}.{os.getenv('SF_TEST_SCHEMA')}"
 
 
 def bq_client():
     global bq_client_instance
     if bq_client_instance is None:
+        from google.cloud import bigquery
+
         try:
             bq_client_instance = bigquery.Client(project=os.getenv("BQ_TEST_PROJECT"))
         except Exception as e:
@@ -39,17 +104,23 @@ def bq_client():
 
 
 def sf_client():
-    global sf_client_instance
-    if sf_client_instance is None:
+    """Snowflake connection for the current thread.
+
+    Snowflake connections can not be shared between concurrent queries, so each
+    thread (e.g. each test worker) gets its own session.
+    """
+    if getattr(sf_client_local, "instance", None) is None:
+        import snowflake.connector
+
         try:
-            sf_client_instance = snowflake.connector.connect(
+            sf_client_local.instance = snowflake.connector.connect(
                 user=os.getenv("SF_USER"),
                 password=os.getenv("SF_PASSWORD"),
                 account=os.getenv("SF_ACCOUNT"),
             )
         except Exception as e:
             raise Exception(f"Error connecting to SnowFlake: {e}")
-    return sf_client_instance
+    return sf_client_local.instance
 
 
 def add_namespace_to_component_names(metadata):
@@ -58,69 +129,246 @@ def add_namespace_to_component_names(metadata):
     return metadata
 
 
+def _load_build_cache():
+    global build_cache
+    if build_cache is None:
+        current_folder = os.path.dirname(os.path.abspath(__file__))
+        manifest_file = os.path.join(current_folder, BUILD_CACHE_FOLDER, "manifest.json")
+        try:
+            with open(manifest_file, "r") as f:
+                build_cache = json.load(f)
+            if build_cache.get("version") != BUILD_CACHE_VERSION:
+                raise ValueError("Outdated build cache")
+        except (OSError, ValueError):
+            build_cache = {"version": BUILD_CACHE_VERSION, "entries": {}}
+    return build_cache
+
+
+def _save_build_cache():
+    global build_cache_modified
+    if not build_cache_modified:
+        return
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    cache_folder = os.path.join(current_folder, BUILD_CACHE_FOLDER)
+    manifest_file = os.path.join(cache_folder, "manifest.json")
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(build_cache, f)
+        os.replace(manifest_file + ".tmp", manifest_file)
+        build_cache_modified = False
+    except OSError as e:
+        if verbose:
+            print(f"Build cache could not be saved: {e}")
+
+
+def _cached(paths, build):
+    """Return the value built from a set of source files, using the build cache.
+
+    `build` receives the content (bytes) of each file in `paths`. Its result is
+    stored in the build cache manifest along with the size, modification time
+    and sha256 hash of the files. Files whose size and modification time have
+    not changed are not read again, and the value is only rebuilt when the
+    content of any of the files has changed.
+    """
+    global build_cache_modified
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    key = ";".join(os.path.relpath(path, current_folder) for path in paths)
+    entries = _load_build_cache()["entries"]
+    entry = entries.get(key)
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append([stat.st_size, stat.st_mtime_ns])
+    if entry is None or entry["stats"] != stats:
+        contents = []
+        for path in paths:
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+        if entry is None or entry["hashes"] != hashes:
+            entry = {"hashes": hashes, "value": build(contents)}
+        entry["stats"] = stats
+        entries[key] = entry
+        build_cache_modified = True
+    return copy.deepcopy(entry["value"])
+
+
+def _decode_source(content):
+    return content.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _minify_svg(content):
+    """Remove the comments, XML declaration and redundant whitespace of an SVG file."""
+    svg = content.decode("utf-8")
+    svg = re.sub(r"<!--.*?-->|<\?xml.*?\?>", "", svg, flags=re.DOTALL)
+    svg = re.sub(r">\s+<", "><", svg)
+    svg = re.sub(r"\s+", " ", svg)
+    return svg.strip().encode("utf-8")
+
+
 def _encode_image(image_path):
+    """Data URI of an icon, with SVG files minified before encoding.
+
+    Each icon is encoded once per run, even if several files have the same
+    content, and only encoded again in later runs (through the build cache)
+    when the hash of its content changes.
+    """
     if not os.path.exists(image_path):
         raise FileNotFoundError(
             f"Icon file '{os.path.basename(image_path)}' not found in icons folder"
         )
+    is_svg = image_path.endswith(".svg")
     with open(image_path, "rb") as f:
-        if image_path.endswith(".svg"):
-            return f"data:image/svg+xml;base64,{base64.b64encode(f.read()).decode('utf-8')}"
+        key = (is_svg, hashlib.sha256(f.read()).hexdigest())
+    if key in encoded_images:
+        return encoded_images[key]
+
+    def build(contents):
+        if is_svg:
+            return f"data:image/svg+xml;base64,{base64.b64encode(_minify_svg(contents[0])).decode('utf-8')}"
         else:
-            return f"data:image/png;base64,{base64.b64encode(f.read()).decode('utf-8')}"
+            return f"data:image/png;base64,{base64.b64encode(contents[0]).decode('utf-8')}"
+
+    encoded_images[key] = _cached([image_path], build)
+    return encoded_images[key]
+
+
+def _component_files(component_name, provider):
+    """Files a component is built from for a provider.
+
+    These are its metadata, its `fullrun.sql` and `dryrun.sql` code and the
+    other (non hidden) files next to them, which the code can inline. The code
+    is taken from the `src/<provider>` folder of the component if it has one, or
+    else from `src`. The code of a `src/<provider>` folder can also inline the
+    files of `src`, after which the files of its own folder are listed.
+    """
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    component_folder = os.path.join(current_folder, "components", component_name)
+    source_folders = [os.path.join(component_folder, "src")]
+    if os.path.isfile(os.path.join(source_folders[0], provider, "fullrun.sql")):
+        source_folders.append(os.path.join(source_folders[0], provider))
+    source_folder = source_folders[-1]
+    other_files = [
+        os.path.join(folder, filename)
+        for folder in source_folders
+        for filename in sorted(os.listdir(folder))
+        if filename not in ["fullrun.sql", "dryrun.sql"]
+        and not filename.startswith(".")
+        and os.path.isfile(os.path.join(folder, filename))
+    ]
+    return [
+        os.path.join(component_folder, "metadata.json"),
+        os.path.join(source_folder, "fullrun.sql"),
+        os.path.join(source_folder, "dryrun.sql"),
+    ] + other_files
+
+
+def _sql_string_literal(text):
+    """Single-quoted, single-line SQL string literal (valid in BigQuery and Snowflake)."""
+    text = text.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n")
+    return f"'{text}'"
+
+
+def _inline_sources(code, sources):
+    """Replace the `@@<file name>@@` placeholders of the code of a component with
+    the content of those files, as a SQL string literal (e.g. the code of a
+    UDF)."""
+
+    def replace(match):
+        if match.group(1) not in sources:
+            raise FileNotFoundError(
+                f"File '{match.group(1)}' inlined in the component code not found"
+            )
+        return _sql_string_literal(_decode_source(sources[match.group(1)]))
+
+    return INLINE_SOURCE_PATTERN.sub(replace, code)
+
+
+def load_component(component_name, provider):
+    """Load the metadata and the code of a component for a provider.
+
+    Returns a dict with the parsed `metadata` and the `fullrun` and `dryrun`
+    code. The files are read once and the result is kept in the build cache
+    until any of them changes.
+    """
+    paths = _component_files(component_name, provider)
+
+    def build(contents):
+        metadata_content, fullrun_content, dryrun_content = contents[:3]
+        # files of a provider folder take precedence over those of `src`
+        sources = {
+            os.path.basename(path): content
+            for path, content in zip(paths[3:], contents[3:])
+        }
+        metadata = json.loads(metadata_content)
+        fullrun_code = _inline_sources(_decode_source(fullrun_content), sources)
+        dryrun_code = _inline_sources(_decode_source(dryrun_content), sources)
+        return {"metadata": metadata, "fullrun": fullrun_code, "dryrun": dryrun_code}
+
+    return _cached(paths, build)
 
 
 def create_metadata():
     current_folder = os.path.dirname(os.path.abspath(__file__))
     metadata_file = os.path.join(current_folder, "metadata.json")
-    with open(metadata_file, "r") as f:
-        metadata = json.load(f)
+    metadata = _cached([metadata_file], lambda contents: json.loads(contents[0]))
     components = []
-    components_folder = os.path.join(current_folder, "components")
     icon_folder = os.path.join(current_folder, "icons")
     icon_filename = metadata.get("icon")
     if icon_filename:
         icon_full_path = os.path.join(icon_folder, icon_filename)
         metadata["icon"] = _encode_image(icon_full_path)
     for component in metadata["components"]:
-        metadata_file = os.path.join(components_folder, component, "metadata.json")
-        with open(metadata_file, "r") as f:
-            component_metadata = json.load(f)
-            component_metadata["group"] = metadata["title"]
-            component_metadata["cartoEnvVars"] = component_metadata.get(
-                "cartoEnvVars", []
-            )
-            components.append(component_metadata)
+        component_source = load_component(component, metadata["provider"])
+        component_metadata = component_source["metadata"]
+        component_metadata["group"] = metadata["title"]
+        component_metadata["cartoEnvVars"] = component_metadata.get(
+            "cartoEnvVars", []
+        )
+        components.append(component_metadata)
 
-        fullrun_file = os.path.join(components_folder, component, "src", "fullrun.sql")
-        with open(fullrun_file, "r") as f:
-            fullrun_code = f.read()
-        code_hash = (
-            int(hashlib.sha256(fullrun_code.encode("utf-8")).hexdigest(), 16) % 10**8
+        component_metadata["procedureName"] = _procedure_name_with_hash(
+            component_metadata, metadata["provider"]
         )
-        component_metadata["procedureName"] = f"__proc_{component}_{code_hash}"
         icon_filename = component_metadata.get("icon")
         if icon_filename:
             icon_full_path = os.path.join(icon_folder, icon_filename)
             component_metadata["icon"] = _encode_image(icon_full_path)
 
     metadata["components"] = components
+    _save_build_cache()
     return metadata
 
 
-def get_procedure_code_bq(component):
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
-    fullrun_file = os.path.join(
-        components_folder, component["name"], "src", "fullrun.sql"
+def _procedure_name_with_hash(component, provider):
+    """Name of the procedure of a component, with a hash of its code.
+
+    The hash is computed on the generated procedure, with the variables
+    substituted as in a deployment, so that it changes with anything the
+    procedure is made of: the component code and signature, the procedure
+    template and the values of the variables. Variables that are not set (e.g.
+    when packaging) are hashed as they are written.
+    """
+    if provider == "bigquery":
+        get_procedure_code = get_procedure_code_bq
+    else:
+        get_procedure_code = get_procedure_code_sf
+    procedure_code = get_procedure_code(
+        dict(component, procedureName=f"__proc_{component['name']}")
     )
-    with open(fullrun_file, "r") as f:
-        fullrun_code = f.read().replace("\n", "\n" + " " * 16)
-    dryrun_file = os.path.join(
-        components_folder, component["name"], "src", "dryrun.sql"
+    template = Template(procedure_code)
+    procedure_code = template.render(
+        {name: os.getenv(name, f"${{{name}}}") for name in template.variables}
     )
-    with open(dryrun_file, "r") as f:
-        dryrun_code = f.read().replace("\n", "\n" + " " * 16)
+    code_hash = int(hashlib.sha256(procedure_code.encode("utf-8")).hexdigest(), 16) % 10**8
+    return f"__proc_{component['name']}_{code_hash}"
+
+
+def get_procedure_code_bq(component):
+    component_source = load_component(component["name"], "bigquery")
+    fullrun_code = component_source["fullrun"].replace("\n", "\n" + " " * 16)
+    dryrun_code = component_source["dryrun"].replace("\n", "\n" + " " * 16)
 
     newline_and_tab = ",\n" + " " * 12
     params_string = newline_and_tab.join(
@@ -163,12 +411,68 @@ def get_procedure_code_bq(component):
     return procedure_code
 
 
-def create_sql_code_bq(metadata):
+def _procedure_name(procedure):
+    """Name of a procedure listed in the `procedures` column of the extensions
+    table. Snowflake entries also include the parameter types."""
+    return procedure.split("(")[0]
+
+
+def _diff_procedures(procedures, installed_procedures):
+    """Compare the procedures of an extension with the installed ones.
+
+    Returns the procedures that have to be created and the installed ones that
+    are stale and have to be removed. Since procedure names contain the hash of
+    the component code, unchanged components keep their installed procedure.
+    """
+    names = {_procedure_name(p) for p in procedures}
+    installed_names = {_procedure_name(p) for p in installed_procedures}
+    to_create = [p for p in procedures if _procedure_name(p) not in installed_names]
+    to_remove = [p for p in installed_procedures if _procedure_name(p) not in names]
+    return to_create, to_remove
+
+
+def create_sql_code_bq(metadata, installed_procedures=None):
+    """Create the BigQuery script that installs the extension.
+
+    By default all the procedures from previous installations are dropped and
+    created again. If `installed_procedures` is given, only the stale ones are
+    dropped and only the ones that are not installed yet are created.
+    """
+    procedures = [c["procedureName"] for c in metadata["components"]]
+    if installed_procedures is None:
+        components = metadata["components"]
+        remove_code = dedent(
+            f"""\
+            SET procedures = (
+                SELECT procedures
+                FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
+                WHERE name = '{metadata["name"]}'
+            );
+            IF (procedures IS NOT NULL) THEN
+                SET proceduresArray = SPLIT(procedures, ',');
+                LOOP
+                    SET i = i + 1;
+                    IF i > ARRAY_LENGTH(proceduresArray) THEN
+                        LEAVE;
+                    END IF;
+                    EXECUTE IMMEDIATE 'DROP PROCEDURE {WORKFLOWS_TEMP_PLACEHOLDER}.' || proceduresArray[ORDINAL(i)];
+                END LOOP;
+            END IF;"""
+        )
+    else:
+        to_create, to_remove = _diff_procedures(procedures, installed_procedures)
+        components = [c for c in metadata["components"] if c["procedureName"] in to_create]
+        remove_code = "\n".join(
+            [
+                f"DROP PROCEDURE IF EXISTS {WORKFLOWS_TEMP_PLACEHOLDER}.`{p}`;"
+                for p in to_remove
+            ]
+        )
+    remove_code = indent(remove_code, " " * 8).lstrip()
     procedures_code = ""
-    for component in metadata["components"]:
+    for component in components:
         procedure_code = get_procedure_code_bq(component)
         procedures_code += "\n" + procedure_code
-    procedures = [c["procedureName"] for c in metadata["components"]]
     metadata_string = json.dumps(metadata).replace("\\n", "\\\\n")
     code = dedent(
         f"""\
@@ -184,21 +488,7 @@ def create_sql_code_bq(metadata):
 
         -- remove procedures from previous installations
 
-        SET procedures = (
-            SELECT procedures
-            FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
-            WHERE name = '{metadata["name"]}'
-        );
-        IF (procedures IS NOT NULL) THEN
-            SET proceduresArray = SPLIT(procedures, ',');
-            LOOP
-                SET i = i + 1;
-                IF i > ARRAY_LENGTH(proceduresArray) THEN
-                    LEAVE;
-                END IF;
-                EXECUTE IMMEDIATE 'DROP PROCEDURE {WORKFLOWS_TEMP_PLACEHOLDER}.' || proceduresArray[ORDINAL(i)];
-            END LOOP;
-        END IF;
+        {remove_code}
 
         DELETE FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
         WHERE name = '{metadata["name"]}';
@@ -215,26 +505,22 @@ def create_sql_code_bq(metadata):
     return dedent(code)
 
 
+def _procedure_params_sf(component):
+    """Names and Snowflake types of the parameters of the procedure of a component."""
+    return [
+        (p["name"], _param_type_to_sf_type(p["type"])[0])
+        for p in component["inputs"] + component["outputs"]
+    ] + [("dry_run", "BOOLEAN"), ("env_vars", "VARCHAR")]
+
+
 def get_procedure_code_sf(component):
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
-    fullrun_file = os.path.join(
-        components_folder, component["name"], "src", "fullrun.sql"
-    )
-    with open(fullrun_file, "r") as f:
-        fullrun_code = f.read().replace("\n", "\n" + " " * 16)
-    dryrun_file = os.path.join(
-        components_folder, component["name"], "src", "dryrun.sql"
-    )
-    with open(dryrun_file, "r") as f:
-        dryrun_code = f.read().replace("\n", "\n" + " " * 16)
+    component_source = load_component(component["name"], "snowflake")
+    fullrun_code = component_source["fullrun"].replace("\n", "\n" + " " * 16)
+    dryrun_code = component_source["dryrun"].replace("\n", "\n" + " " * 16)
 
     newline_and_tab = ",\n" + " " * 12
     params_string = newline_and_tab.join(
-        [
-            f"{p['name']} {_param_type_to_sf_type(p['type'])[0]}"
-            for p in component["inputs"] + component["outputs"]
-        ]
+        [f"{name} {sql_type}" for name, sql_type in _procedure_params_sf(component)]
     )
 
     carto_env_vars = component["cartoEnvVars"] if "cartoEnvVars" in component else []
@@ -247,9 +533,7 @@ def get_procedure_code_sf(component):
     procedure_code = dedent(
         f"""\
         CREATE OR REPLACE PROCEDURE {WORKFLOWS_TEMP_PLACEHOLDER}.{component["procedureName"]}(
-            {params_string},
-            dry_run BOOLEAN,
-            env_vars VARCHAR
+            {params_string}
         )
         RETURNS VARCHAR
         LANGUAGE SQL
@@ -277,15 +561,89 @@ def get_procedure_code_sf(component):
     return procedure_code
 
 
-def create_sql_code_sf(metadata):
-    procedures_code = ""
-    for component in metadata["components"]:
-        procedure_code = get_procedure_code_sf(component)
-        procedures_code += "\n" + procedure_code
+def _drop_procedure_code_sf(procedure):
+    """Snowflake code that drops a procedure listed in the extensions table.
+
+    `procedure` is a SQL expression with the entry of the procedure: its name
+    and the SQL types of its parameters. Entries written by older versions
+    list the parameter types of the component instead (e.g.
+    `__proc_name(Table,Number)`), which can't be used to drop it, so the
+    parameter types of the procedure with that name are looked up instead.
+    """
+    return dedent(
+        f"""\
+        BEGIN
+            LET procedure_entry VARCHAR := {procedure};
+            LET parameter_types VARCHAR := SPLIT_PART(procedure_entry, '(', 2);
+            IF (parameter_types = ')' OR parameter_types <> UPPER(parameter_types)) THEN
+                LET procedure_name VARCHAR := SPLIT_PART(procedure_entry, '(', 1);
+                LET shown RESULTSET := (
+                    EXECUTE IMMEDIATE 'SHOW PROCEDURES LIKE ''' || procedure_name
+                        || ''' IN SCHEMA {WORKFLOWS_TEMP_PLACEHOLDER}'
+                );
+                LET shown_cursor CURSOR FOR shown;
+                FOR shown_procedure IN shown_cursor DO
+                    IF (UPPER(shown_procedure."name") = UPPER(procedure_name)) THEN
+                        -- e.g. `__PROC_NAME(VARCHAR, FLOAT) RETURN VARCHAR`
+                        procedure_entry := SPLIT_PART(shown_procedure."arguments", ' RETURN ', 1);
+                    END IF;
+                END FOR;
+            END IF;
+            EXECUTE IMMEDIATE 'DROP PROCEDURE IF EXISTS {WORKFLOWS_TEMP_PLACEHOLDER}.' || procedure_entry;
+        EXCEPTION
+            WHEN OTHER THEN
+                NULL;
+        END;"""
+    )
+
+
+def create_sql_code_sf(metadata, installed_procedures=None):
+    """Create the Snowflake script that installs the extension.
+
+    By default all the procedures from previous installations are dropped and
+    created again. If `installed_procedures` is given, only the stale ones are
+    dropped and only the ones that are not installed yet are created.
+    """
+    # with the types of their arguments, as needed to drop them
     procedures = []
     for c in metadata["components"]:
-        param_types = [f"{p['type']}" for p in c["inputs"]]
+        param_types = [sql_type for _, sql_type in _procedure_params_sf(c)]
         procedures.append(f"{c['procedureName']}({','.join(param_types)})")
+    if installed_procedures is None:
+        components = metadata["components"]
+        remove_code = "\n".join(
+            [
+                dedent(
+                    f"""\
+                    procedures := (
+                        SELECT procedures
+                        FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
+                        WHERE name = '{metadata["name"]}'
+                    );
+                    LET installed RESULTSET := (
+                        SELECT value::STRING AS procedure_entry
+                        FROM TABLE(FLATTEN(input => SPLIT(:procedures, ';')))
+                    );
+                    LET installed_cursor CURSOR FOR installed;
+                    FOR installed_procedure IN installed_cursor DO"""
+                ),
+                indent(_drop_procedure_code_sf("installed_procedure.procedure_entry"), " " * 4),
+                "END FOR;",
+            ]
+        )
+    else:
+        to_create, to_remove = _diff_procedures(procedures, installed_procedures)
+        components = [
+            c
+            for c, p in zip(metadata["components"], procedures)
+            if p in to_create
+        ]
+        remove_code = "\n".join([_drop_procedure_code_sf(f"'{p}'") for p in to_remove])
+    remove_code = indent(remove_code, " " * 12).lstrip()
+    procedures_code = ""
+    for component in components:
+        procedure_code = get_procedure_code_sf(component)
+        procedures_code += "\n" + procedure_code
     metadata_string = json.dumps(metadata).replace("\\n", "\\\\n")
     code = dedent(
         f"""DECLARE
@@ -299,19 +657,7 @@ def create_sql_code_sf(metadata):
 
             -- remove procedures from previous installations
 
-            procedures := (
-                SELECT procedures
-                FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
-                WHERE name = '{metadata["name"]}'
-            );
-
-            BEGIN
-                EXECUTE IMMEDIATE 'DROP PROCEDURE IF EXISTS {WORKFLOWS_TEMP_PLACEHOLDER}.'
-                    || REPLACE(:procedures, ';', ';DROP PROCEDURE IF EXISTS {WORKFLOWS_TEMP_PLACEHOLDER}.');
-            EXCEPTION
-                WHEN OTHER THEN
-                    NULL;
-            END;
+            {remove_code}
 
             DELETE FROM {WORKFLOWS_TEMP_PLACEHOLDER}.{EXTENSIONS_TABLENAME}
             WHERE name = '{metadata["name"]}';
@@ -329,120 +675,475 @@ def create_sql_code_sf(metadata):
     return code
 
 
-def deploy_bq(metadata, destination):
+def _installed_procedures_bq(metadata, destination):
+    from google.api_core.exceptions import NotFound
+
+    query = f"""SELECT procedures FROM {destination}.{EXTENSIONS_TABLENAME}
+        WHERE name = '{metadata["name"]}'"""
+    try:
+        rows = list(bq_client().query(query).result())
+    except NotFound:
+        return []
+    if not rows or not rows[0]["procedures"]:
+        return []
+    return rows[0]["procedures"].split(",")
+
+
+def _installed_procedures_sf(metadata, destination):
+    from snowflake.connector.errors import ProgrammingError
+
+    query = f"""SELECT procedures FROM {destination}.{EXTENSIONS_TABLENAME}
+        WHERE name = '{metadata["name"]}'"""
+    cur = sf_client().cursor()
+    try:
+        cur.execute(query)
+        row = cur.fetchone()
+    except ProgrammingError:
+        return []
+    finally:
+        cur.close()
+    if not row or not row[0]:
+        return []
+    return row[0].split(";")
+
+
+def _print_procedures_diff(procedures, installed_procedures):
+    to_create, to_remove = _diff_procedures(procedures, installed_procedures)
+    print(
+        f"Procedures to create: {len(to_create)}, to remove: {len(to_remove)}, "
+        f"unchanged: {len(procedures) - len(to_create)}."
+    )
+
+
+def _print_script_size(sql_code, metadata, get_procedure_code):
+    """Print the size of a deploy script and of its parts.
+
+    Warns if it exceeds the maximum size of a query in the data warehouse.
+    """
+    size = len(sql_code.encode("utf-8"))
+    icons = [metadata.get("icon")] + [c.get("icon") for c in metadata["components"]]
+    icons_size = sum(len(icon) for icon in icons if icon)
+    metadata_size = len(json.dumps(metadata))
+    print(
+        f"Deploy script size: {size / 1024:.1f} KiB (metadata {metadata_size / 1024:.1f} KiB, "
+        f"of which icons {icons_size / 1024:.1f} KiB)."
+    )
+    if verbose:
+        for component in metadata["components"]:
+            procedure_size = len(get_procedure_code(component).encode("utf-8"))
+            print(f"  Procedure {component['name']}: {procedure_size / 1024:.1f} KiB")
+    if size > DEPLOY_SCRIPT_SIZE_LIMIT:
+        print(
+            f"Warning: the deploy script is larger than the "
+            f"{DEPLOY_SCRIPT_SIZE_LIMIT // 1024} KiB query size limit."
+        )
+
+
+def deploy_bq(metadata, destination, incremental=False):
     print("Deploying extension to BigQuery...")
-    destination = f"`{destination}`" if destination else bq_workflows_temp
-    sql_code = create_sql_code_bq(metadata)
+    destination = f"`{destination}`" if destination else bq_workflows_temp()
+    installed_procedures = None
+    if incremental:
+        installed_procedures = _installed_procedures_bq(metadata, destination)
+        _print_procedures_diff(
+            [c["procedureName"] for c in metadata["components"]], installed_procedures
+        )
+    sql_code = create_sql_code_bq(metadata, installed_procedures)
     sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
     sql_code = substitute_vars(sql_code)
     if verbose:
         print(sql_code)
-    query_job = bq_client().query(sql_code)
-    query_job.result()
+    _print_script_size(sql_code, metadata, get_procedure_code_bq)
+    with _instrument("deploy", destination=destination):
+        query_job = bq_client().query(sql_code)
+        query_job.result()
+        _record_job_bq(query_job)
     print("Extension correctly deployed to BigQuery.")
 
 
-def deploy_sf(metadata, destination):
+def deploy_sf(metadata, destination, incremental=False):
     print("Deploying extension to SnowFlake...")
-    destination = destination or sf_workflows_temp
-    sql_code = create_sql_code_sf(metadata)
+    destination = destination or sf_workflows_temp()
+    installed_procedures = None
+    if incremental:
+        installed_procedures = _installed_procedures_sf(metadata, destination)
+        _print_procedures_diff(
+            [c["procedureName"] for c in metadata["components"]], installed_procedures
+        )
+    sql_code = create_sql_code_sf(metadata, installed_procedures)
     sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
     sql_code = substitute_vars(sql_code)
 
     if verbose:
         print(sql_code)
-    cur = sf_client().cursor()
-    cur.execute(sql_code)
+    _print_script_size(sql_code, metadata, get_procedure_code_sf)
+    with _instrument("deploy", destination=destination):
+        cur = sf_client().cursor()
+        cur.execute(sql_code)
+        _record_query_sf(cur)
     print("Extension correctly deployed to SnowFlake.")
 
 
-def deploy(destination):
+def deploy(destination, incremental=False):
     metadata = create_metadata()
     if metadata["provider"] == "bigquery":
-        deploy_bq(metadata, destination)
+        deploy_bq(metadata, destination, incremental)
     else:
-        deploy_sf(metadata, destination)
+        deploy_sf(metadata, destination, incremental)
+
+
+class VariableLookup(dict):
+    """Values of the variables used in templates, read from the environment.
+
+    Each variable is looked up only once; missing variables are stored as None.
+    """
+
+    def __missing__(self, name):
+        value = os.getenv(name)
+        self[name] = value
+        return value
+
+
+def _variable_value(lookup, name):
+    """Value of a variable, or None if it is missing from the lookup (which can
+    be a plain dict)."""
+    try:
+        return lookup[name]
+    except KeyError:
+        return None
+
+
+def _missing_variables_error(names):
+    names = sorted(names)
+    if len(names) == 1:
+        return ValueError(f"Environment variable {names[0]} is not set")
+    return ValueError(f"Environment variables {', '.join(names)} are not set")
+
 
+class Template:
+    """Text with `${variable_name}` placeholders.
 
-def substitute_vars(text) -> str:
+    The text is split into literal parts and variable names once, so it can be
+    rendered several times with a single pass over its parts.
+    """
+
+    def __init__(self, text):
+        self.parts = VARIABLE_PATTERN.split(text)
+        self.variables = set(self.parts[1::2])
+
+    def render(self, lookup=None):
+        """Return the text with the variables replaced by their values.
+
+        Raises a ValueError listing all the variables without a value.
+        """
+        if not self.variables:
+            return self.parts[0]
+        lookup = VariableLookup() if lookup is None else lookup
+        values = {name: _variable_value(lookup, name) for name in self.variables}
+        missing = [name for name, value in values.items() if value is None]
+        if missing:
+            raise _missing_variables_error(missing)
+        parts = list(self.parts)
+        parts[1::2] = [values[name] for name in parts[1::2]]
+        return "".join(parts)
+
+
+@lru_cache(maxsize=64)
+def _template(text):
+    """Parsed template of a text, kept for the texts substituted repeatedly."""
+    return Template(text)
+
+
+def substitute_vars(text, lookup=None) -> str:
     """Substitute all variables in a string with their values from the environment.
 
     For a given string, all the variables using the syntax `${variable_name}`
     will be interpolated with their values from the corresponding env vars. It will
-    raise a ValueError if any variable name is not present in the environment.
+    raise a ValueError listing the variable names that are not present in the
+    environment.
+    """
+    if "${" not in text:
+        return text
+    return _template(text).render(lookup)
+
+
+def substitute_lines(lines, lookup=None):
+    """Substitute all variables in a stream of lines, see `substitute_vars`.
+
+    Variable values are looked up once for the whole stream. Missing variables
+    are collected while the stream is consumed and reported together at the end.
     """
-    pattern = r"\${([a-zA-Z0-9_]+)}"
+    lookup = VariableLookup() if lookup is None else lookup
+    missing = set()
+
+    def replace(match):
+        value = _variable_value(lookup, match.group(1))
+        if value is None:
+            missing.add(match.group(1))
+            return match.group(0)
+        return value
 
-    for variable in re.findall(pattern, text, re.MULTILINE):
-        env_var_value = os.getenv(variable)
-        if env_var_value is None:
-            raise ValueError(f"Environment variable {variable} is not set")
-        text = text.replace(f"${{{variable}}}", env_var_value)
+    for line in lines:
+        if "${" in line:
+            line = VARIABLE_PATTERN.sub(replace, line)
+        yield line
+    if missing:
+        raise _missing_variables_error(missing)
 
-    return text
 
+def _value_type(value):
+    """Data type of a JSON value, or None for nulls. Objects give a dict of field types.
 
-def _data_type_from_value(value):
-    if isinstance(value, int):
+    Strings are only reported as GEOGRAPHY if they start like a WKT geometry;
+    `_infer_schema` then checks that they can actually be parsed.
+    """
+    if value is None:
+        return None
+    elif isinstance(value, bool):
+        return "BOOL"
+    elif isinstance(value, int):
         return "INT64"
     elif isinstance(value, float):
         return "FLOAT64"
+    elif isinstance(value, dict):
+        return {key: _value_type(sub_value) for key, sub_value in value.items()}
     elif isinstance(value, str):
-        if value.endswith("date"):
+        if WKT_PREFIX_PATTERN.match(value):
+            return "GEOGRAPHY"
+        elif DATE_PATTERN.match(value):
             return "DATE"
-        elif value.endswith("timestamp"):
-            return "TIMESTAMP"
-        elif value.endswith("datetime"):
+        elif DATETIME_PATTERN.match(value):
             return "DATETIME"
-        else:
+        elif TIMESTAMP_PATTERN.match(value):
+            return "TIMESTAMP"
+    return "STRING"
+
+
+def _widen_type(data_type, other_type):
+    """Narrowest data type that can hold the values of two data types."""
+    if data_type is None or data_type == other_type:
+        return other_type
+    elif other_type is None:
+        return data_type
+    elif isinstance(data_type, dict) and isinstance(other_type, dict):
+        keys = list(data_type) + [key for key in other_type if key not in data_type]
+        return {
+            key: _widen_type(data_type.get(key), other_type.get(key)) for key in keys
+        }
+    elif isinstance(data_type, dict) or isinstance(other_type, dict):
+        return "STRING"
+    elif {data_type, other_type} == {"INT64", "FLOAT64"}:
+        return "FLOAT64"
+    elif {data_type, other_type} == {"DATE", "DATETIME"}:
+        return "DATETIME"
+    return "STRING"
+
+
+def _check_geographies(schema, rows):
+    """Replace GEOGRAPHY by STRING for the fields whose first value is not valid WKT."""
+    from shapely import wkt
+
+    for key, data_type in schema.items():
+        if isinstance(data_type, dict):
+            _check_geographies(
+                data_type, [row[key] for row in rows if isinstance(row.get(key), dict)]
+            )
+        elif data_type == "GEOGRAPHY":
+            value = next(row[key] for row in rows if row.get(key) is not None)
             try:
                 wkt.loads(value)
-                return "GEOGRAPHY"
             except Exception:
-                return "STRING"
-    return "STRING"
+                schema[key] = "STRING"
+
+
+def _default_types(schema):
+    """Use STRING for the fields that only had null values in the sample."""
+    return {
+        key: _default_types(data_type)
+        if isinstance(data_type, dict)
+        else data_type or "STRING"
+        for key, data_type in schema.items()
+    }
+
+
+def _file_hash(filename):
+    file_hash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(partial(f.read, 1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _sample_schema(filename, sample_rows):
+    rows = []
+    with open(filename, "r") as f:
+        for line in substitute_lines(f):
+            if line.strip():
+                rows.append(json.loads(line))
+                if len(rows) >= sample_rows:
+                    break
+    if not rows:
+        raise ValueError(f"Test table '{os.path.basename(filename)}' is empty")
+    schema = {}
+    for row in rows:
+        schema = _widen_type(schema, _value_type(row))
+    _check_geographies(schema, rows)
+    return _default_types(schema)
+
+
+def _infer_schema(filename, sample_rows=SCHEMA_SAMPLE_ROWS):
+    """Infer the column types of an NDJSON test table from its first rows.
+
+    Types use the BigQuery names (records are dicts of field types) and are
+    widened across the `sample_rows` first rows (after substituting
+    variables), so columns that are null or integer in the first row are
+    typed from the rest of the sample. Only the strings that start like a WKT
+    geometry are parsed, and only the first one of each column.
+
+    The schema is cached in a `.inferred_schema.json` file next to the table,
+    and inferred again only when the content of the table changes.
+    """
+    cache_filename = filename.replace(".ndjson", ".inferred_schema.json")
+    stat = os.stat(filename)
+    stats = [stat.st_size, stat.st_mtime_ns]
+    content_hash = None
+    schema = None
+    try:
+        with open(cache_filename, "r") as f:
+            cache = json.load(f)
+        if cache["version"] == SCHEMA_CACHE_VERSION and cache["sample_rows"] == sample_rows:
+            if cache["stats"] == stats:
+                return cache["schema"]
+            content_hash = _file_hash(filename)
+            if cache["hash"] == content_hash:
+                schema = cache["schema"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if schema is None:
+        schema = _sample_schema(filename, sample_rows)
+    cache = {
+        "version": SCHEMA_CACHE_VERSION,
+        "sample_rows": sample_rows,
+        "stats": stats,
+        "hash": content_hash or _file_hash(filename),
+        "schema": schema,
+    }
+    try:
+        with open(cache_filename, "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        if verbose:
+            print(f"Inferred schema could not be cached: {e}")
+    return schema
+
+
+def _bq_schema(schema):
+    """BigQuery schema fields for an inferred schema."""
+    from google.cloud import bigquery
+
+    return [
+        bigquery.SchemaField(key, "RECORD", fields=_bq_schema(data_type))
+        if isinstance(data_type, dict)
+        else bigquery.SchemaField(key, data_type)
+        for key, data_type in schema.items()
+    ]
+
+
+def _sf_data_type(data_type):
+    """Snowflake data type for an inferred data type."""
+    if isinstance(data_type, dict):
+        return "OBJECT"
+    return SF_DATA_TYPES[data_type]
+
+
+class _SubstitutedFile(io.RawIOBase):
+    """Binary stream with the content of a text file after substituting variables.
+
+    The file is read and substituted line by line as the stream is consumed, so
+    only the requested amount of data is kept in memory.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, "r", encoding="utf-8")
+        self._lines = substitute_lines(self._file)
+        self._buffer = bytearray()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer.extend(line.encode("utf-8"))
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        self._position += size
+        return size
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _test_table_id(component, filename):
+    return f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
+
+
+def _test_table_fingerprint(filename, schema):
+    """Hash of the content of a test table (after substituting variables) and its schema.
+
+    It is stored in the description or comment of the uploaded table, so that the
+    upload can be skipped when the table is already up to date.
+    """
+    fingerprint = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8"))
+    with _SubstitutedFile(filename) as f:
+        for chunk in iter(partial(f.read, 1024 * 1024), b""):
+            fingerprint.update(chunk)
+    return f"{TEST_TABLE_FINGERPRINT_PREFIX}{fingerprint.hexdigest()}"
 
 
-def _upload_test_table_bq(filename, component):
-    schema = []
-    with open(filename) as f:
-        data = [json.loads(l) for l in f.readlines()]
+def _upload_test_table_bq(filename, component, force=False):
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
+
     if os.path.exists(filename.replace(".ndjson", ".schema")):
         with open(filename.replace(".ndjson", ".schema")) as f:
             jsonschema = json.load(f)
-            for key, value in jsonschema.items():
-                schema.append(bigquery.SchemaField(key, value))
+        schema = [bigquery.SchemaField(key, value) for key, value in jsonschema.items()]
     else:
-        for key, value in data[0].items():
-            if isinstance(value, dict):
-                sub_schema = []
-                for sub_key, sub_value in value.items():
-                    data_type = _data_type_from_value(sub_value)
-                    sub_schema.append(bigquery.SchemaField(sub_key, data_type))
-                
-                schema.append(bigquery.SchemaField(key, "RECORD", fields=sub_schema))
-            else:
-                data_type = _data_type_from_value(value)
-                schema.append(bigquery.SchemaField(key, data_type))
+        schema = _bq_schema(_infer_schema(filename))
     dataset_id = os.getenv("BQ_TEST_DATASET")
-    table_id = f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
+    table_id = _test_table_id(component, filename)
 
     dataset_ref = bq_client().dataset(dataset_id)
     table_ref = dataset_ref.table(table_id)
+    fingerprint = _test_table_fingerprint(
+        filename, [field.to_api_repr() for field in schema]
+    )
+    if not force:
+        try:
+            if bq_client().get_table(table_ref).description == fingerprint:
+                _annotate_record(up_to_date=True)
+                if verbose:
+                    print(f"Test table {table_id} is up to date, skipping upload")
+                return
+        except NotFound:
+            pass
     job_config = bigquery.LoadJobConfig()
     job_config.source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
     job_config.autodetect = True
     job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
     job_config.schema = schema
+    job_config.destination_table_description = fingerprint
 
-    with open(filename, "rb") as source_file:
-        processed = io.BytesIO()
-        for line in source_file:
-            processed_line = substitute_vars(line.decode("utf-8"))
-            processed.write(processed_line.encode("utf-8"))
-
-        processed.seek(0)
-
+    with _SubstitutedFile(filename) as processed:
         job = bq_client().load_table_from_file(
             processed,
             table_ref,
@@ -452,263 +1153,1834 @@ def _upload_test_table_bq(filename, component):
         job.result()
     except Exception as e:
         pass
+    _record_job_bq(job)
 
 
-def _upload_test_table_sf(filename, component):
-    with open(filename) as f:
-        data = []
-        for l in f.readlines():
-            if l.strip():
-                data.append(json.loads(substitute_vars(l)))
-    if os.path.exists(filename.replace(".ndjson", ".schema")):
-        with open(filename.replace(".ndjson", ".schema")) as f:
-            data_types = json.load(f)
-    else:
-        data_types = {}
-        for key, value in data[0].items():
-            if isinstance(value, int):
-                data_types[key] = "NUMBER"
-            elif isinstance(value, str):
-                try:
-                    wkt.loads(value)
-                    data_types[key] = "GEOGRAPHY"
-                except Exception as e:
-                    data_types[key] = "VARCHAR"
-            elif isinstance(value, float):
-                data_types[key] = "FLOAT"
-            else:
-                try:
-                    wkt.loads(value)
-                    data_types[key] = "GEOGRAPHY"
-                except Exception as e:
-                    data_types[key] = "VARCHAR"
-    table_id = f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
-    create_table_sql = f"CREATE OR REPLACE TABLE {sf_workflows_temp}.{table_id} ("
-    for key, value in data[0].items():
-        create_table_sql += f"{key} {data_types[key]}, "
-    create_table_sql = create_table_sql.rstrip(", ")
-    create_table_sql += ");\n"
+def _sf_copy_expression(column, data_type):
+    """Expression that reads a column from a staged NDJSON file in COPY INTO."""
+    value = f'$1:"{column}"'
+    if data_type.upper() == "GEOGRAPHY":
+        return f"TO_GEOGRAPHY({value}::VARCHAR)"
+    return f"{value}::{data_type}"
+
+
+def _sf_tables(pattern):
+    """Tables in the Snowflake test schema whose name matches a LIKE pattern,
+    as dicts with the columns of SHOW TABLES by name."""
     cursor = sf_client().cursor()
-    cursor.execute(create_table_sql)
-    for row in data:
-        values = {}
-        for key, value in row.items():
-            if value is None:
-                values[key] = "null"
-            elif data_types[key] in ["NUMBER", "FLOAT"]:
-                values[key] = str(value)
-            else:
-                values[key] = f"'{value}'"
-        values_string = ", ".join([values[key] for key in row.keys()])
-        insert_sql = f"INSERT INTO {sf_workflows_temp}.{table_id} ({', '.join(row.keys())}) VALUES ({values_string})"
-        cursor.execute(insert_sql)
+    cursor.execute(f"SHOW TABLES LIKE '{pattern}' IN SCHEMA {sf_workflows_temp()}")
+    columns = [column[0].lower() for column in cursor.description]
+    tables = {
+        row[columns.index("name")]: dict(zip(columns, row)) for row in cursor.fetchall()
+    }
     cursor.close()
+    return tables
 
 
-def _get_test_results(metadata, component):
-    if metadata["provider"] == "bigquery":
-        upload_function = _upload_test_table_bq
-        workflows_temp = bq_workflows_temp
-    else:
-        upload_function = _upload_test_table_sf
-        workflows_temp = sf_workflows_temp
-    results = {}
-    if component:
-        components = [c for c in metadata["components"] if c["name"] == component]
-    else:
-        components = metadata["components"]
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
+def _sf_table_comments(pattern):
+    """Comments of the tables in the Snowflake test schema whose name matches a LIKE pattern."""
+    return {name: table["comment"] for name, table in _sf_tables(pattern).items()}
 
-    for component in components:
-        component_folder = os.path.join(components_folder, component["name"])
-        test_folder = os.path.join(component_folder, "test")
-        # upload test tables
-        for filename in os.listdir(test_folder):
-            if filename.endswith(".ndjson"):
-                upload_function(os.path.join(test_folder, filename), component)
-        # run tests
-        test_configuration_file = os.path.join(test_folder, "test.json")
-        with open(test_configuration_file, "r") as f:
-            test_configurations = json.loads(substitute_vars(f.read()))
-
-        tables = {}
-        component_results = {}
-        for test_configuration in test_configurations:
-            param_values = []
-            test_id = test_configuration["id"]
-            component_results[test_id] = {}
-            for inputparam in component["inputs"]:
-                param_value = test_configuration["inputs"][inputparam["name"]]
-                if param_value is None:
-                    param_values.append(None)
-                else:
-                    if inputparam["type"] == "Table":
-                        tablename = f"'{workflows_temp}._test_{component['name']}_{param_value}'"
-                        param_values.append(tablename)
-                    elif inputparam["type"] in [
-                        "String",
-                        "Selection",
-                        "StringSql",
-                        "Json",
-                        "GeoJson",
-                        "Column",
-                    ]:
-                        param_values.append(f"'{param_value}'")
-                    else:
-                        param_values.append(param_value)
-            tablename = f"{workflows_temp}._table_{uuid4().hex}"
-            for outputparam in component["outputs"]:
-                param_values.append(f"'{tablename}'")
-                tables[outputparam["name"]] = tablename
-            param_values.append(False)  # dry run
-            param_values.append(json.dumps(test_configuration.get("env_vars", "{}")))
-            query = f"""CALL {workflows_temp}.{component['procedureName']}(
-                {','.join([str(p) if p is not None else 'null' for p in param_values])}
-            );"""
-            if verbose:
-                print(query)
-            if metadata["provider"] == "bigquery":
-                query_job = bq_client().query(query)
-                result = query_job.result()
-                for output in component["outputs"]:
-                    query = f"SELECT * FROM {tables[output['name']]}"
-                    query_job = bq_client().query(query)
-                    result = query_job.result()
-                    rows = [{k: v for k, v in row.items()} for row in result]
-                    component_results[test_id][output["name"]] = rows
-            else:
-                cur = sf_client().cursor()
-                cur.execute(query)
-                for output in component["outputs"]:
-                    query = f"SELECT * FROM {tables[output['name']]}"
-                    cur = sf_client().cursor()
-                    cur.execute(query)
-                    rows = cur.fetchall()
-                    component_results[test_id][output["name"]] = rows
-        results[component["name"]] = component_results
-    return results
 
+def _upload_test_table_sf(filename, component, force=False):
+    """Upload a test table to Snowflake.
 
-def test(component):
-    print("Testing extension...")
-    metadata = create_metadata()
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
-    deploy(None)
-    results = _get_test_results(metadata, component)
+    The NDJSON file (after substituting variables) is put in the table stage and
+    loaded with a single COPY INTO, instead of inserting rows one by one.
+    """
+    start = time.perf_counter()
+    table_id = _test_table_id(component, filename)
+    table_name = f"{sf_workflows_temp()}.{table_id}"
+    table_stage = f"@{sf_workflows_temp()}.%{table_id}"
+    if os.path.exists(filename.replace(".ndjson", ".schema")):
+        with open(filename.replace(".ndjson", ".schema")) as f:
+            data_types = json.load(f)
+    else:
+        data_types = {
+            key: _sf_data_type(data_type)
+            for key, data_type in _infer_schema(filename).items()
+        }
+    fingerprint = _test_table_fingerprint(filename, data_types)
+    if not force:
+        comments = _sf_table_comments(table_id)
+        if comments.get(table_id.upper()) == fingerprint:
+            _annotate_record(up_to_date=True)
+            if verbose:
+                print(f"Test table {table_id} is up to date, skipping upload")
+            return
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        processed_filename = os.path.join(tmp_folder, f"{table_id}.ndjson")
+        num_rows = 0
+        with open(filename) as f, open(processed_filename, "w") as processed:
+            for line in substitute_lines(f):
+                if line.strip():
+                    processed.write(line.rstrip("\n") + "\n")
+                    num_rows += 1
+        columns = list(data_types.keys())
+        create_table_sql = f"CREATE OR REPLACE TABLE {table_name} ("
+        for key in columns:
+            create_table_sql += f"{key} {data_types[key]}, "
+        create_table_sql = create_table_sql.rstrip(", ")
+        create_table_sql += ");\n"
+        copy_sql = f"""COPY INTO {table_name} ({', '.join(columns)})
+            FROM (
+                SELECT {', '.join([_sf_copy_expression(key, data_types[key]) for key in columns])}
+                FROM {table_stage}
+            )
+            FILE_FORMAT = (TYPE = JSON)
+            PURGE = TRUE"""
+        processed_path = processed_filename.replace("\\", "/")
+        cursor = sf_client().cursor()
+        for statement in [
+            create_table_sql,
+            f"PUT 'file://{processed_path}' {table_stage} AUTO_COMPRESS = TRUE OVERWRITE = TRUE",
+            copy_sql,
+            f"COMMENT ON TABLE {table_name} IS '{fingerprint}'",
+        ]:
+            cursor.execute(statement)
+            _record_query_sf(cursor)
+        cursor.close()
+        _annotate_record(rows=num_rows)
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Uploaded {num_rows} rows to {table_id} in {elapsed:.2f} s "
+            f"({num_rows / max(elapsed, 1e-6):.0f} rows/s)"
+        )
 
-    for component in metadata["components"]:
-        component_folder = os.path.join(components_folder, component["name"])
-        for test_id, outputs in results[component["name"]].items():
-            test_folder = os.path.join(component_folder, "test", "fixtures")
-            test_filename = os.path.join(test_folder, f"{test_id}.json")
-            if str(test_id).startswith("skip_"):
-                # Don't compare results, it will only throw an error
-                # if there is an issue when running on BigQuery
-                continue
-            with open(test_filename, "r") as f:
-                expected = json.loads(substitute_vars(f.read()))
-                for output_name, output in outputs.items():
-                    output = json.loads(json.dumps(output, default=str))
-                    if not test_output(expected[output_name], output, decimal_places=3):
-                        raise AssertionError(
-                            f"Test '{test_id}' failed for component {component['name']} and table {output_name}."
-                        )
-    print("Extension correctly tested.")
 
+def _run_parallel(tasks, jobs):
+    """Run a list of functions with a pool of `jobs` workers.
 
-def _normalize_json(original, decimal_places=3):
-    """Ensure that the input for a test is in a uniform format.
-
-    This function takes an input and generates a new version of it that does
-    comply with a uniform format, including the precision of the floats.
-    """
-    if isinstance(original, dict):
-        processed_row = {}
-        processed = []
-        for column, value in original.items():
-            if isinstance(value, float):
-                processed_row[column] = round(value, decimal_places)
-            elif isinstance(value, dict):
-                processed_row[column] = _normalize_json(value, decimal_places)
-            elif isinstance(value, list):
-                processed_row[column] = _normalize_json(value, decimal_places)
-            else:
-                processed_row[column] = value
-        return processed_row
-    
-    elif isinstance(original, list):
-        processed = []
-        for item in original:
-            processed.append(_normalize_json(item, decimal_places))
-        return processed
-    
-    elif isinstance(original, float):
-        return round(original, decimal_places)
-    
-    else:
-        return original
+    Returns the results in the same order as the tasks. If any of them fails,
+    the tasks that have not started yet are cancelled and the error is raised.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        return [task() for task in tasks]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
 
-def _sorted_json(data):
-    """Recursively sort JSON-like structures (lists of dicts) to enable consistent ordering."""
-    
-    if isinstance(data, dict):
-        return {key: _sorted_json(data[key]) for key in sorted(data)}
-    elif isinstance(data, list):
-        return sorted((_sorted_json(item) for item in data), key=json.dumps)
-    else:
-        return data
+def start_instrumentation():
+    """Record the warehouse calls of the next actions (see `_instrument`)."""
+    global instrumentation, instrumentation_start
+    instrumentation = []
+    instrumentation_start = time.perf_counter()
 
 
-def test_output(expected, result, decimal_places=3):
-    expected = _normalize_json(
-        _sorted_json(expected), decimal_places=decimal_places
-    )
-    result = _normalize_json(
-        _sorted_json(result), decimal_places=decimal_places
-    )
-    return expected == result
+def _new_record(phase, component, test_id, details):
+    record = {"phase": phase, "component": component, "test_id": test_id}
+    record.update(details)
+    record["thread"] = threading.current_thread().name
+    return record
 
 
-def capture(component):
-    print("Capturing fixtures... ")
-    metadata = create_metadata()
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
-    deploy(None)
-    results = _get_test_results(metadata, component)
-    for component in metadata["components"]:
-        component_folder = os.path.join(components_folder, component["name"])
-        for test_id, outputs in results[component["name"]].items():
-            test_folder = os.path.join(component_folder, "test", "fixtures")
-            os.makedirs(test_folder, exist_ok=True)
-            test_filename = os.path.join(test_folder, f"{test_id}.json")
-            with open(test_filename, "w") as f:
-                f.write(json.dumps(outputs, indent=2, default=str))
-    print("Fixtures correctly captured.")
+def _finish_record(record, start, seconds):
+    record["start"] = round(start - instrumentation_start, 6)
+    record["seconds"] = round(seconds, 6)
+    instrumentation.append(record)
 
 
-def package():
-    print("Packaging extension...")
+@contextmanager
+def _instrument(phase, component=None, test_id=None, **details):
+    """Record a warehouse call, if the calls are instrumented.
+
+    The record has the phase (upload, deploy, call or fetch), component, test
+    id and other details of the call, its start (in seconds since
+    `start_instrumentation`), wall time and thread. The jobs and queries run by
+    the thread meanwhile add their IDs and statistics to it (see `_record_job_bq`
+    and `_record_query_sf`).
+    """
+    if instrumentation is None:
+        yield None
+        return
+    record = _new_record(phase, component, test_id, details)
+    previous = getattr(instrumentation_local, "record", None)
+    instrumentation_local.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        instrumentation_local.record = previous
+        _finish_record(record, start, time.perf_counter() - start)
+
+
+def _instrumented_rows(rows, component=None, test_id=None, **details):
+    """Rows of a test output, recorded as a "fetch" call when they are consumed.
+
+    Only the time spent fetching the rows counts as its wall time, and not the
+    time spent by the consumer in between.
+    """
+    if instrumentation is None:
+        yield from rows
+        return
+    record = _new_record("fetch", component, test_id, details)
+    record["rows"] = 0
+    start = None
+    seconds = 0
+    iterator = iter(rows)
+    try:
+        while True:
+            previous = getattr(instrumentation_local, "record", None)
+            instrumentation_local.record = record
+            fetch_start = time.perf_counter()
+            if start is None:
+                start = fetch_start
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                record["error"] = str(e)
+                raise
+            finally:
+                seconds += time.perf_counter() - fetch_start
+                instrumentation_local.record = previous
+            record["rows"] += 1
+            yield row
+    finally:
+        if start is not None:
+            _finish_record(record, start, seconds)
+
+
+def _annotate_record(**values):
+    """Add some details to the record of the current warehouse call, if any."""
+    record = getattr(instrumentation_local, "record", None)
+    if record is not None:
+        record.update(values)
+
+
+def _add_statistic(record, key, value):
+    if value is None:
+        return
+    if key == "job_ids":
+        record.setdefault(key, []).extend(value)
+    else:
+        record[key] = record.get(key, 0) + value
+
+
+def _record_job_bq(query_job):
+    """Add the ID and statistics of a finished BigQuery job to the current record."""
+    record = getattr(instrumentation_local, "record", None)
+    if record is None:
+        return
+    _add_statistic(record, "job_ids", [query_job.job_id])
+    _add_statistic(record, "bytes_processed", getattr(query_job, "total_bytes_processed", None))
+    _add_statistic(record, "slot_ms", getattr(query_job, "slot_millis", None))
+    if getattr(query_job, "job_type", None) == "load":
+        _add_statistic(record, "rows", query_job.output_rows)
+
+
+def _record_query_sf(cur):
+    """Add the ID and statistics of the last query of a Snowflake cursor to the
+    current record.
+
+    The statistics are read from the query history of the session, with the
+    same names as in BigQuery: the bytes scanned as `bytes_processed`, and the
+    rows loaded by COPY INTO as `rows`.
+    """
+    record = getattr(instrumentation_local, "record", None)
+    if record is None:
+        return
+    from snowflake.connector.errors import ProgrammingError
+
+    _add_statistic(record, "job_ids", [cur.sfqid])
+    try:
+        _, bytes_scanned, _, rows_loaded = _query_history_sf(cur.sfqid)
+    except ProgrammingError:
+        # e.g. no current database to read the query history from
+        return
+    _add_statistic(record, "bytes_processed", bytes_scanned)
+    _add_statistic(record, "rows", rows_loaded)
+
+
+def _instrumentation_summary(records):
+    """Number of calls, wall time and statistics of the records of each phase."""
+    summary = {}
+    for record in records:
+        phase = summary.setdefault(record["phase"], {"calls": 0})
+        phase["calls"] += 1
+        for key in ["seconds", "bytes_processed", "slot_ms", "rows"]:
+            _add_statistic(phase, key, record.get(key))
+    for phase in summary.values():
+        phase["seconds"] = round(phase.get("seconds", 0), 6)
+    return summary
+
+
+def write_instrumentation(report_file=None, trace_file=None):
+    """Write the records of the instrumented warehouse calls.
+
+    The report is a JSON file with every record and a summary by phase. The
+    trace is a Chrome trace file (for chrome://tracing or Perfetto), with the
+    calls of each thread on their own track.
+    """
+    records = sorted(instrumentation or [], key=lambda record: record["start"])
+    if report_file:
+        with open(report_file, "w") as f:
+            json.dump(
+                {"summary": _instrumentation_summary(records), "calls": records},
+                f,
+                indent=2,
+                default=str,
+            )
+    if trace_file:
+        threads = {}
+        events = []
+        for record in records:
+            tid = threads.setdefault(record["thread"], len(threads) + 1)
+            name = " ".join(
+                str(part)
+                for part in [record["phase"], record["component"], record["test_id"]]
+                if part is not None
+            )
+            args = {
+                key: value
+                for key, value in record.items()
+                if key not in ["phase", "start", "seconds", "thread"] and value is not None
+            }
+            events.append(
+                {
+                    "name": name,
+                    "cat": record["phase"],
+                    "ph": "X",
+                    "ts": round(record["start"] * 1e6),
+                    "dur": round(record["seconds"] * 1e6),
+                    "pid": 1,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for thread, tid in threads.items():
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}}
+            )
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def _fetch_job_rows_bq(query_job):
+    """Rows of a BigQuery query job as dicts, fetched page by page as they are consumed."""
+    rows = query_job.result(page_size=RESULTS_BATCH_SIZE)
+    _record_job_bq(query_job)
+    for row in rows:
+        yield {k: v for k, v in row.items()}
+
+
+def _fetch_rows_bq(query):
+    yield from _fetch_job_rows_bq(bq_client().query(query))
+
+
+def _fetch_cursor_rows_sf(cur):
+    """Rows of the current result of a Snowflake cursor as dicts, fetched in batches."""
+    columns = [column[0] for column in cur.description]
+    while True:
+        rows = cur.fetchmany(RESULTS_BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def _fetch_rows_sf(query):
+    """Rows of a Snowflake query as dicts, fetched in batches as they are consumed."""
+    cur = sf_client().cursor()
+    try:
+        cur.execute(query)
+        _record_query_sf(cur)
+        yield from _fetch_cursor_rows_sf(cur)
+    finally:
+        cur.close()
+
+
+def _job_statistics_bq(query_job):
+    """Statistics of a BigQuery job (for a script, of all its child jobs)."""
+    return {
+        "job_id": query_job.job_id,
+        "bytes_processed": query_job.total_bytes_processed,
+        "bytes_billed": query_job.total_bytes_billed,
+        "slot_ms": query_job.slot_millis,
+    }
+
+
+def _query_history_sf(query_id):
+    """Number of queries, bytes scanned, execution time (ms) and rows loaded
+    by COPY INTO of a Snowflake query and of the queries run after it in the
+    same session (for a CALL, the queries of the procedure)."""
+    cur = sf_client().cursor()
+    try:
+        cur.execute(
+            """SELECT
+                COUNT(*),
+                SUM(BYTES_SCANNED),
+                SUM(EXECUTION_TIME),
+                SUM(IFF(QUERY_TYPE = 'COPY', ROWS_PRODUCED, NULL))
+            FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000))
+            WHERE EXECUTION_STATUS = 'SUCCESS' AND START_TIME >= (
+                SELECT START_TIME
+                FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000))
+                WHERE QUERY_ID = %s
+            )""",
+            (query_id,),
+        )
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+def _query_statistics_sf(cur):
+    """Statistics of the last query of a Snowflake cursor, see `_query_history_sf`."""
+    query_id = cur.sfqid
+    queries, bytes_scanned, execution_ms, _ = _query_history_sf(query_id)
+    return {
+        "query_id": query_id,
+        "queries": queries,
+        "bytes_scanned": bytes_scanned,
+        "execution_ms": execution_ms,
+    }
+
+
+class _Rows:
+    """Rows of a test output, which are fetched again each time they are iterated.
+
+    If `first` is given, it is used as the rows for the first iteration. The
+    `context` (component, test id and output) is used to instrument the fetches.
+    """
+
+    def __init__(self, fetch, first=None, **context):
+        self.fetch = fetch
+        self.first = first
+        self.context = context
+
+    def __iter__(self):
+        if self.first is not None:
+            first, self.first = self.first, None
+            return _instrumented_rows(first, **self.context)
+        return _instrumented_rows(self.fetch(), **self.context)
+
+
+def _collect_output(component, test_id, output_name, rows):
+    return list(rows)
+
+
+def _test_arguments(component, test_configuration, workflows_temp):
+    """Arguments of the procedure call for a test case and the output tables it creates.
+
+    Table inputs and outputs are given as fully qualified table names.
+    """
+    arguments = {}
+    tables = {}
+    for inputparam in component["inputs"]:
+        param_value = test_configuration["inputs"][inputparam["name"]]
+        if param_value and inputparam["type"] == "Table":
+            param_value = f"{workflows_temp}._test_{component['name']}_{param_value}"
+        arguments[inputparam["name"]] = param_value
+    tablename = f"{workflows_temp}._table_{uuid4().hex}"
+    for outputparam in component["outputs"]:
+        arguments[outputparam["name"]] = tablename
+        tables[outputparam["name"]] = tablename
+    return arguments, tables
+
+
+def _test_call(component, test_configuration, workflows_temp):
+    """Query that runs a test case and the output tables that it creates."""
+    arguments, tables = _test_arguments(component, test_configuration, workflows_temp)
+    input_types = {param["name"]: param["type"] for param in component["inputs"]}
+    param_values = []
+    for name, param_value in arguments.items():
+        if param_value is None:
+            param_values.append(None)
+        elif input_types.get(name, "Table") in [
+            "Table",
+            "String",
+            "Selection",
+            "StringSql",
+            "Json",
+            "GeoJson",
+            "Column",
+        ]:
+            param_values.append(f"'{param_value}'")
+        else:
+            param_values.append(param_value)
+    param_values.append(False)  # dry run
+    param_values.append(json.dumps(test_configuration.get("env_vars", "{}")))
+    query = f"""CALL {workflows_temp}.{component['procedureName']}(
+                {','.join([str(p) if p is not None else 'null' for p in param_values])}
+            );"""
+    return query, tables
+
+
+def _upload_test_table(backend, filename, component, force=False):
+    with _instrument(
+        "upload", component["name"], table=_test_table_id(component, filename)
+    ):
+        backend.upload_test_table(filename, component, force)
+
+
+def _run_test(backend, component, test_configuration, handle_output):
+    outputs = {}
+    with _instrument("call", component["name"], test_configuration["id"]):
+        tables = backend.call_test(component, test_configuration)
+    for output in component["outputs"]:
+        rows = _Rows(
+            partial(backend.fetch_table, tables[output["name"]]),
+            component=component["name"],
+            test_id=test_configuration["id"],
+            output=output["name"],
+        )
+        outputs[output["name"]] = handle_output(
+            component, test_configuration["id"], output["name"], rows
+        )
+    return outputs
+
+
+def _batch_script(component, test_configurations, workflows_temp):
+    """Statements of a script that runs all the test cases of a component.
+
+    The script calls the component procedure for every test case and then
+    selects every output table. Returns the statements and, by index of each
+    select statement, its test id, output name and line in the script.
+    """
+    statements = []
+    selects = {}
+    line = 1
+    for test_configuration in test_configurations:
+        query, tables = _test_call(component, test_configuration, workflows_temp)
+        statements.append(query)
+        line += query.count("\n") + 1
+        for output in component["outputs"]:
+            selects[len(statements)] = (test_configuration["id"], output["name"], line)
+            statements.append(f"SELECT * FROM {tables[output['name']]};")
+            line += 1
+    return statements, selects
+
+
+class Backend:
+    """Where the extension is deployed and its tests are run.
+
+    Test tables and output tables are created in `workflows_temp`.
+    """
+
+    workflows_temp = None
+
+    def upload_test_table(self, filename, component, force=False):
+        raise NotImplementedError
+
+    def deploy(self, metadata, destination=None, incremental=False):
+        raise NotImplementedError
+
+    def call_test(self, component, test_configuration, statistics=None):
+        """Run a test case and return its output tables, by output name.
+
+        If `statistics` is a dict, the statistics of the warehouse job that ran
+        it are added to it.
+        """
+        raise NotImplementedError
+
+    def fetch_table(self, table):
+        """Rows of a table as dicts, fetched in batches as they are consumed."""
+        raise NotImplementedError
+
+    def count_rows(self, table):
+        return sum(1 for _ in self.fetch_table(table))
+
+    def run_tests_batch(self, component, test_configurations, handle_output):
+        """Run all the test cases of a component and return their outputs, by test id."""
+        return {
+            test_configuration["id"]: _run_test(
+                self, component, test_configuration, handle_output
+            )
+            for test_configuration in test_configurations
+        }
+
+
+class BigQueryBackend(Backend):
+    def __init__(self):
+        self.workflows_temp = bq_workflows_temp()
+
+    def upload_test_table(self, filename, component, force=False):
+        _upload_test_table_bq(filename, component, force)
+
+    def deploy(self, metadata, destination=None, incremental=False):
+        deploy_bq(metadata, destination, incremental)
+
+    def call_test(self, component, test_configuration, statistics=None):
+        query, tables = _test_call(component, test_configuration, self.workflows_temp)
+        if verbose:
+            print(query)
+        query_job = bq_client().query(query)
+        query_job.result()
+        _record_job_bq(query_job)
+        if statistics is not None:
+            statistics.update(_job_statistics_bq(query_job))
+        return tables
+
+    def fetch_table(self, table):
+        return _fetch_rows_bq(f"SELECT * FROM {table}")
+
+    def count_rows(self, table):
+        return next(_fetch_rows_bq(f"SELECT COUNT(*) AS row_count FROM {table}"))[
+            "row_count"
+        ]
+
+    def run_tests_batch(self, component, test_configurations, handle_output):
+        """Run all the test cases of a component with a single BigQuery script.
+
+        The results are read from the child jobs of the script, matched by the
+        line of their statement.
+        """
+        statements, selects = _batch_script(
+            component, test_configurations, self.workflows_temp
+        )
+        script = "\n".join(statements)
+        if verbose:
+            print(script)
+        results = {test_configuration["id"]: {} for test_configuration in test_configurations}
+        with _instrument("call", component["name"], tests=len(test_configurations)):
+            script_job = bq_client().query(script)
+            script_job.result()
+            _record_job_bq(script_job)
+        child_jobs = {}
+        for child_job in bq_client().list_jobs(parent_job=script_job):
+            statistics = child_job.script_statistics
+            if statistics is not None and len(statistics.stack_frames) == 1:
+                child_jobs[statistics.stack_frames[0].start_line] = child_job
+        for i, (test_id, output_name, line) in sorted(selects.items()):
+            select = statements[i]
+            rows = _Rows(
+                partial(_fetch_rows_bq, select),
+                _fetch_job_rows_bq(child_jobs[line]) if line in child_jobs else None,
+                component=component["name"],
+                test_id=test_id,
+                output=output_name,
+            )
+            results[test_id][output_name] = handle_output(
+                component, test_id, output_name, rows
+            )
+        return results
+
+
+class SnowflakeBackend(Backend):
+    def __init__(self):
+        self.workflows_temp = sf_workflows_temp()
+
+    def upload_test_table(self, filename, component, force=False):
+        _upload_test_table_sf(filename, component, force)
+
+    def deploy(self, metadata, destination=None, incremental=False):
+        deploy_sf(metadata, destination, incremental)
+
+    def call_test(self, component, test_configuration, statistics=None):
+        query, tables = _test_call(component, test_configuration, self.workflows_temp)
+        if verbose:
+            print(query)
+        cur = sf_client().cursor()
+        try:
+            cur.execute(query)
+            # before the query history is read again for the record
+            if statistics is not None:
+                statistics.update(_query_statistics_sf(cur))
+            _record_query_sf(cur)
+        finally:
+            cur.close()
+        return tables
+
+    def fetch_table(self, table):
+        return _fetch_rows_sf(f"SELECT * FROM {table}")
+
+    def count_rows(self, table):
+        return next(_fetch_rows_sf(f"SELECT COUNT(*) AS row_count FROM {table}"))[
+            "ROW_COUNT"
+        ]
+
+    def run_tests_batch(self, component, test_configurations, handle_output):
+        """Run all the test cases of a component with a single Snowflake request.
+
+        The script is sent as a multi-statement request and its result sets are
+        read in order.
+        """
+        statements, selects = _batch_script(
+            component, test_configurations, self.workflows_temp
+        )
+        script = "\n".join(statements)
+        if verbose:
+            print(script)
+        results = {test_configuration["id"]: {} for test_configuration in test_configurations}
+        cur = sf_client().cursor()
+        try:
+            with _instrument("call", component["name"], tests=len(test_configurations)):
+                cur.execute(script, num_statements=len(statements))
+                _record_query_sf(cur)
+            for i, statement in enumerate(statements):
+                if i > 0:
+                    cur.nextset()
+                if i in selects:
+                    test_id, output_name, _ = selects[i]
+                    rows = _Rows(
+                        partial(_fetch_rows_sf, statement),
+                        _fetch_cursor_rows_sf(cur),
+                        component=component["name"],
+                        test_id=test_id,
+                        output=output_name,
+                    )
+                    results[test_id][output_name] = handle_output(
+                        component, test_id, output_name, rows
+                    )
+        finally:
+            cur.close()
+        return results
+
+
+SQL_STRING_PATTERN = r"""'''(?:[^\\]|\\.)*?'''|\"\"\"(?:[^\\]|\\.)*?\"\"\"|\$\$.*?\$\$|'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*\""""
+SQL_CONCATENATION_TOKEN = re.compile(
+    rf"\s*(?:(?P<string>{SQL_STRING_PATTERN})|:?(?P<variable>[A-Za-z_][A-Za-z0-9_]*)|(?P<operator>\|\|))\s*",
+    re.DOTALL,
+)
+SQL_TOKEN = re.compile(rf"{SQL_STRING_PATTERN}|`[^`]*`|--[^\n]*|/\*.*?\*/|;", re.DOTALL)
+LOCAL_STATEMENTS = ("SELECT", "WITH", "CREATE", "INSERT", "DELETE", "UPDATE", "MERGE", "DROP")
+LOCAL_SQL_REPLACEMENTS = {
+    "INT64": "BIGINT",
+    "FLOAT64": "DOUBLE",
+    "SAFE_CAST": "TRY_CAST",
+    "ST_GEOGFROMTEXT": "ST_GeomFromText",
+    "ST_GEOGPOINT": "ST_Point",
+}
+
+
+def _split_sql_statements(code):
+    """Statements of a SQL script, without comments.
+
+    Semicolons and comment markers inside strings and quoted identifiers are ignored.
+    """
+    statements = []
+    current = []
+    position = 0
+    for match in SQL_TOKEN.finditer(code):
+        current.append(code[position : match.start()])
+        token = match.group(0)
+        if token == ";":
+            statements.append("".join(current).strip())
+            current = []
+        elif not token.startswith(("--", "/*")):
+            current.append(token)
+        position = match.end()
+    current.append(code[position:])
+    statements.append("".join(current).strip())
+    return [statement for statement in statements if statement]
+
+
+def _sql_string_value(literal):
+    """Value of a BigQuery or Snowflake string literal."""
+    if literal.startswith(("'''", '"""')):
+        text = literal[3:-3]
+    elif literal.startswith("$$"):
+        return literal[2:-2]
+    else:
+        text = literal[1:-1].replace(literal[0] * 2, literal[0])
+    escapes = {"n": "\n", "t": "\t", "r": "\r"}
+    return re.sub(r"\\(.)", lambda m: escapes.get(m.group(1), m.group(1)), text)
+
+
+def _evaluate_sql_concatenation(expression, variables):
+    """Value of a concatenation of string literals and procedure variables.
+
+    This is what the procedure bodies pass to EXECUTE IMMEDIATE, with the table
+    names and other parameters concatenated into the query text.
+    """
+    parts = []
+    position = 0
+    expect_operand = True
+    while position < len(expression):
+        match = SQL_CONCATENATION_TOKEN.match(expression, position)
+        if match is None or bool(match.group("operator")) == expect_operand:
+            raise NotImplementedError(
+                f"Unsupported EXECUTE IMMEDIATE expression: {expression[position:][:50]}"
+            )
+        if match.group("string"):
+            parts.append(_sql_string_value(match.group("string")))
+        elif match.group("variable"):
+            name = match.group("variable")
+            if name not in variables:
+                raise NotImplementedError(f"Unknown variable '{name}'")
+            value = variables[name]
+            if value is None:
+                value = "NULL"
+            elif isinstance(value, bool):
+                value = str(value).upper()
+            parts.append(str(value))
+        expect_operand = not expect_operand
+        position = match.end()
+    return "".join(parts)
+
+
+def _remove_sql_options(sql):
+    """Remove the BigQuery OPTIONS (...) clauses of a statement."""
+    while True:
+        match = re.search(r"\bOPTIONS\s*\(", sql, re.IGNORECASE)
+        if match is None:
+            return sql
+        depth = 1
+        end = match.end()
+        while depth and end < len(sql):
+            depth += {"(": 1, ")": -1}.get(sql[end], 0)
+            end += 1
+        sql = sql[: match.start()] + sql[end:]
+
+
+def _local_sql(sql, spatial):
+    """Translate a BigQuery or Snowflake statement to DuckDB, where the dialects differ."""
+    sql = _remove_sql_options(sql)
+    sql = re.sub(r"\*\s+EXCEPT\s*\(", "* EXCLUDE (", sql, flags=re.IGNORECASE)
+    replacements = dict(LOCAL_SQL_REPLACEMENTS)
+    replacements["GEOGRAPHY"] = "GEOMETRY" if spatial else "VARCHAR"
+    sql = re.sub(
+        r"\b(" + "|".join(replacements) + r")\b",
+        lambda m: replacements[m.group(1).upper()],
+        sql,
+        flags=re.IGNORECASE,
+    )
+    return sql.replace("`", '"')
+
+
+def _local_statements(code):
+    """Compile a procedure body into the statements run by the local backend.
+
+    Returns a list of (kind, text) pairs, where kind is "execute" for
+    EXECUTE IMMEDIATE statements (text being the expression that builds the
+    query) or "sql" for static statements. Raises NotImplementedError for
+    procedural statements, which only the data warehouses can run.
+    """
+    statements = []
+    for statement in _split_sql_statements(code):
+        match = re.match(r"EXECUTE\s+IMMEDIATE\s+(.*)$", statement, re.IGNORECASE | re.DOTALL)
+        if match:
+            statements.append(("execute", match.group(1)))
+            continue
+        words = statement.split()
+        if words[0].upper() not in LOCAL_STATEMENTS or (
+            words[0].upper() == "CREATE" and "FUNCTION" in [w.upper() for w in words[1:5]]
+        ):
+            raise NotImplementedError(
+                f"'{' '.join(words[:3])} ...' statements are not supported by the local backend"
+            )
+        statements.append(("sql", statement))
+    return statements
+
+
+def _load_local_engine(component_name, engine_file):
+    """Import the Python implementation of a component."""
+    spec = importlib.util.spec_from_file_location(
+        f"{component_name}_local_engine", engine_file
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalBackend(Backend):
+    """Runs the tests in an in-process DuckDB database, without a data warehouse.
+
+    Test tables are loaded from the NDJSON files and the procedure bodies are run
+    statement by statement, evaluating their EXECUTE IMMEDIATE queries with the
+    test arguments and translating them to DuckDB where the dialects differ.
+    Components whose procedures use scripting (variables, loops, temporary
+    functions...) can not be run locally, unless they have a Python
+    implementation in `src/local.py`: its `fullrun(inputs)` function is called
+    with the value of each input (tables as lists of rows) and returns the rows
+    of each output. Geography columns are stored as GEOMETRY if the DuckDB
+    spatial extension is available and as WKT otherwise.
+    """
+
+    workflows_temp = "workflows_temp"
+
+    def __init__(self):
+        try:
+            import duckdb
+        except ImportError:
+            raise Exception(
+                "The local backend requires the duckdb package (pip install duckdb)"
+            )
+
+        self.connection = duckdb.connect()
+        self.spatial = False
+        for statements in (["LOAD spatial"], ["INSTALL spatial", "LOAD spatial"]):
+            try:
+                for statement in statements:
+                    self.connection.execute(statement)
+                self.spatial = True
+                break
+            except duckdb.Error:
+                pass
+        if not self.spatial:
+            print(
+                "DuckDB spatial extension not available, geographies are stored as WKT"
+            )
+        self.connection.execute(f"CREATE SCHEMA {self.workflows_temp}")
+        self.procedures = {}
+        self.engine_tables = {}  # output tables of the Python implementations
+
+    def upload_test_table(self, filename, component, force=False):
+        table_name = f"{self.workflows_temp}.{_test_table_id(component, filename)}"
+        if os.path.exists(filename.replace(".ndjson", ".schema")):
+            with open(filename.replace(".ndjson", ".schema")) as f:
+                data_types = json.load(f)
+        else:
+            data_types = _infer_schema(filename)
+        geographies = [
+            f'ST_GeomFromText("{key}") AS "{key}"'
+            for key, data_type in data_types.items()
+            if str(data_type).upper() == "GEOGRAPHY"
+        ]
+        columns = "*"
+        if self.spatial and geographies:
+            columns = f"* REPLACE ({', '.join(geographies)})"
+        with tempfile.TemporaryDirectory() as tmp_folder:
+            processed_filename = os.path.join(tmp_folder, "table.ndjson")
+            with open(filename) as f, open(processed_filename, "w") as processed:
+                processed.writelines(substitute_lines(f))
+            processed_path = processed_filename.replace("'", "''")
+            cursor = self.connection.cursor()
+            cursor.execute(
+                f"CREATE OR REPLACE TABLE {table_name} AS SELECT {columns} "
+                f"FROM read_json('{processed_path}', format = 'newline_delimited')"
+            )
+            cursor.close()
+
+    def deploy(self, metadata, destination=None, incremental=False):
+        with _instrument("deploy", destination="local"):
+            self._load_procedures(metadata)
+
+    def _load_procedures(self, metadata):
+        self.provider = metadata["provider"]
+        current_folder = os.path.dirname(os.path.abspath(__file__))
+        for component in metadata["components"]:
+            component_folder = os.path.join(current_folder, "components", component["name"])
+            engine_file = os.path.join(component_folder, "src", LOCAL_ENGINE_FILE)
+            try:
+                if os.path.isfile(engine_file):
+                    statements = _load_local_engine(component["name"], engine_file)
+                else:
+                    code = load_component(component["name"], self.provider)["fullrun"]
+                    statements = _local_statements(code)
+            except (NotImplementedError, ImportError) as e:
+                statements = e
+            self.procedures[component["procedureName"]] = statements
+
+    def call_test(self, component, test_configuration, statistics=None):
+        statements = self.procedures[component["procedureName"]]
+        if isinstance(statements, Exception):
+            raise Exception(
+                f"Component {component['name']} can not be run locally: {statements}"
+            )
+        arguments, tables = _test_arguments(
+            component, test_configuration, self.workflows_temp
+        )
+        if not isinstance(statements, list):
+            # Python implementation
+            inputs = dict(arguments)
+            for inputparam in component["inputs"]:
+                if inputparam["type"] == "Table" and inputs[inputparam["name"]]:
+                    inputs[inputparam["name"]] = list(
+                        self.fetch_table(inputs[inputparam["name"]])
+                    )
+            for output_name, rows in statements.fullrun(inputs).items():
+                self.engine_tables[tables[output_name]] = rows
+            return tables
+        # an object in test.json, passed as a JSON string as in the warehouses
+        env_vars = test_configuration.get("env_vars", {})
+        if not isinstance(env_vars, str):
+            env_vars = json.dumps(env_vars)
+        variables = dict(arguments, dry_run=False, env_vars=env_vars)
+        for env_var in component.get("cartoEnvVars", []):
+            value = json.loads(env_vars).get(env_var)
+            # as declared by get_procedure_code_bq and get_procedure_code_sf
+            if self.provider == "bigquery":
+                value = json.dumps(value)
+            variables[env_var] = value
+        cursor = self.connection.cursor()
+        try:
+            for kind, statement in statements:
+                if kind == "execute":
+                    statement = _evaluate_sql_concatenation(statement, variables)
+                statement = _local_sql(statement, self.spatial)
+                if verbose:
+                    print(statement)
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+        return tables
+
+    def fetch_table(self, table):
+        if table in self.engine_tables:
+            yield from copy.deepcopy(self.engine_tables[table])
+            return
+        cursor = self.connection.cursor()
+        try:
+            columns = [
+                f'ST_AsText("{name}") AS "{name}"'
+                if data_type == "GEOMETRY"
+                else f'"{name}"'
+                for name, data_type, *_ in cursor.execute(f"DESCRIBE {table}").fetchall()
+            ]
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            yield from _fetch_cursor_rows_sf(cursor)
+        finally:
+            cursor.close()
+
+
+def _backend(metadata, local=False):
+    if local:
+        return LocalBackend()
+    elif metadata["provider"] == "bigquery":
+        return BigQueryBackend()
+    else:
+        return SnowflakeBackend()
+
+
+def _get_test_results(
+    metadata,
+    component,
+    jobs=1,
+    force_upload=False,
+    handle_output=_collect_output,
+    batch=False,
+    backend=None,
+):
+    """Run the tests of the extension components and return their outputs.
+
+    Test tables are uploaded first and then the test cases are run, each of
+    these steps using up to `jobs` concurrent workers. The results are returned
+    in the same order as in the `test.json` files, regardless of the order in
+    which the test cases finish. Test tables that are already up to date in the
+    data warehouse are only uploaded again if `force_upload` is set. If `batch`
+    is set, all the test cases of a component are run in a single warehouse
+    script instead of one query per test case and output. The tests are run in
+    `backend`, by default the data warehouse of the extension provider.
+
+    For each output of a test case, `handle_output(component, test_id,
+    output_name, rows)` is called by the worker with an iterable over the rows
+    (as dicts), which are fetched in batches as it is consumed (and fetched
+    again if it is iterated again). Its return value is used as the result for
+    that output; by default, the list of rows.
+    """
+    if backend is None:
+        backend = _backend(metadata)
+    results = {}
+    if component:
+        components = [c for c in metadata["components"] if c["name"] == component]
+    else:
+        components = metadata["components"]
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    components_folder = os.path.join(current_folder, "components")
+
+    # upload test tables
+    uploads = []
+    for component in components:
+        test_folder = os.path.join(components_folder, component["name"], "test")
+        for filename in sorted(os.listdir(test_folder)):
+            if filename.endswith(".ndjson"):
+                uploads.append(
+                    partial(
+                        _upload_test_table,
+                        backend,
+                        os.path.join(test_folder, filename),
+                        component,
+                        force_upload,
+                    )
+                )
+    _run_parallel(uploads, jobs)
+
+    # run tests
+    test_configurations = {}
+    for component in components:
+        test_folder = os.path.join(components_folder, component["name"], "test")
+        test_configuration_file = os.path.join(test_folder, "test.json")
+        with open(test_configuration_file, "r") as f:
+            test_configurations[component["name"]] = json.loads(
+                substitute_vars(f.read())
+            )
+    if batch:
+        outputs = _run_parallel(
+            [
+                partial(
+                    backend.run_tests_batch,
+                    component,
+                    test_configurations[component["name"]],
+                    handle_output,
+                )
+                for component in components
+            ],
+            jobs,
+        )
+        for component, component_outputs in zip(components, outputs):
+            results[component["name"]] = component_outputs
+        return results
+
+    test_cases = [
+        (component, test_configuration)
+        for component in components
+        for test_configuration in test_configurations[component["name"]]
+    ]
+    outputs = _run_parallel(
+        [
+            partial(_run_test, backend, component, test_configuration, handle_output)
+            for component, test_configuration in test_cases
+        ],
+        jobs,
+    )
+    for component in components:
+        results[component["name"]] = {}
+    for (component, test_configuration), test_outputs in zip(test_cases, outputs):
+        results[component["name"]][test_configuration["id"]] = test_outputs
+    return results
+
+
+def _fixture_filename(component, test_id, fixture_format=None, local=False):
+    """Path of the fixture of a test.
+
+    If no format is given, the compressed fixture is used if it exists. The
+    fixtures captured with the local backend are kept apart, in
+    `fixtures/local`, so that they are never compared with warehouse results.
+    """
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    fixtures_folder = os.path.join(
+        current_folder, "components", component["name"], "test", "fixtures"
+    )
+    if local:
+        fixtures_folder = os.path.join(fixtures_folder, "local")
+    if fixture_format is None:
+        compressed_filename = os.path.join(fixtures_folder, f"{test_id}.ndjson.gz")
+        fixture_format = "ndjson.gz" if os.path.exists(compressed_filename) else "json"
+    return os.path.join(fixtures_folder, f"{test_id}.{fixture_format}")
+
+
+def _json_row(row):
+    """Row with the values that are not JSON types converted as in the fixtures."""
+    return json.loads(json.dumps(row, default=str))
+
+
+def _multiset_hash(canonical_rows):
+    """Hash of a set of rows (in canonical JSON) that doesn't depend on their order."""
+    total = 0
+    for canonical_row in canonical_rows:
+        digest = hashlib.sha256(canonical_row.encode("utf-8")).digest()
+        total = (total + int.from_bytes(digest, "big")) % 2**256
+    return f"{total:064x}"
+
+
+def _output_hash(rows, decimal_places=3):
+    """Number of rows and hash of a test output, as stored in compressed fixtures."""
+    count = 0
+
+    def canonical_rows():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield _canonical_json(row, decimal_places)
+
+    output_hash = _multiset_hash(canonical_rows())
+    return count, output_hash
+
+
+def _write_fixture(filename, outputs):
+    """Write the outputs of a test to a fixture file.
+
+    `.json` fixtures contain a JSON object with the rows of each output.
+    `.ndjson.gz` fixtures are gzip-compressed NDJSON files: the first line is a
+    header with the name, number of rows and hash of each output, followed by
+    the rows of each output in canonical order.
+    """
+    if not filename.endswith(".ndjson.gz"):
+        with open(filename, "w") as f:
+            f.write(json.dumps(outputs, indent=2, default=str))
+        return
+    header = {"outputs": []}
+    lines = []
+    for output_name, rows in outputs.items():
+        rows = sorted(
+            (_canonical_json(row), json.dumps(row, sort_keys=True))
+            for row in (_json_row(row) for row in rows)
+        )
+        header["outputs"].append(
+            {
+                "name": output_name,
+                "rows": len(rows),
+                "hash": _multiset_hash(canonical_row for canonical_row, _ in rows),
+            }
+        )
+        lines.extend(line for _, line in rows)
+    with open(filename, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            for line in lines:
+                f.write((line + "\n").encode("utf-8"))
+
+
+def _read_fixture_header(filename):
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+    return {output["name"]: output for output in header["outputs"]}
+
+
+def _read_fixture_rows(filename, output_name):
+    """Rows of an output from a compressed fixture, read as they are consumed."""
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        lines = substitute_lines(f)
+        for output in header["outputs"]:
+            for _ in range(output["rows"]):
+                line = next(lines)
+                if output["name"] == output_name:
+                    yield json.loads(line)
+            if output["name"] == output_name:
+                return
+
+
+def _verify_fixture(filename):
+    """Check that the header of a compressed fixture matches the rows it stores.
+
+    Tests trust the header hashes to skip comparing the rows, so a fixture
+    edited by hand would otherwise let a wrong output pass. It reads the whole
+    fixture, so it is run by `check` rather than by every test.
+    """
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        for output in header["outputs"]:
+            rows = (json.loads(line) for line in itertools.islice(f, output["rows"]))
+            if _output_hash(rows) != (output["rows"], output["hash"]):
+                raise AssertionError(
+                    f"Fixture {filename} doesn't match its header for output "
+                    f"'{output['name']}', capture it again"
+                )
+        if f.readline():
+            raise AssertionError(
+                f"Fixture {filename} has more rows than its header, capture it again"
+            )
+
+
+def _existing_fixture(component, test_id, local=False):
+    """Path of the fixture of a test, or None if it hasn't been captured."""
+    fixture_filename = _fixture_filename(component, test_id, local=local)
+    return fixture_filename if os.path.exists(fixture_filename) else None
+
+
+def _compare_output(component, test_id, output_name, rows, local=False):
+    if str(test_id).startswith("skip_"):
+        # Don't compare results, it will only throw an error
+        # if there is an issue when running on BigQuery
+        return None
+    fixture_filename = _fixture_filename(component, test_id)
+    if local:
+        # components without local fixtures are compared with the warehouse ones
+        fixture_filename = (
+            _existing_fixture(component, test_id, local=True) or fixture_filename
+        )
+    elif not os.path.exists(fixture_filename) and _existing_fixture(
+        component, test_id, local=True
+    ):
+        print(
+            f"Test '{test_id}' of component {component['name']} only has a local "
+            "fixture, capture it in the data warehouse to compare its results"
+        )
+        return None
+    if fixture_filename.endswith(".ndjson.gz"):
+        output = _read_fixture_header(fixture_filename)[output_name]
+        output_hash = _output_hash(_json_row(row) for row in rows)
+        if output_hash == (output["rows"], output["hash"]):
+            return OutputDiff([], [], [])
+        expected = _read_fixture_rows(fixture_filename, output_name)
+    else:
+        with open(fixture_filename, "r") as f:
+            expected = json.loads(substitute_vars(f.read()))[output_name]
+    return compare_outputs(
+        expected, (_json_row(row) for row in rows), decimal_places=3
+    )
+
+
+def test(component, jobs=1, force_upload=False, batch=False, local=False):
+    print("Testing extension...")
+    metadata = create_metadata()
+    backend = _backend(metadata, local)
+    backend.deploy(metadata)
+    results = _get_test_results(
+        metadata,
+        component,
+        jobs,
+        force_upload,
+        partial(_compare_output, local=local),
+        batch,
+        backend,
+    )
+
+    for component_name, component_results in results.items():
+        for test_id, diffs in component_results.items():
+            for output_name, diff in diffs.items():
+                if diff is not None and not diff.equal:
+                    raise AssertionError(
+                        f"Test '{test_id}' failed for component {component_name} and table {output_name}: "
+                        + diff.report()
+                    )
+    print("Extension correctly tested.")
+
+
+def _expected_test_tables(metadata):
     current_folder = os.path.dirname(os.path.abspath(__file__))
+    components_folder = os.path.join(current_folder, "components")
+    test_tables = set()
+    for component in metadata["components"]:
+        test_folder = os.path.join(components_folder, component["name"], "test")
+        if os.path.isdir(test_folder):
+            for filename in os.listdir(test_folder):
+                if filename.endswith(".ndjson"):
+                    test_tables.add(_test_table_id(component, filename).lower())
+    return test_tables
+
+
+def _is_leftover_table(table_id, created, metadata, test_tables):
+    """Whether a table is an output of a previous test run or a test table of a
+    component of the extension that does not belong to any of its test files.
+
+    Output tables are not named after their component, so they are only removed
+    once they are older than `CLEAN_MIN_AGE`, when they can no longer belong to
+    a test that is running, of this or another extension.
+    """
+    table_id = table_id.lower()
+    if re.fullmatch(r"_table_[0-9a-f]{32}", table_id):
+        return time.time() - created.timestamp() > CLEAN_MIN_AGE
+    return table_id not in test_tables and any(
+        table_id.startswith(f"_test_{component['name'].lower()}_")
+        for component in metadata["components"]
+    )
+
+
+def clean(dry_run=False):
+    """Remove leftover tables from the test dataset or schema.
+
+    That includes the old output tables of previous test runs (`_table_<uuid>`)
+    and the uploaded test tables of the components (`_test_<component>_*`) that
+    no longer have a test file. With `dry_run`, they are only listed.
+    """
+    print("Removing leftover test tables...")
+    metadata = create_metadata()
+    test_tables = _expected_test_tables(metadata)
+    removed = 0
+    if metadata["provider"] == "bigquery":
+        dataset_id = f"{os.getenv('BQ_TEST_PROJECT')}.{os.getenv('BQ_TEST_DATASET')}"
+        for table in bq_client().list_tables(dataset_id):
+            if _is_leftover_table(table.table_id, table.created, metadata, test_tables):
+                if verbose or dry_run:
+                    print(f"Removing {table.table_id}")
+                if not dry_run:
+                    bq_client().delete_table(table, not_found_ok=True)
+                removed += 1
+    else:
+        cursor = sf_client().cursor()
+        for table_id, table in _sf_tables("%").items():
+            if _is_leftover_table(table_id, table["created_on"], metadata, test_tables):
+                if verbose or dry_run:
+                    print(f"Removing {table_id}")
+                if not dry_run:
+                    cursor.execute(f"DROP TABLE IF EXISTS {sf_workflows_temp()}.{table_id}")
+                removed += 1
+        cursor.close()
+    if dry_run:
+        print(f"{removed} leftover tables would be removed (dry run).")
+    else:
+        print(f"{removed} leftover tables removed.")
+
+
+def _row_key(value, decimal_places=3):
+    """Hashable canonical form of a value from a test output.
+
+    Floats are rounded to `decimal_places`, and objects and lists are turned
+    into frozensets so that the order of their keys and items is ignored
+    (lists keep the number of occurrences of each item). Two values that are
+    equal for a test have equal keys.
+    """
+    if isinstance(value, dict):
+        return frozenset(
+            [
+                (
+                    column,
+                    item
+                    if type(item) in _PLAIN_TYPES
+                    else _row_key(item, decimal_places),
+                )
+                for column, item in value.items()
+            ]
+        )
+    elif isinstance(value, float):
+        return round(value, decimal_places) + 0.0
+    elif isinstance(value, (list, tuple)):
+        items = Counter(
+            [
+                item if type(item) in _PLAIN_TYPES else _row_key(item, decimal_places)
+                for item in value
+            ]
+        )
+        return frozenset(items.items())
+    return value
+
+
+_PLAIN_TYPES = {str, int, bool, type(None)}
+
+
+def _normalize_json(value, decimal_places=3):
+    """Ensure that a value from a test output is in a uniform format.
+
+    Floats are rounded to `decimal_places` (integral floats are turned into
+    integers) and the items of lists are sorted, so that values that are equal
+    for a test serialize in the same way.
+    """
+    if isinstance(value, dict):
+        return {
+            column: item
+            if type(item) in _PLAIN_TYPES
+            else _normalize_json(item, decimal_places)
+            for column, item in value.items()
+        }
+    elif isinstance(value, float):
+        value = round(value, decimal_places) + 0.0
+        return int(value) if value.is_integer() else value
+    elif isinstance(value, (list, tuple)):
+        return sorted(
+            [_normalize_json(item, decimal_places) for item in value],
+            key=_canonical_json,
+        )
+    return value
+
+
+def _canonical_json(value, decimal_places=3):
+    """Canonical JSON representation of a value from a test output."""
+    return json.dumps(_normalize_json(value, decimal_places), sort_keys=True)
+
+
+class OutputDiff:
+    """Differences between the expected and the actual rows of a test output.
+
+    `missing` and `extra` are the rows that are only in the expected or in the
+    actual output, and `changed` contains pairs of them that only differ in
+    some of their columns, as (expected row, actual row, columns) tuples.
+    """
+
+    def __init__(self, missing, extra, changed):
+        self.missing = missing
+        self.extra = extra
+        self.changed = changed
+
+    @property
+    def equal(self):
+        return not (self.missing or self.extra or self.changed)
+
+    def report(self, limit=10):
+        def plural(count, name):
+            return f"{count} {name}{'' if count == 1 else 's'}"
+
+        lines = [
+            f"{plural(len(self.changed), 'changed row')}, "
+            f"{plural(len(self.missing), 'missing row')}, "
+            f"{plural(len(self.extra), 'unexpected row')}."
+        ]
+        for expected, actual, columns in self.changed[:limit]:
+            lines.append(f"  changed: {json.dumps(expected, default=str)}")
+            for column in columns:
+                lines.append(
+                    f"    {column}: expected {json.dumps(expected.get(column), default=str)}, "
+                    f"got {json.dumps(actual.get(column), default=str)}"
+                )
+        for name, rows in [("missing", self.missing), ("unexpected", self.extra)]:
+            for row in rows[:limit]:
+                lines.append(f"  {name}: {json.dumps(row, default=str)}")
+        for name, rows in [
+            ("changed", self.changed),
+            ("missing", self.missing),
+            ("unexpected", self.extra),
+        ]:
+            if len(rows) > limit:
+                lines.append(f"  ... and {len(rows) - limit} more {name} rows")
+        return "\n".join(lines)
+
+
+def _pair_changed_rows(missing, extra, decimal_places):
+    """Pair missing and extra rows with the same columns that have at least half
+    of their values in common."""
+    changed = []
+    if len(missing) * len(extra) > 10**6:
+        return changed, missing, extra
+    extra_columns = [
+        {k: _row_key(v, decimal_places) for k, v in row.items()}
+        if isinstance(row, dict)
+        else None
+        for row in extra
+    ]
+    paired = set()
+    unpaired_missing = []
+    for row in missing:
+        best, best_equal = None, 0
+        if isinstance(row, dict):
+            columns = {k: _row_key(v, decimal_places) for k, v in row.items()}
+            for i, candidate in enumerate(extra_columns):
+                if i in paired or candidate is None or candidate.keys() != columns.keys():
+                    continue
+                equal = sum(1 for k in columns if columns[k] == candidate[k])
+                if equal > best_equal and equal * 2 >= len(columns):
+                    best, best_equal = i, equal
+        if best is None:
+            unpaired_missing.append(row)
+        else:
+            paired.add(best)
+            differences = [
+                k for k in columns if columns[k] != extra_columns[best][k]
+            ]
+            changed.append((row, extra[best], differences))
+    unpaired_extra = [row for i, row in enumerate(extra) if i not in paired]
+    return changed, unpaired_missing, unpaired_extra
+
+
+def compare_outputs(expected, result, decimal_places=3):
+    """Compare the expected and actual rows of a test output, ignoring their order.
+
+    Each row is normalized into a hashable canonical form once, and both outputs
+    are compared as multisets of rows in linear time. `result` can be any
+    iterable of rows, which is consumed once. Returns an OutputDiff.
+    """
+    counts = Counter()
+    rows = {}
+    for row in expected:
+        key = _row_key(row, decimal_places)
+        counts[key] += 1
+        rows.setdefault(key, row)
+    # actual rows are only kept if they are not expected, so `result` can be
+    # a stream of rows much larger than the memory available
+    extra = []
+    for row in result:
+        key = _row_key(row, decimal_places)
+        if counts.get(key, 0) > 0:
+            counts[key] -= 1
+        else:
+            extra.append(row)
+    missing = []
+    for key, count in counts.items():
+        if count > 0:
+            missing.extend([rows[key]] * count)
+    changed, missing, extra = _pair_changed_rows(missing, extra, decimal_places)
+    return OutputDiff(missing, extra, changed)
+
+
+def test_output(expected, result, decimal_places=3):
+    return compare_outputs(expected, result, decimal_places).equal
+
+
+def capture(
+    component,
+    jobs=1,
+    force_upload=False,
+    fixture_format="json",
+    batch=False,
+    local=False,
+):
+    print("Capturing fixtures... ")
     metadata = create_metadata()
-    sql_code = (
-        create_sql_code_bq(metadata)
-        if metadata["provider"] == "bigquery"
-        else create_sql_code_sf(metadata)
+    backend = _backend(metadata, local)
+    backend.deploy(metadata)
+    results = _get_test_results(
+        metadata, component, jobs, force_upload, _collect_output, batch, backend
     )
-    package_filename = os.path.join(current_folder, "extension.zip")
-    with zipfile.ZipFile(package_filename, "w") as z:
-        with z.open("metadata.json", "w") as f:
-            f.write(
-                json.dumps(add_namespace_to_component_names(metadata), indent=2).encode(
-                    "utf-8"
+    for component in metadata["components"]:
+        if component["name"] not in results:
+            continue
+        for test_id, outputs in results[component["name"]].items():
+            test_filename = _fixture_filename(
+                component, test_id, fixture_format, local
+            )
+            os.makedirs(os.path.dirname(test_filename), exist_ok=True)
+            _write_fixture(test_filename, outputs)
+            for other_format in FIXTURE_FORMATS:
+                # remove fixtures of the same test in other formats
+                other_filename = _fixture_filename(
+                    component, test_id, other_format, local
                 )
+                if other_format != fixture_format and os.path.exists(other_filename):
+                    os.remove(other_filename)
+    print("Fixtures correctly captured.")
+
+
+def _grid_network(rows, rng, spacing=0.001, span=5):
+    """Lines of a street grid, alternately horizontal and vertical.
+
+    Each line is `span` blocks long (with a vertex at every crossing), and the
+    lines of consecutive rows are staggered, so that every line crosses about
+    `span` others. The grid grows with the number of lines, so their density
+    is the same at every scale.
+    """
+    lines_per_orientation = math.ceil(rows / 2)
+    lines_per_row = max(1, math.ceil(math.sqrt(lines_per_orientation / span)))
+    for i in range(rows):
+        row, column = divmod(i // 2, lines_per_row)
+        start = column * span + row % span
+        points = [(row, start + k) for k in range(span + 1)]
+        if i % 2 == 0:
+            points = [(x, y) for y, x in points]
+        coordinates = ", ".join(
+            f"{round(x * spacing, 7)} {round(y * spacing, 7)}" for x, y in points
+        )
+        yield {"geoid": i, "geom": f"LINESTRING({coordinates})"}
+
+
+def _random_walk_network(rows, rng, vertices=10, step=0.001):
+    """Lines that start at random points and turn randomly at every vertex.
+
+    The lines are spread over an area that grows with their number, so that
+    each one crosses about as many others at every scale.
+    """
+    side = step * math.sqrt(rows * vertices)
+    for i in range(rows):
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+        heading = rng.uniform(0, 2 * math.pi)
+        points = [(x, y)]
+        for _ in range(vertices - 1):
+            heading += rng.uniform(-math.pi / 4, math.pi / 4)
+            x, y = x + step * math.cos(heading), y + step * math.sin(heading)
+            points.append((x, y))
+        coordinates = ", ".join(f"{round(x, 7)} {round(y, 7)}" for x, y in points)
+        yield {"geoid": i, "geom": f"LINESTRING({coordinates})"}
+
+
+BENCH_GENERATORS = {"grid": _grid_network, "random_walk": _random_walk_network}
+
+
+def _generate_bench_table(filename, rows, options):
+    """Write a synthetic table of a benchmark to an NDJSON file.
+
+    `options` has the name of the generator and its parameters, and an optional
+    random seed, so that the same table is generated in every run.
+    """
+    options = dict(options)
+    generator = BENCH_GENERATORS[options.pop("generator")]
+    rng = random.Random(options.pop("seed", 0))
+    with open(filename, "w") as f:
+        for row in generator(rows, rng, **options):
+            f.write(json.dumps(row) + "\n")
+
+
+def _run_bench_case(backend, component, case, scale, force_upload=False):
+    """Generate and upload the tables of a benchmark case at a scale (number of
+    rows), run the component on them and return the number of output rows, the
+    wall time and the warehouse statistics of the call."""
+    inputs = {param["name"]: param.get("default") for param in component["inputs"]}
+    inputs.update(case["inputs"])
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for table, options in case.get("tables", {}).items():
+            name = f"bench_{case['id']}_{table}_{scale}"
+            filename = os.path.join(tmp_folder, f"{name}.ndjson")
+            _generate_bench_table(filename, scale, options)
+            _upload_test_table(backend, filename, component, force_upload)
+            for input_name, value in case["inputs"].items():
+                if value == table:
+                    inputs[input_name] = name
+    test_configuration = {
+        "id": f"{case['id']}_{scale}",
+        "inputs": inputs,
+        "env_vars": case.get("env_vars", "{}"),
+    }
+    statistics = {}
+    start = time.perf_counter()
+    with _instrument("call", component["name"], test_configuration["id"]):
+        tables = backend.call_test(component, test_configuration, statistics)
+    statistics["seconds"] = round(time.perf_counter() - start, 3)
+    statistics["output_rows"] = sum(
+        backend.count_rows(tables[output["name"]]) for output in component["outputs"]
+    )
+    return statistics
+
+
+def _bench_machine():
+    """Description of the machine running the benchmarks, stored with the
+    baseline since wall times can only be compared on the same machine."""
+    import platform
+
+    return (
+        f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs, "
+        f"{platform.processor() or 'unknown processor'}, "
+        f"Python {platform.python_version()}"
+    )
+
+
+def _bench_regressions(result, expected, threshold, timing=False):
+    """Differences of a benchmark result with its baseline.
+
+    The number of output rows must be the same, and the other metrics must not
+    be above `threshold` times their baseline. Wall times are only compared if
+    `timing` is set.
+    """
+    regressions = []
+    if expected.get("output_rows") is not None and (
+        result["output_rows"] != expected["output_rows"]
+    ):
+        regressions.append(
+            f"output_rows {result['output_rows']} != {expected['output_rows']}"
+        )
+    metrics = BENCH_METRICS + (BENCH_TIMING_METRICS if timing else [])
+    regressions.extend(
+        f"{metric} {result[metric]} > {threshold} x {expected[metric]}"
+        for metric in metrics
+        if result.get(metric) is not None
+        and expected.get(metric)
+        and result[metric] > threshold * expected[metric]
+    )
+    return regressions
+
+
+def bench(
+    component_name,
+    force_upload=False,
+    local=False,
+    scales=None,
+    threshold=BENCH_THRESHOLD,
+    update_baseline=False,
+    timing=False,
+):
+    """Run the benchmarks of the components and compare them with their baseline.
+
+    The cases of each component are defined in its `bench/bench.json` file,
+    and are run at each of their scales (or at `scales`) with synthetic tables.
+    The results are compared with `bench/baseline.json`, which has the results
+    of each backend (the provider or "local") and the machine they were
+    recorded on, or written to it if `update_baseline` is set. Wall times are
+    only compared if `timing` is set.
+    """
+    print("Benchmarking extension...")
+    metadata = create_metadata()
+    backend = _backend(metadata, local)
+    backend.deploy(metadata)
+    backend_name = "local" if local else metadata["provider"]
+    machine = _bench_machine()
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    regressions = []
+    for component in metadata["components"]:
+        if component_name and component["name"] != component_name:
+            continue
+        bench_folder = os.path.join(current_folder, "components", component["name"], "bench")
+        if not os.path.exists(os.path.join(bench_folder, "bench.json")):
+            continue
+        with open(os.path.join(bench_folder, "bench.json")) as f:
+            cases = json.loads(substitute_vars(f.read()))
+        baseline_file = os.path.join(bench_folder, "baseline.json")
+        baselines = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                baselines = json.load(f)
+        baseline = baselines.setdefault(backend_name, {})
+        if timing and not update_baseline and baseline.get("machine", machine) != machine:
+            print(
+                f"Warning: the baseline of {component['name']} was recorded on "
+                f"{baseline['machine']}, wall times are not comparable."
             )
-        with z.open("extension.sql", "w") as f:
-            f.write(sql_code.encode("utf-8"))
+        for case in cases:
+            for scale in scales or case["scales"]:
+                result = _run_bench_case(backend, component, case, scale, force_upload)
+                expected = baseline.get(case["id"], {}).get(str(scale), {})
+                summary = ", ".join(
+                    f"{key} {value}"
+                    + (f" ({value / expected[key]:.2f}x)" if expected.get(key) else "")
+                    for key, value in result.items()
+                    if value is not None
+                )
+                print(f"{component['name']} {case['id']} x{scale}: {summary}")
+                for regression in _bench_regressions(result, expected, threshold, timing):
+                    regressions.append(
+                        f"{component['name']} {case['id']} x{scale}: {regression}"
+                    )
+                if update_baseline:
+                    baseline.setdefault(case["id"], {})[str(scale)] = {
+                        metric: result[metric]
+                        for metric in ["output_rows"] + BENCH_METRICS + BENCH_TIMING_METRICS
+                        if result.get(metric) is not None
+                    }
+        if update_baseline:
+            baseline["machine"] = machine
+            with open(baseline_file, "w") as f:
+                f.write(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+    if regressions and not update_baseline:
+        raise AssertionError(
+            "Benchmark regressions against the baseline:\n" + "\n".join(regressions)
+        )
+    if update_baseline:
+        print("Benchmark baselines correctly updated.")
+    else:
+        print("Extension correctly benchmarked.")
+
+
+def _package_source_hash():
+    """Hash of the files the extension package is generated from, this script included."""
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    metadata_file = os.path.join(current_folder, "metadata.json")
+    with open(metadata_file, "r") as f:
+        metadata = json.load(f)
+    paths = [os.path.abspath(__file__), metadata_file]
+    icons = {metadata.get("icon")}
+    for component in metadata["components"]:
+        component_files = _component_files(component, metadata["provider"])
+        paths.extend(component_files)
+        with open(component_files[0], "r") as f:
+            icons.add(json.load(f).get("icon"))
+    for icon in sorted(icon for icon in icons if icon):
+        paths.append(os.path.join(current_folder, "icons", icon))
+    source_hash = hashlib.sha256()
+    for path in paths:
+        source_hash.update(os.path.relpath(path, current_folder).encode("utf-8"))
+        with open(path, "rb") as f:
+            source_hash.update(hashlib.sha256(f.read()).digest())
+    return source_hash.hexdigest()
+
+
+def _write_package_file(z, name, content):
+    """Add a file to a package with fixed metadata, so that packages are reproducible."""
+    info = zipfile.ZipInfo(name, date_time=PACKAGE_TIMESTAMP)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.create_system = 3
+    info.external_attr = 0o644 << 16
+    z.writestr(info, content, compresslevel=9)
+
+
+def package():
+    print("Packaging extension...")
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    package_filename = os.path.join(current_folder, "extension.zip")
+    package_comment = f"{PACKAGE_HASH_PREFIX}{_package_source_hash()}".encode("utf-8")
+    try:
+        with zipfile.ZipFile(package_filename, "r") as z:
+            if z.comment == package_comment:
+                print(f"Extension package '{package_filename}' is up to date.")
+                return
+    except (OSError, zipfile.BadZipFile):
+        pass
+    metadata = create_metadata()
+    if metadata["provider"] == "bigquery":
+        sql_code = create_sql_code_bq(metadata)
+        _print_script_size(sql_code, metadata, get_procedure_code_bq)
+    else:
+        sql_code = create_sql_code_sf(metadata)
+        _print_script_size(sql_code, metadata, get_procedure_code_sf)
+    with zipfile.ZipFile(package_filename + ".tmp", "w") as z:
+        _write_package_file(
+            z,
+            "metadata.json",
+            json.dumps(add_namespace_to_component_names(metadata), indent=2).encode(
+                "utf-8"
+            ),
+        )
+        _write_package_file(z, "extension.sql", sql_code.encode("utf-8"))
+        z.comment = package_comment
+    os.replace(package_filename + ".tmp", package_filename)
 
     print(f"Extension correctly packaged to '{package_filename}' file.")
 
@@ -724,6 +2996,8 @@ def download_file(
     remote_url: str = "https://raw.githubusercontent.com/CartoDB/workflows-extension-template",
     remote_branch: str = "master",
 ):
+    import urllib.request
+
     complete_url = f"{remote_url}/{remote_branch}/{path_to_file}"
     complete_path = f"{destination_dir}/{path_to_file}"
 
@@ -790,19 +3064,24 @@ def _param_type_to_sf_type(param_type):
 
 def check():
     print("Checking extension...")
-    current_folder = os.path.dirname(os.path.abspath(__file__))
     metadata = create_metadata()
-    components_folder = os.path.join(current_folder, "components")
     for component in metadata["components"]:
-        component_folder = os.path.join(components_folder, component["name"])
-        component_metadata_file = os.path.join(component_folder, "metadata.json")
-        with open(component_metadata_file, "r") as f:
-            component_metadata = json.load(f)
+        component_metadata = load_component(component["name"], metadata["provider"])[
+            "metadata"
+        ]
         required_fields = ["name", "title", "description", "icon", "version"]
         for field in required_fields:
             assert (
                 field in component_metadata
             ), f"Component metadata is missing field '{field}'"
+        for local in (False, True):
+            fixtures_folder = os.path.dirname(
+                _fixture_filename(component, "", "json", local)
+            )
+            if os.path.isdir(fixtures_folder):
+                for filename in sorted(os.listdir(fixtures_folder)):
+                    if filename.endswith(".ndjson.gz"):
+                        _verify_fixture(os.path.join(fixtures_folder, filename))
     required_fields = [
         "name",
         "title",
@@ -822,39 +3101,286 @@ def check():
     print("Extension correctly checked. No errors found.")
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "action",
-    nargs=1,
-    type=str,
-    choices=["package", "deploy", "test", "capture", "check", "update"],
-)
-parser.add_argument("-c", "--component", help="Choose one component", type=str)
-parser.add_argument(
-    "-d",
-    "--destination",
-    help="Choose an specific destination",
-    type=str,
-    required="deploy" in argv,
-)
-parser.add_argument("-v", "--verbose", help="Verbose mode", action="store_true")
-args = parser.parse_args()
-action = args.action[0]
-verbose = args.verbose
-if args.component and action not in ["capture", "test"]:
-    parser.error("Component can only be used with 'capture' and 'test' actions")
-if args.destination and action not in ["deploy"]:
-    parser.error("Destination can only be used with 'deploy' action")
-if action == "package":
+def _watched_files():
+    """Size and modification time of the files that the extension is built from."""
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    files = {}
+    paths = [os.path.join(current_folder, "metadata.json")]
+    for folder in ["components", "icons"]:
+        for root, _, filenames in os.walk(os.path.join(current_folder, folder)):
+            paths.extend(os.path.join(root, filename) for filename in filenames)
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files[os.path.relpath(path, current_folder)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def _rebuild_changes(changed_files, deploy_changes=False):
+    """Check, package and optionally deploy the extension after some files changed.
+
+    Only the procedures of the components with changed files are generated
+    again (unchanged files are served by the build cache), and the deployment
+    is incremental, so only the procedures of those components are recreated.
+    """
+    changed_components = set()
+    for path in changed_files:
+        parts = path.replace(os.sep, "/").split("/")
+        if parts[0] == "components" and len(parts) > 2:
+            changed_components.add(parts[1])
+        elif parts[0] == "icons":
+            encoded_images.clear()
     check()
+    metadata = create_metadata()
+    if metadata["provider"] == "bigquery":
+        get_procedure_code = get_procedure_code_bq
+    else:
+        get_procedure_code = get_procedure_code_sf
+    for component in metadata["components"]:
+        if component["name"] in changed_components:
+            procedure_code = get_procedure_code(component)
+            print(
+                f"Generated procedure {component['procedureName']} "
+                f"({len(procedure_code.encode('utf-8')) / 1024:.1f} KiB)."
+            )
     package()
-elif action == "deploy":
-    deploy(args.destination)
-elif action == "test":
-    test(args.component)
-elif action == "capture":
-    capture(args.component)
-elif action == "check":
-    check()
-elif action == "update":
-    update()
+    if deploy_changes:
+        if metadata["provider"] == "bigquery":
+            deploy_bq(metadata, None, incremental=True)
+        else:
+            deploy_sf(metadata, None, incremental=True)
+
+
+def watch(deploy_changes=False):
+    """Rebuild the extension whenever its files change, until interrupted.
+
+    Files are polled every WATCH_INTERVAL seconds, and changes are only
+    processed once no file has changed for WATCH_DEBOUNCE seconds, so that
+    saving several files at once triggers a single rebuild.
+    """
+    print("Watching extension files for changes. Press Ctrl+C to stop.")
+    files = _watched_files()
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current_files = _watched_files()
+            if current_files == files:
+                continue
+            while True:
+                time.sleep(WATCH_DEBOUNCE)
+                latest_files = _watched_files()
+                if latest_files == current_files:
+                    break
+                current_files = latest_files
+            changed_files = [
+                path
+                for path in sorted(set(files) | set(current_files))
+                if files.get(path) != current_files.get(path)
+            ]
+            files = current_files
+            print(f"Changed files: {', '.join(changed_files)}")
+            try:
+                _rebuild_changes(changed_files, deploy_changes)
+            except Exception as e:
+                print(f"Error: {e}")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def main():
+    global verbose
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "action",
+        nargs=1,
+        type=str,
+        choices=[
+            "package",
+            "deploy",
+            "test",
+            "capture",
+            "check",
+            "update",
+            "clean",
+            "watch",
+            "bench",
+        ],
+    )
+    parser.add_argument("-c", "--component", help="Choose one component", type=str)
+    parser.add_argument(
+        "-d",
+        "--destination",
+        help="Choose an specific destination",
+        type=str,
+        required="deploy" in argv,
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        help="Only recreate the procedures whose code has changed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of test cases to run concurrently",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--force-upload",
+        help="Upload test tables even if they are up to date",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="Run all the tests of a component in a single warehouse script",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l",
+        "--local",
+        help="Run the tests in a local DuckDB database instead of the data warehouse",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fixture-format",
+        help="Format of the captured fixtures",
+        choices=FIXTURE_FORMATS,
+    )
+    parser.add_argument(
+        "--deploy",
+        help="Deploy the changed components to the test dataset or schema",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--scales",
+        help="Comma-separated numbers of rows of the benchmark tables (instead of those of bench.json)",
+        type=lambda value: [int(scale) for scale in value.split(",")],
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Ratio to the baseline above which a benchmark fails",
+        type=float,
+        default=BENCH_THRESHOLD,
+    )
+    parser.add_argument(
+        "--timing",
+        help="Also compare the benchmark wall times with the baseline",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        help="Write the benchmark results as the new baseline",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--report",
+        help="Write a JSON report of the warehouse calls (uploads, deployment, calls and fetches)",
+    )
+    parser.add_argument(
+        "--trace", help="Write the warehouse calls as a Chrome trace file"
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="List the tables that clean would remove without removing them",
+        action="store_true",
+    )
+    parser.add_argument("-v", "--verbose", help="Verbose mode", action="store_true")
+    args = parser.parse_args()
+    action = args.action[0]
+    verbose = args.verbose
+    if args.component and action not in ["capture", "test", "bench"]:
+        parser.error(
+            "Component can only be used with 'capture', 'test' and 'bench' actions"
+        )
+    if args.destination and action not in ["deploy"]:
+        parser.error("Destination can only be used with 'deploy' action")
+    if args.incremental and action not in ["deploy"]:
+        parser.error("Incremental can only be used with 'deploy' action")
+    if args.jobs != 1 and action not in ["capture", "test"]:
+        parser.error("Jobs can only be used with 'capture' and 'test' actions")
+    if args.force_upload and action not in ["capture", "test", "bench"]:
+        parser.error(
+            "Force upload can only be used with 'capture', 'test' and 'bench' actions"
+        )
+    if args.batch and action not in ["capture", "test"]:
+        parser.error("Batch can only be used with 'capture' and 'test' actions")
+    if args.local and action not in ["capture", "test", "bench"]:
+        parser.error("Local can only be used with 'capture', 'test' and 'bench' actions")
+    if args.fixture_format and action not in ["capture"]:
+        parser.error("Fixture format can only be used with 'capture' action")
+    if args.deploy and action not in ["watch"]:
+        parser.error("Deploy can only be used with 'watch' action")
+    if (
+        args.scales
+        or args.threshold != BENCH_THRESHOLD
+        or args.timing
+        or args.update_baseline
+    ) and action not in ["bench"]:
+        parser.error(
+            "Scales, threshold, timing and update baseline can only be used with 'bench' action"
+        )
+    if (args.report or args.trace) and action not in ["deploy", "test", "capture", "bench"]:
+        parser.error(
+            "Report and trace can only be used with 'deploy', 'test', 'capture' and 'bench' actions"
+        )
+    if args.dry_run and action not in ["clean"]:
+        parser.error("Dry run can only be used with 'clean' action")
+    if args.jobs < 1:
+        parser.error("Jobs must be a positive number")
+    if args.report or args.trace:
+        start_instrumentation()
+    try:
+        _run_action(action, args)
+    finally:
+        if args.report or args.trace:
+            write_instrumentation(args.report, args.trace)
+
+
+def _run_action(action, args):
+    if action == "package":
+        check()
+        package()
+    elif action == "deploy":
+        deploy(args.destination, args.incremental)
+    elif action == "test":
+        test(args.component, args.jobs, args.force_upload, args.batch, args.local)
+    elif action == "capture":
+        capture(
+            args.component,
+            args.jobs,
+            args.force_upload,
+            args.fixture_format or "json",
+            args.batch,
+            args.local,
+        )
+    elif action == "check":
+        check()
+    elif action == "update":
+        update()
+    elif action == "clean":
+        clean(args.dry_run)
+    elif action == "watch":
+        watch(args.deploy)
+    elif action == "bench":
+        bench(
+            args.component,
+            args.force_upload,
+            args.local,
+            args.scales,
+            args.threshold,
+            args.update_baseline,
+            args.timing,
+        )
+
+
+if __name__ == "__main__":
+    main()
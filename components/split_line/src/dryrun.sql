@@ -5,7 +5,7 @@ AS
 SELECT 
     r.* EXCEPT (geom),  
     NULL AS segmentid,  
-    NULL AS segment_wkt,  
+    ''' || IF(include_segment_wkt, 'NULL AS segment_wkt,', '') || '''
     NULL AS geom,  
     NULL AS segment_length_km  
 FROM ''' || input_table || ''' r
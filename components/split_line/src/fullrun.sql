@@ -1,163 +1,231 @@
--- Step 1: Create the output table dynamically
-EXECUTE IMMEDIATE '''
-  CREATE OR REPLACE TABLE ''' || output_table || '''
+-- Step 0: Query for the pairs of intersecting lines and their intersection,
+-- computed once per pair (a.id < b.id) and later assigned to both lines.
+-- With a cell level, the lines are first assigned to the S2 cells that cover
+-- them, and only the lines that share a cell are compared.
+DECLARE pairs_query STRING DEFAULT IF(
+  cell_level IS NULL OR cell_level <= 0,
+  '''
+    SELECT
+      a.''' || user_column || ''' AS id_a,
+      b.''' || user_column || ''' AS id_b,
+      ST_INTERSECTION(a.geom, b.geom) AS inter
+    FROM ''' || input_table || ''' a
+    JOIN ''' || input_table || ''' b
+      ON a.''' || user_column || ''' < b.''' || user_column || '''
+         AND ST_INTERSECTS(a.geom, b.geom)
+  ''',
+  '''
+    WITH cells AS (
+      SELECT r.''' || user_column || ''' AS id, cell
+      FROM ''' || input_table || ''' r,
+        UNNEST(S2_COVERINGCELLIDS(
+          r.geom,
+          min_level => ''' || CAST(CAST(cell_level AS INT64) AS STRING) || ''',
+          max_level => ''' || CAST(CAST(cell_level AS INT64) AS STRING) || ''',
+          max_cells => 1000000
+        )) AS cell
+    ),
+    candidates AS (
+      SELECT DISTINCT a.id AS id_a, b.id AS id_b
+      FROM cells a
+      JOIN cells b
+        ON a.cell = b.cell AND a.id < b.id
+    )
+    SELECT
+      c.id_a,
+      c.id_b,
+      ST_INTERSECTION(a.geom, b.geom) AS inter
+    FROM candidates c
+    JOIN ''' || input_table || ''' a
+      ON a.''' || user_column || ''' = c.id_a
+    JOIN ''' || input_table || ''' b
+      ON b.''' || user_column || ''' = c.id_b
+    WHERE ST_INTERSECTS(a.geom, b.geom)
+  '''
+);
+
+-- Incremental mode: with a table of changed (or deleted) line IDs or a change
+-- timestamp column, only the changed lines and the lines that intersect them
+-- (before or after the change) are split again, and merged into the output
+-- table of a previous run (optional inputs left empty are given as '')
+DECLARE changed_lines_table STRING DEFAULT NULLIF(changes_table, '');
+DECLARE timestamp_column STRING DEFAULT NULLIF(change_timestamp_column, '');
+DECLARE incremental BOOL DEFAULT
+  NULLIF(changes_table, '') IS NOT NULL OR NULLIF(change_timestamp_column, '') IS NOT NULL;
+DECLARE changed_ids ARRAY<STRING> DEFAULT [];
+DECLARE affected_ids ARRAY<STRING> DEFAULT [];
+DECLARE lines_query STRING DEFAULT input_table;
+DECLARE intersections_query STRING;
+DECLARE segments_query STRING;
+
+-- Step 1: Create the output table dynamically (in incremental mode, an
+-- existing output table is kept and its expiration extended)
+EXECUTE IMMEDIATE
+  IF(incremental, 'CREATE TABLE IF NOT EXISTS ', 'CREATE OR REPLACE TABLE ') || output_table || '''
   OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 30 DAY))
   AS 
   SELECT 
       r.* EXCEPT (geom),  
       CAST(NULL AS INT64) AS segmentid,            -- segmented line identifier
-      CAST(NULL AS STRING) AS segment_wkt,         -- segmented line as WKT
+      ''' || IF(include_segment_wkt, '''
+      CAST(NULL AS STRING) AS segment_wkt,         -- segmented line as WKT''', '') || '''
       CAST(NULL AS GEOGRAPHY) AS geom,             -- new geometry (GEOGRAPHY type)
       CAST(NULL AS FLOAT64) AS segment_length_km   -- length in km
   FROM ''' || input_table || ''' r
   WHERE 1 = 0;
   ''';
 
+IF incremental THEN
+  EXECUTE IMMEDIATE '''
+    ALTER TABLE ''' || output_table || '''
+    SET OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 30 DAY))
+  ''';
+  -- an empty output table is computed in full
+  EXECUTE IMMEDIATE '''
+    SELECT COUNT(*) > 0 FROM (SELECT 1 FROM ''' || output_table || ''' LIMIT 1)
+  ''' INTO incremental;
+END IF;
+
 
 -- Step 2: Define the JavaScript UDF for splitting road segments at intersections
+-- The line is given as GeoJSON and the points and segments as coordinates,
+-- to avoid formatting and parsing WKT text
 CREATE TEMP FUNCTION splitLineAtPoints(
-  line_wkt STRING, pts_wkt ARRAY<STRING>, tolerance FLOAT64
-) RETURNS ARRAY<STRUCT<segmentid INT64, segment_wkt STRING>> 
-LANGUAGE js AS """
-function parsePoint(wkt) {
-  try {
-    var inner = wkt.replace(/^POINT\\(/, "").replace(/\\)$/, "");
-    var parts = inner.split(" ");
-    return { x: parseFloat(parts[0]), y: parseFloat(parts[1]) };
-  } catch (err) {
-    return null;
-  }
-}
-
-function parseLine(wkt) {
-  var inner = wkt.replace(/^LINESTRING\\(/, "").replace(/\\)$/, "");
-  var parts = inner.split(",");
-  return parts.map(function(part) {
-    var coords = part.trim().split(" ");
-    return { x: parseFloat(coords[0]), y: parseFloat(coords[1]) };
-  });
-}
-
-function lineWKT(points) {
-  return "LINESTRING(" + points.map(pt => pt.x + " " + pt.y).join(", ") + ")";
-}
-
-function distance(a, b) {
-  var dx = b.x - a.x, dy = b.y - a.y;
-  return Math.sqrt(dx * dx + dy * dy);
-}
-
-function interpolatePoint(line, d) {
-  var cum = 0;
-  for (var i = 0; i < line.length - 1; i++) {
-    var a = line[i], b = line[i+1];
-    var segLen = distance(a, b);
-    if (cum + segLen >= d) {
-      var t = (d - cum) / segLen;
-      return { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
-    }
-    cum += segLen;
-  }
-  return line[line.length - 1];
-}
-
-function cumulativeDistances(line) {
-  var cum = [0];
-  for (var i = 1; i < line.length; i++) {
-    cum.push(cum[i - 1] + distance(line[i - 1], line[i]));
-  }
-  return cum;
-}
-
-function splitLineAtPoints(line_wkt, pts_wkt, tolerance) {
-  tolerance = tolerance || 1e-6;
-  var line = parseLine(line_wkt);
-  var cum = cumulativeDistances(line);
-  var totalLength = cum[cum.length - 1];
-  var projections = [];
-
-  pts_wkt.forEach(function(ptWKT) {
-    var pt = parsePoint(ptWKT);
-    if (pt === null) return;
-    var bestProj = null;
-    var bestError = 1e9;
-    for (var i = 0; i < line.length - 1; i++) {
-      var a = line[i], b = line[i+1];
-      var segLen = distance(a, b);
-      if (segLen === 0) continue;
-
-      var t = ((pt.x - a.x) * (b.x - a.x) + (pt.y - a.y) * (b.y - a.y)) / (segLen * segLen);
-      t = Math.max(0, Math.min(1, t));
-      var proj = { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
-      var err = distance(pt, proj);
-      
-      if (err < bestError) {
-        bestError = err;
-        bestProj = cum[i] + t * segLen;
-      }
-    }
-    if (bestProj !== null) {
-      projections.push(bestProj);
-    }
-  });
-
-  projections.push(0);
-  projections.push(totalLength);
-  projections.sort((a, b) => a - b);
-
-  var unique = projections.filter((d, i) => i === 0 || Math.abs(d - projections[i - 1]) > tolerance);
-  var segments = [];
-  for (var i = 0; i < unique.length - 1; i++) {
-    var d_start = unique[i];
-    var d_end = unique[i+1];
-    var segPoints = [interpolatePoint(line, d_start)];
-
-    for (var j = 0; j < cum.length; j++) {
-      if (cum[j] > d_start && cum[j] < d_end) {
-        segPoints.push(line[j]);
-      }
-    }
-
-    segPoints.push(interpolatePoint(line, d_end));
-    segments.push({ segmentid: i, segment_wkt: lineWKT(segPoints) });
-  }
-
-  return segments;
-}
-
-return splitLineAtPoints(line_wkt, pts_wkt, tolerance);
-""";
+  line_geojson STRING, pts ARRAY<STRUCT<x FLOAT64, y FLOAT64>>, tolerance FLOAT64
+) RETURNS ARRAY<STRUCT<segmentid INT64, coords ARRAY<STRUCT<x FLOAT64, y FLOAT64>>>>
+LANGUAGE js AS @@split_line_at_points.js@@;
+
+-- Step 3: Find the lines to split: all of them, or in incremental mode the
+-- changed lines and the lines that intersect their new or previous geometry
+SET intersections_query = '''
+  SELECT rid, inter FROM (''' || pairs_query || '''), UNNEST([id_a, id_b]) AS rid
+''';
+
+IF incremental THEN
+  IF changed_lines_table IS NOT NULL THEN
+    EXECUTE IMMEDIATE '''
+      SELECT ARRAY(
+        SELECT DISTINCT CAST(''' || user_column || ''' AS STRING)
+        FROM ''' || changed_lines_table || '''
+        WHERE ''' || user_column || ''' IS NOT NULL
+      )
+    ''' INTO changed_ids;
+  END IF;
+  IF timestamp_column IS NOT NULL THEN
+    -- lines modified after the last change already in the output, and lines
+    -- deleted from the input since then
+    EXECUTE IMMEDIATE '''
+      SELECT ARRAY_CONCAT(@changed_ids, ARRAY(
+        SELECT CAST(r.''' || user_column || ''' AS STRING)
+        FROM ''' || input_table || ''' r
+        WHERE r.''' || timestamp_column || ''' > (
+          SELECT MAX(''' || timestamp_column || ''') FROM ''' || output_table || '''
+        )
+        UNION DISTINCT
+        SELECT CAST(o.''' || user_column || ''' AS STRING)
+        FROM ''' || output_table || ''' o
+        LEFT JOIN ''' || input_table || ''' r
+          ON r.''' || user_column || ''' = o.''' || user_column || '''
+        WHERE r.''' || user_column || ''' IS NULL
+      ))
+    ''' INTO changed_ids USING changed_ids AS changed_ids;
+  END IF;
+
+  EXECUTE IMMEDIATE '''
+    SELECT ARRAY(
+      SELECT id FROM UNNEST(@changed_ids) AS id
+      UNION DISTINCT
+      -- lines that intersect a changed line
+      SELECT CAST(r.''' || user_column || ''' AS STRING)
+      FROM ''' || input_table || ''' r
+      JOIN ''' || input_table || ''' c
+        ON ST_INTERSECTS(r.geom, c.geom)
+      WHERE CAST(c.''' || user_column || ''' AS STRING) IN UNNEST(@changed_ids)
+      UNION DISTINCT
+      -- lines that intersected a changed or deleted line before the change
+      SELECT CAST(r.''' || user_column || ''' AS STRING)
+      FROM ''' || input_table || ''' r
+      JOIN ''' || output_table || ''' o
+        ON ST_INTERSECTS(r.geom, o.geom)
+      WHERE CAST(o.''' || user_column || ''' AS STRING) IN UNNEST(@changed_ids)
+    )
+  ''' INTO affected_ids USING changed_ids AS changed_ids;
+
+  -- the affected lines are joined with all the lines they intersect, so
+  -- that the pairs are not restricted to a.id < b.id
+  SET lines_query = '''(
+    SELECT * FROM ''' || input_table || '''
+    WHERE CAST(''' || user_column || ''' AS STRING) IN UNNEST(@affected_ids)
+  )''';
+  SET intersections_query = '''
+    SELECT
+      a.''' || user_column || ''' AS rid,
+      ST_INTERSECTION(a.geom, b.geom) AS inter
+    FROM ''' || input_table || ''' a
+    JOIN ''' || input_table || ''' b
+      ON a.''' || user_column || ''' <> b.''' || user_column || '''
+         AND ST_INTERSECTS(a.geom, b.geom)
+    WHERE CAST(a.''' || user_column || ''' AS STRING) IN UNNEST(@affected_ids)
+  ''';
+END IF;
 
--- Step 3: Insert split road segments into output_table
-EXECUTE IMMEDIATE '''
-INSERT INTO ''' || output_table || '''
-SELECT * FROM (
+-- Step 4: Split the lines at their intersections
+SET segments_query = '''
   WITH intersections AS (
     SELECT
-      r.''' || user_column || ''' AS rid,  -- Dynamically use user-defined column
-      ARRAY_AGG(ST_ASTEXT(ST_INTERSECTION(r.geom, other.geom)) IGNORE NULLS) AS inter_pts
-    FROM ''' || input_table || ''' r
-    JOIN ''' || input_table || ''' other
-      ON r.''' || user_column || ''' <> other.''' || user_column || '''
-         AND ST_INTERSECTS(r.geom, other.geom)
-    GROUP BY r.''' || user_column || '''
+      rid,  -- value of the user-defined column
+      ARRAY_AGG(STRUCT(ST_X(pt) AS x, ST_Y(pt) AS y)) AS inter_pts
+    FROM (''' || intersections_query || '''), UNNEST(ST_DUMP(inter, 0)) AS pt
+    GROUP BY rid
+  ),
+  segments AS (
+    -- each segment geography is built once, from the coordinates returned by the UDF
+    SELECT
+      r.* EXCEPT (geom),
+      seg.segmentid,
+      ST_MAKELINE(ARRAY(
+        SELECT ST_GEOGPOINT(c.x, c.y) FROM UNNEST(seg.coords) AS c WITH OFFSET AS o ORDER BY o
+      )) AS geom
+    FROM ''' || lines_query || ''' r
+    LEFT JOIN intersections i
+      ON r.''' || user_column || ''' = i.rid
+    CROSS JOIN UNNEST(
+      splitLineAtPoints(
+        ST_ASGEOJSON(r.geom),
+        IFNULL(i.inter_pts, []),
+        ''' || tolerance || '''  -- Inject tolerance from metadata.json
+      )
+    ) AS seg
+  ),
+  measured_segments AS (
+    SELECT *, ST_LENGTH(geom) / 1000 AS segment_length_km
+    FROM segments
   )
   SELECT
-    r.* EXCEPT (geom),
-    seg.segmentid,
-    seg.segment_wkt,
-    ST_GEOGFROMTEXT(seg.segment_wkt) AS geom,
-    ST_LENGTH(ST_GEOGFROMTEXT(seg.segment_wkt)) / 1000 AS segment_length_km
-  FROM ''' || input_table || ''' r
-  LEFT JOIN intersections i
-    ON r.''' || user_column || ''' = i.rid
-  CROSS JOIN UNNEST(
-    splitLineAtPoints(
-      ST_ASTEXT(r.geom),
-      IFNULL(i.inter_pts, []),
-      ''' || tolerance || '''  -- Inject tolerance from metadata.json
-    )
-  ) AS seg
-  WHERE ST_LENGTH(ST_GEOGFROMTEXT(seg.segment_wkt)) > 0
-);
-''';
\ No newline at end of file
+    * EXCEPT (geom, segment_length_km),
+    ''' || IF(include_segment_wkt, 'ST_ASTEXT(geom) AS segment_wkt,', '') || '''
+    geom,
+    segment_length_km
+  FROM measured_segments
+  WHERE segment_length_km > 0
+''';
+
+-- Step 5: Insert split road segments into output_table, or in incremental
+-- mode replace the previous segments of the affected lines
+IF NOT incremental THEN
+  EXECUTE IMMEDIATE '''
+  INSERT INTO ''' || output_table || '''
+  SELECT * FROM (''' || segments_query || ''');
+  ''';
+ELSEIF ARRAY_LENGTH(affected_ids) > 0 THEN
+  EXECUTE IMMEDIATE '''
+  MERGE ''' || output_table || ''' T
+  USING (''' || segments_query || ''') S
+  ON FALSE
+  WHEN NOT MATCHED BY SOURCE
+    AND CAST(T.''' || user_column || ''' AS STRING) IN UNNEST(@affected_ids) THEN
+    DELETE
+  WHEN NOT MATCHED THEN
+    INSERT ROW
+  ''' USING affected_ids AS affected_ids;
+END IF;
@@ -0,0 +1,148 @@
+"""Local reference engine of the split_line component.
+
+Splits the lines of a table at their intersections without a data warehouse,
+with the same output schema as the procedure: the columns of the input table
+(but `geom`), `segmentid`, `segment_wkt` (optionally), `geom` and
+`segment_length_km`. The candidate intersections of all the lines are found
+with a single bulk query of a shapely STRtree, intersected at once, and the
+lines are split by the vectorized `split_lines` module, as in the Snowflake
+UDF. It is run by `carto_extension.py test --local` and `capture --local`, and
+can be run on the NDJSON files of the tests, e.g. to profile large networks:
+
+    $ python components/split_line/src/local.py roads.ndjson -o segments.ndjson
+
+Intersections are computed in the plane (the data warehouses compute them on
+the sphere), which only makes a difference for long edges, and lengths on a
+sphere, as `ST_LENGTH`. `cell_level` only limits the pairs of lines that are
+compared, so it is ignored. `changes_table` and `change_timestamp_column` are
+ignored too: there is no output table of a previous run to update, so all the
+lines are always split, as the procedure does when the output table is empty.
+Incremental runs can only be tested in the data warehouses. As in the
+procedures, geometries other than LINESTRINGs (e.g. MULTILINESTRINGs) are
+rejected with an error.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from split_lines import _split_batch  # noqa: E402
+
+EARTH_RADIUS_M = 6371008.8  # mean radius, as BigQuery's ST_LENGTH
+
+
+def fullrun(inputs):
+    """Run the component with the values of its inputs (tables as lists of
+    rows, with geographies as WKT) and return the rows of its output table."""
+    return {
+        "output_table": split_line(
+            inputs["input_table"],
+            inputs.get("user_column") or "geoid",
+            inputs.get("tolerance"),
+            inputs.get("include_segment_wkt", True),
+        )
+    }
+
+
+def split_line(rows, user_column="geoid", tolerance=1e-6, include_segment_wkt=True):
+    """Split the lines of some rows (with a `geom` column as WKT) at their
+    intersections with the other lines, and return the output rows."""
+    rows = [row for row in rows if row.get("geom") is not None]
+    if rows and user_column not in rows[0]:
+        raise KeyError(f"Column '{user_column}' not found in the input table")
+    lines = shapely.from_wkt([row["geom"] for row in rows])
+    ids = np.array([row[user_column] for row in rows], dtype=object)
+
+    # points of the intersections of each pair of lines (with different IDs),
+    # for both of them
+    tree = shapely.STRtree(lines)
+    a, b = tree.query(lines, predicate="intersects")
+    pair = (a < b) & (ids[a] != ids[b])
+    a, b = a[pair], b[pair]
+    parts, pairs = shapely.get_parts(
+        shapely.intersection(lines[a], lines[b]), return_index=True
+    )
+    is_point = (shapely.get_type_id(parts) == 0) & ~shapely.is_empty(parts)
+    pts = shapely.get_coordinates(parts[is_point])
+    pairs = pairs[is_point]
+    coords, ends, segment_lines = _split_batch(
+        lines,
+        np.concatenate([pts, pts]),
+        np.concatenate([a[pairs], b[pairs]]),
+        tolerance,
+    )
+
+    starts = np.concatenate([[0], ends[:-1]]).astype(int)
+    segment_index = np.repeat(np.arange(len(ends)), ends - starts)
+    segments = shapely.linestrings(coords, indices=segment_index)
+    lengths = _segment_lengths(coords, segment_index, len(ends)) / 1000
+    # segments are sorted by line, and numbered from 0 in each line
+    segment_ids = np.arange(len(ends)) - np.searchsorted(segment_lines, segment_lines)
+    wkts = [
+        wkt.replace(" (", "(", 1)
+        for wkt in shapely.to_wkt(segments, rounding_precision=-1)
+    ]
+
+    output = []
+    for i in np.flatnonzero(lengths > 0).tolist():
+        row = {
+            key: value
+            for key, value in rows[segment_lines[i]].items()
+            if key != "geom"
+        }
+        row["segmentid"] = int(segment_ids[i])
+        if include_segment_wkt:
+            row["segment_wkt"] = wkts[i]
+        row["geom"] = wkts[i]
+        row["segment_length_km"] = float(lengths[i])
+        output.append(row)
+    return output
+
+
+def _segment_lengths(coords, segment_index, count):
+    """Length in meters on the sphere of each segment (haversine formula)."""
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    same = segment_index[1:] == segment_index[:-1]
+    dlat, dlon = np.diff(lat)[same], np.diff(lon)[same]
+    h = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(lat[:-1][same]) * np.cos(lat[1:][same]) * np.sin(dlon / 2) ** 2
+    )
+    distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1)))
+    return np.bincount(segment_index[1:][same], weights=distances, minlength=count)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="NDJSON file with the lines")
+    parser.add_argument("-o", "--output", help="NDJSON file for the segments")
+    parser.add_argument("--user-column", default="geoid")
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--no-segment-wkt", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    start = time.perf_counter()
+    output = split_line(
+        rows, args.user_column, args.tolerance, not args.no_segment_wkt
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(rows)} lines split into {len(output)} segments in {elapsed:.2f} s",
+        file=sys.stderr,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.writelines(json.dumps(row) + "\n" for row in output)
+
+
+if __name__ == "__main__":
+    main()
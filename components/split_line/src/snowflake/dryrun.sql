@@ -0,0 +1,12 @@
+LET query VARCHAR := '
+CREATE OR REPLACE TABLE ' || output_table || '
+AS
+SELECT
+    r.* EXCLUDE (geom),
+    CAST(NULL AS INTEGER) AS segmentid,
+    ' || IFF(include_segment_wkt, 'CAST(NULL AS VARCHAR) AS segment_wkt,', '') || '
+    CAST(NULL AS GEOGRAPHY) AS geom,
+    CAST(NULL AS FLOAT) AS segment_length_km
+FROM ' || input_table || ' r
+WHERE 1 = 0';
+EXECUTE IMMEDIATE :query;
@@ -0,0 +1,184 @@
+-- Snowflake version of split_line: the lines are split in batches by a
+-- vectorized Python UDF, whose code is in split_lines.py. There are no S2
+-- functions in Snowflake, so cell_level is not used.
+
+-- Step 1: Define the vectorized Python UDF that splits the lines, given as WKB,
+-- at the points of their intersections with other lines
+CREATE OR REPLACE TEMPORARY FUNCTION @@workflows_temp@@.split_lines(
+  line BINARY, intersections ARRAY, tolerance FLOAT
+)
+RETURNS ARRAY
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.10'
+PACKAGES = ('numpy', 'pandas', 'shapely')
+HANDLER = 'split_lines_udf'
+AS @@split_lines.py@@;
+
+-- Incremental mode: with a table of changed (or deleted) line IDs or a change
+-- timestamp column, only the changed lines and the lines that intersect them
+-- (before or after the change) are split again, and replace their previous
+-- segments in the output table of a previous run (optional inputs left
+-- empty are given as '')
+LET changed_lines_table VARCHAR := NULLIF(changes_table, '');
+LET timestamp_column VARCHAR := NULLIF(change_timestamp_column, '');
+LET incremental BOOLEAN := changed_lines_table IS NOT NULL OR timestamp_column IS NOT NULL;
+LET affected_ids VARCHAR := '[]';
+LET query VARCHAR := '';
+
+-- Step 2: Create the output table dynamically (in incremental mode, an
+-- existing output table is kept)
+query := IFF(incremental, 'CREATE TABLE IF NOT EXISTS ', 'CREATE OR REPLACE TABLE ') || output_table || '
+  AS
+  SELECT
+      r.* EXCLUDE (geom),
+      CAST(NULL AS INTEGER) AS segmentid,          -- segmented line identifier
+      ' || IFF(include_segment_wkt, '
+      CAST(NULL AS VARCHAR) AS segment_wkt,        -- segmented line as WKT', '') || '
+      CAST(NULL AS GEOGRAPHY) AS geom,             -- new geometry (GEOGRAPHY type)
+      CAST(NULL AS FLOAT) AS segment_length_km     -- length in km
+  FROM ' || input_table || ' r
+  WHERE 1 = 0';
+EXECUTE IMMEDIATE :query;
+
+IF (incremental) THEN
+  -- an empty output table is computed in full
+  SELECT COUNT(*) > 0 INTO :incremental
+  FROM (SELECT 1 FROM IDENTIFIER(:output_table) LIMIT 1);
+END IF;
+
+-- Step 3: Find the lines to split: all of them, or in incremental mode the
+-- changed lines and the lines that intersect their new or previous geometry
+-- (as a JSON array of IDs)
+LET lines_query VARCHAR := input_table;
+LET intersections_query VARCHAR := '
+  WITH pairs AS (
+    SELECT
+      a.' || user_column || ' AS id_a,
+      b.' || user_column || ' AS id_b,
+      ST_INTERSECTION(a.geom, b.geom) AS inter
+    FROM ' || input_table || ' a
+    JOIN ' || input_table || ' b
+      ON a.' || user_column || ' < b.' || user_column || '
+         AND ST_INTERSECTS(a.geom, b.geom)
+  )
+  SELECT id_a AS rid, inter FROM pairs
+  UNION ALL
+  SELECT id_b AS rid, inter FROM pairs';
+
+IF (incremental) THEN
+  LET changed_query VARCHAR := IFF(
+    changed_lines_table IS NULL,
+    NULL,
+    'SELECT ' || user_column || ' AS id FROM ' || changed_lines_table
+  );
+  IF (timestamp_column IS NOT NULL) THEN
+    -- lines modified after the last change already in the output, and lines
+    -- deleted from the input since then
+    changed_query := IFF(changed_query IS NULL, '', changed_query || ' UNION ') || '
+      SELECT r.' || user_column || ' AS id
+      FROM ' || input_table || ' r
+      WHERE r.' || timestamp_column || ' > (
+        SELECT MAX(' || timestamp_column || ') FROM ' || output_table || '
+      )
+      UNION
+      SELECT o.' || user_column || '
+      FROM ' || output_table || ' o
+      LEFT JOIN ' || input_table || ' r
+        ON r.' || user_column || ' = o.' || user_column || '
+      WHERE r.' || user_column || ' IS NULL';
+  END IF;
+
+  query := '
+    SELECT TO_JSON(ARRAY_AGG(DISTINCT id)) AS ids
+    FROM (
+      WITH changed AS (' || changed_query || ')
+      SELECT id FROM changed WHERE id IS NOT NULL
+      UNION
+      -- lines that intersect a changed line
+      SELECT r.' || user_column || '
+      FROM ' || input_table || ' r
+      JOIN ' || input_table || ' c
+        ON ST_INTERSECTS(r.geom, c.geom)
+      WHERE c.' || user_column || ' IN (SELECT id FROM changed)
+      UNION
+      -- lines that intersected a changed or deleted line before the change
+      SELECT r.' || user_column || '
+      FROM ' || input_table || ' r
+      JOIN ' || output_table || ' o
+        ON ST_INTERSECTS(r.geom, o.geom)
+      WHERE o.' || user_column || ' IN (SELECT id FROM changed)
+    )';
+  LET affected_rs RESULTSET := (EXECUTE IMMEDIATE :query);
+  LET affected_cursor CURSOR FOR affected_rs;
+  OPEN affected_cursor;
+  FETCH affected_cursor INTO affected_ids;
+  CLOSE affected_cursor;
+
+  -- the affected lines are joined with all the lines they intersect, so that
+  -- the pairs are not restricted to a.id < b.id
+  lines_query := '(
+    SELECT * FROM ' || input_table || '
+    WHERE ARRAY_CONTAINS(' || user_column || '::VARIANT, PARSE_JSON(?))
+  )';
+  intersections_query := '
+    SELECT
+      a.' || user_column || ' AS rid,
+      ST_INTERSECTION(a.geom, b.geom) AS inter
+    FROM ' || input_table || ' a
+    JOIN ' || input_table || ' b
+      ON a.' || user_column || ' <> b.' || user_column || '
+         AND ST_INTERSECTS(a.geom, b.geom)
+    WHERE ARRAY_CONTAINS(a.' || user_column || '::VARIANT, PARSE_JSON(?))';
+END IF;
+
+-- Step 4: Split the lines at their intersections
+LET segments_query VARCHAR := '
+  WITH intersections AS (
+    SELECT
+      rid,  -- value of the user-defined column
+      ARRAY_AGG(ST_ASWKB(inter)) AS inter_wkb
+    FROM (' || intersections_query || ')
+    GROUP BY rid
+  ),
+  segments AS (
+    -- the UDF returns each segment as an array of coordinates
+    SELECT
+      r.* EXCLUDE (geom),
+      s.index AS segmentid,
+      TO_GEOGRAPHY(OBJECT_CONSTRUCT(''type'', ''LineString'', ''coordinates'', s.value)) AS geom
+    FROM ' || lines_query || ' r
+    LEFT JOIN intersections i
+      ON r.' || user_column || ' = i.rid,
+    LATERAL FLATTEN(input => @@workflows_temp@@.split_lines(
+      ST_ASWKB(r.geom),
+      IFNULL(i.inter_wkb, ARRAY_CONSTRUCT()),
+      ' || tolerance || '  -- Inject tolerance from metadata.json
+    )) s
+  ),
+  measured_segments AS (
+    SELECT *, ST_LENGTH(geom) / 1000 AS segment_length_km
+    FROM segments
+  )
+  SELECT
+    * EXCLUDE (geom, segment_length_km),
+    ' || IFF(include_segment_wkt, 'ST_ASWKT(geom) AS segment_wkt,', '') || '
+    geom,
+    segment_length_km
+  FROM measured_segments
+  WHERE segment_length_km > 0';
+
+-- Step 5: Insert split road segments into output_table, or in incremental
+-- mode replace the previous segments of the affected lines
+IF (NOT incremental) THEN
+  query := 'INSERT INTO ' || output_table || ' SELECT * FROM (' || segments_query || ')';
+  EXECUTE IMMEDIATE :query;
+ELSEIF (affected_ids <> '[]') THEN
+  BEGIN TRANSACTION;
+  query := '
+    DELETE FROM ' || output_table || '
+    WHERE ARRAY_CONTAINS(' || user_column || '::VARIANT, PARSE_JSON(?))';
+  EXECUTE IMMEDIATE :query USING (affected_ids);
+  query := 'INSERT INTO ' || output_table || ' SELECT * FROM (' || segments_query || ')';
+  EXECUTE IMMEDIATE :query USING (affected_ids, affected_ids);
+  COMMIT;
+END IF;
@@ -0,0 +1,191 @@
+// Body of the splitLineAtPoints JavaScript UDF of the BigQuery version of
+// split_line, inlined in its fullrun.sql.
+
+
+function parseLine(geojson) {
+  var geometry = JSON.parse(geojson);
+  if (geometry.type !== "LineString") {
+    throw new Error("Only LINESTRING geometries can be split, got " + geometry.type);
+  }
+  return geometry.coordinates.map(function(coords) {
+    return { x: coords[0], y: coords[1] };
+  });
+}
+
+function distance(a, b) {
+  var dx = b.x - a.x, dy = b.y - a.y;
+  return Math.sqrt(dx * dx + dy * dy);
+}
+
+function cumulativeDistances(line) {
+  var cum = [0];
+  for (var i = 1; i < line.length; i++) {
+    cum.push(cum[i - 1] + distance(line[i - 1], line[i]));
+  }
+  return cum;
+}
+
+// First segment i of the line with cum[i + 1] >= d (binary search), or
+// line.length - 1 if d is beyond the end of the line
+function segmentAtDistance(cum, d) {
+  var lo = 0, hi = cum.length - 1;
+  while (lo < hi) {
+    var mid = (lo + hi) >> 1;
+    if (cum[mid + 1] >= d) {
+      hi = mid;
+    } else {
+      lo = mid + 1;
+    }
+  }
+  return lo;
+}
+
+function interpolatePoint(line, cum, d) {
+  var i = segmentAtDistance(cum, d);
+  if (i >= line.length - 1) return line[line.length - 1];
+  var a = line[i], b = line[i+1];
+  var segLen = distance(a, b);
+  if (segLen === 0) return a;
+  var t = (d - cum[i]) / segLen;
+  return { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
+}
+
+// Uniform grid of size x size cells over the bounding boxes of the
+// (non-empty) segments of a line, so that points are only projected onto the
+// segments around them
+function segmentGrid(line, size) {
+  var minX = Infinity, minY = Infinity, maxX = -Infinity, maxY = -Infinity;
+  for (var i = 0; i < line.length; i++) {
+    minX = Math.min(minX, line[i].x); maxX = Math.max(maxX, line[i].x);
+    minY = Math.min(minY, line[i].y); maxY = Math.max(maxY, line[i].y);
+  }
+  var grid = {
+    size: size,
+    minX: minX,
+    minY: minY,
+    cellWidth: (maxX - minX) / size || 1,
+    cellHeight: (maxY - minY) / size || 1,
+    cells: [],
+    // last query in which each segment was visited (with several cells, a
+    // segment can be found more than once)
+    visited: size > 1 ? new Int32Array(line.length) : null,
+    query: 0
+  };
+  for (var c = 0; c < size * size; c++) grid.cells.push([]);
+  for (var i = 0; i < line.length - 1; i++) {
+    var a = line[i], b = line[i+1];
+    if (distance(a, b) === 0) continue;
+    var col0 = gridColumn(grid, Math.min(a.x, b.x)), col1 = gridColumn(grid, Math.max(a.x, b.x));
+    var row0 = gridRow(grid, Math.min(a.y, b.y)), row1 = gridRow(grid, Math.max(a.y, b.y));
+    for (var row = row0; row <= row1; row++) {
+      for (var col = col0; col <= col1; col++) {
+        grid.cells[row * size + col].push(i);
+      }
+    }
+  }
+  return grid;
+}
+
+function gridColumn(grid, x) {
+  return Math.max(0, Math.min(grid.size - 1, Math.floor((x - grid.minX) / grid.cellWidth)));
+}
+
+function gridRow(grid, y) {
+  return Math.max(0, Math.min(grid.size - 1, Math.floor((y - grid.minY) / grid.cellHeight)));
+}
+
+// Distance along the line of the projection of a point on its closest
+// segment (the first one in case of a tie), or null if there is none. The
+// cells are visited in rings around the point until no unvisited segment
+// can be closer than the best one found.
+function projectPoint(line, cum, grid, pt) {
+  var bestProj = null;
+  var bestError = 1e9;
+  var bestSegment = -1;
+  var col = gridColumn(grid, pt.x), row = gridRow(grid, pt.y);
+  grid.query++;
+  for (var ring = 0; ring < grid.size; ring++) {
+    for (var r = Math.max(0, row - ring); r <= Math.min(grid.size - 1, row + ring); r++) {
+      for (var c = Math.max(0, col - ring); c <= Math.min(grid.size - 1, col + ring); c++) {
+        if (Math.max(Math.abs(r - row), Math.abs(c - col)) !== ring) continue;
+        var cell = grid.cells[r * grid.size + c];
+        for (var k = 0; k < cell.length; k++) {
+          var i = cell[k];
+          if (grid.visited !== null) {
+            if (grid.visited[i] === grid.query) continue;
+            grid.visited[i] = grid.query;
+          }
+          var a = line[i], b = line[i+1];
+          var segLen = distance(a, b);
+          var t = ((pt.x - a.x) * (b.x - a.x) + (pt.y - a.y) * (b.y - a.y)) / (segLen * segLen);
+          t = Math.max(0, Math.min(1, t));
+          var proj = { x: a.x + t * (b.x - a.x), y: a.y + t * (b.y - a.y) };
+          var err = distance(pt, proj);
+          if (err < bestError || (err === bestError && i < bestSegment)) {
+            bestError = err;
+            bestSegment = i;
+            bestProj = cum[i] + t * segLen;
+          }
+        }
+      }
+    }
+    // distance from the point to the closest unvisited cell
+    var margin = Infinity;
+    if (col - ring > 0) margin = Math.min(margin, pt.x - (grid.minX + (col - ring) * grid.cellWidth));
+    if (col + ring < grid.size - 1) margin = Math.min(margin, grid.minX + (col + ring + 1) * grid.cellWidth - pt.x);
+    if (row - ring > 0) margin = Math.min(margin, pt.y - (grid.minY + (row - ring) * grid.cellHeight));
+    if (row + ring < grid.size - 1) margin = Math.min(margin, grid.minY + (row + ring + 1) * grid.cellHeight - pt.y);
+    if (bestProj !== null && bestError < margin) break;
+  }
+  return bestProj;
+}
+
+function splitLineAtPoints(line_geojson, pts, tolerance) {
+  tolerance = tolerance || 1e-6;
+  var line = parseLine(line_geojson);
+  var cum = cumulativeDistances(line);
+  var totalLength = cum[cum.length - 1];
+  var projections = [];
+
+  pts = pts.filter(function(pt) {
+    return pt !== null && isFinite(pt.x) && isFinite(pt.y);
+  });
+  if (pts.length > 0) {
+    // about as many cells as segments, but not many more than points to project
+    var size = Math.ceil(Math.sqrt(Math.min(line.length - 1, 4 * pts.length)));
+    var grid = segmentGrid(line, Math.max(1, size));
+    pts.forEach(function(pt) {
+      var proj = projectPoint(line, cum, grid, pt);
+      if (proj !== null) {
+        projections.push(proj);
+      }
+    });
+  }
+
+  projections.push(0);
+  projections.push(totalLength);
+  projections.sort((a, b) => a - b);
+
+  var unique = projections.filter((d, i) => i === 0 || Math.abs(d - projections[i - 1]) > tolerance);
+  var segments = [];
+  // single forward sweep over the vertices, as the split distances are sorted
+  var j = 0;
+  for (var i = 0; i < unique.length - 1; i++) {
+    var d_start = unique[i];
+    var d_end = unique[i+1];
+    var segPoints = [interpolatePoint(line, cum, d_start)];
+
+    while (j < cum.length && cum[j] <= d_start) j++;
+    while (j < cum.length && cum[j] < d_end) {
+      segPoints.push(line[j]);
+      j++;
+    }
+
+    segPoints.push(interpolatePoint(line, cum, d_end));
+    segments.push({ segmentid: i, coords: segPoints });
+  }
+
+  return segments;
+}
+
+return splitLineAtPoints(line_geojson, pts, tolerance);
@@ -0,0 +1,297 @@
+"""Split lines at points, in batches of lines.
+
+This module is the handler of the vectorized Python UDF used by the Snowflake
+version of split_line, and it is inlined in its `fullrun.sql` when the
+extension is built. It is also the splitter of the local engine (`local.py`).
+It follows the `splitLineAtPoints` JavaScript UDF of the BigQuery version
+(`split_line_at_points.js`): each point is projected onto the closest segment
+of its line, distances along the line closer than the tolerance are merged,
+and the line is cut at the remaining ones.
+
+The lines of a batch are processed together: their vertices, segments and cut
+points are concatenated in arrays, so that there are no per-line loops. It only
+depends on numpy and shapely, so it can be used locally:
+
+    >>> segments, = split_lines([shapely.LineString([(0, 0), (2, 0)])], [[(1, 0.5)]])
+    >>> [segment.tolist() for segment in segments]
+    [[[0.0, 0.0], [1.0, 0.0]], [[1.0, 0.0], [2.0, 0.0]]]
+"""
+
+import numpy as np
+import shapely
+
+try:
+    import pandas
+except ImportError:  # only needed to run as a Snowflake UDF
+    pandas = None
+
+try:
+    from _snowflake import vectorized
+except ImportError:  # only available in Snowflake, where the handler is vectorized
+
+    def vectorized(input):
+        return lambda handler: handler
+
+# points are only projected onto the segments of their line within this
+# distance (intersection points are on their lines, up to rounding errors)
+SEARCH_DISTANCE = 1e-6
+
+
+def split_lines(lines, points, tolerance=1e-6):
+    """Split each line at its points.
+
+    `lines` is a sequence of LineStrings and `points` has, for each line, a
+    sequence of (x, y) coordinates. Returns, for each line, the list of its
+    segments as arrays of coordinates.
+    """
+    points = [np.asarray(p, dtype=float).reshape(-1, 2) for p in points]
+    point_lines = np.repeat(np.arange(len(points)), [len(p) for p in points])
+    pts = np.concatenate(points) if points else np.empty((0, 2))
+    coords, ends, segment_lines = _split_batch(lines, pts, point_lines, tolerance)
+    segments = np.split(coords, ends[:-1]) if len(ends) else []
+    line_ends = np.cumsum(np.bincount(segment_lines, minlength=len(points)))
+    line_starts = np.concatenate([[0], line_ends[:-1]])
+    return [segments[start:end] for start, end in zip(line_starts, line_ends)]
+
+
+def _split_batch(lines, pts, point_lines, tolerance):
+    """Split a batch of lines at some points, given with the index of their line.
+
+    Returns the coordinates of all the segments, the end of each segment in
+    them and the index of the line of each segment (sorted by line). As the
+    JavaScript UDF, it raises an error for geometries other than LineStrings:
+    the parts of a MultiLineString would otherwise be joined into one line.
+    """
+    tolerance = tolerance or 1e-6
+    lines = np.asarray(lines, dtype=object)
+    type_ids = shapely.get_type_id(lines)
+    invalid = np.flatnonzero((type_ids != 1) & (type_ids != -1))
+    if len(invalid):
+        raise ValueError(
+            f"Only LINESTRING geometries can be split, got {lines[invalid[0]].geom_type}"
+        )
+    coords, vertex_lines = shapely.get_coordinates(lines, return_index=True)
+    sizes = np.bincount(vertex_lines, minlength=len(lines))
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    # length of the segment from each vertex to the next one of its line (0 for
+    # the last vertex of each line), with the same operations as the JavaScript
+    # UDF, and distance of each vertex along its line
+    deltas = np.diff(coords, axis=0, append=coords[-1:])
+    lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+    lengths[offsets[1:][sizes > 0] - 1] = 0
+    cum = _cumulative_lengths(lengths, offsets, sizes)
+
+    finite = np.isfinite(pts).all(axis=1)
+    pts, point_lines = pts[finite], point_lines[finite]
+    distances = _project_points(coords, lengths, cum, vertex_lines, pts, point_lines)
+
+    # distances along each line where it is cut, including its ends, sorted by
+    # line and distance, without the ones closer than the tolerance to the
+    # previous one
+    splittable = np.flatnonzero(sizes >= 2)
+    found = np.isfinite(distances)
+    cut_lines = np.concatenate([point_lines[found], splittable, splittable])
+    cuts = np.concatenate(
+        [distances[found], np.zeros(len(splittable)), cum[offsets[splittable + 1] - 1]]
+    )
+    if len(cuts) == 0:
+        return np.empty((0, 2)), np.empty(0, dtype=int), np.empty(0, dtype=int)
+    order = np.lexsort((cuts, cut_lines))
+    cut_lines, cuts = cut_lines[order], cuts[order]
+    keep = np.concatenate(
+        [[True], (np.diff(cut_lines) != 0) | (np.diff(cuts) > tolerance)]
+    )
+    cut_lines, cuts = cut_lines[keep], cuts[keep]
+    pairs = np.flatnonzero(cut_lines[:-1] == cut_lines[1:])
+    segment_lines, starts, ends = cut_lines[pairs], cuts[pairs], cuts[pairs + 1]
+
+    # each segment has its interpolated ends and the vertices strictly between them
+    left, right = _search_lines(
+        cum,
+        vertex_lines,
+        np.concatenate([segment_lines, segment_lines]),
+        np.concatenate([starts, ends]),
+    )
+    first, last = right[: len(starts)], left[len(starts) :]
+    inner = last - first
+    segment_ends = np.cumsum(inner + 2)
+    segment_starts = segment_ends - inner - 2
+    result = np.empty((segment_ends[-1] if len(segment_ends) else 0, 2))
+    line = (coords, lengths, cum, offsets, sizes)
+    result[segment_starts] = _interpolate(
+        line, segment_lines, starts, left[: len(starts)]
+    )
+    result[segment_ends - 1] = _interpolate(line, segment_lines, ends, last)
+    inner_segments = np.repeat(np.arange(len(inner)), inner)
+    rank = np.arange(len(inner_segments)) - np.repeat(np.cumsum(inner) - inner, inner)
+    inner_positions = segment_starts[inner_segments] + 1 + rank
+    result[inner_positions] = coords[first[inner_segments] + rank]
+    return result, segment_ends, segment_lines
+
+
+def _cumulative_lengths(lengths, offsets, sizes):
+    """Distance along its line of each vertex.
+
+    The lengths of the segments of each line are added in order, as in the
+    JavaScript UDF (a cumulative sum of the whole batch minus the sum of the
+    previous lines would differ in the last digits). Lines of similar sizes are
+    padded to the same size and added together.
+    """
+    cum = np.zeros(len(lengths))
+    buckets = np.ceil(np.log2(np.maximum(sizes, 1))).astype(int)
+    for bucket in np.unique(buckets[sizes >= 2]):
+        group = np.flatnonzero((buckets == bucket) & (sizes >= 2))
+        steps = np.arange(sizes[group].max() - 1)
+        # segments of each line of the group, by their first vertex
+        segments = offsets[group][:, None] + steps
+        valid = steps < sizes[group][:, None] - 1
+        padded = np.where(valid, lengths[np.where(valid, segments, 0)], 0.0)
+        cum[segments[valid] + 1] = np.cumsum(padded, axis=1)[valid]
+    return cum
+
+
+def _search_lines(cum, vertex_lines, lines, distances):
+    """Global index of the first vertex of the line of each distance that is
+    at it or after it, and of the first one after it (as `np.searchsorted` with
+    sides "left" and "right" in the distances of the vertices of the line)."""
+    # vertices sort after the distances searched with side "left" and before
+    # the ones searched with side "right" at equal distance, line by line
+    kinds = np.concatenate(
+        [np.zeros(len(distances)), np.ones(len(cum)), np.full(len(distances), 2)]
+    )
+    order = np.lexsort(
+        (
+            kinds,
+            np.concatenate([distances, cum, distances]),
+            np.concatenate([lines, vertex_lines, lines]),
+        )
+    )
+    is_vertex = (order >= len(distances)) & (order < len(distances) + len(cum))
+    # vertices before each entry, which are those of previous lines too
+    vertices_before = np.cumsum(is_vertex) - is_vertex
+    position = np.empty(len(order), dtype=int)
+    position[order] = np.arange(len(order))
+    left = vertices_before[position[: len(distances)]]
+    right = vertices_before[position[len(distances) + len(cum) :]]
+    return left, right
+
+
+def _interpolate(line, lines, distances, before):
+    """Points of some lines at some distances along them, given the global
+    index of the first vertex of their line at or after each distance."""
+    coords, lengths, cum, offsets, sizes = line
+    # first segment i with cum[i + 1] >= distance
+    i = np.maximum(before - offsets[lines] - 1, 0)
+    beyond = i >= sizes[lines] - 1
+    k = offsets[lines] + np.minimum(i, sizes[lines] - 2)
+    a, b = coords[k], coords[k + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (distances - cum[k]) / lengths[k]
+    points = a + t[:, None] * (b - a)
+    empty = lengths[k] == 0
+    points[empty] = a[empty]
+    points[beyond] = coords[offsets[lines[beyond] + 1] - 1]
+    return points
+
+
+def _project_points(coords, lengths, cum, vertex_lines, pts, point_lines):
+    """Distance along its line of the projection of each point on the closest
+    segment of the line (the first one in case of a tie), or NaN if it has none.
+
+    The (non-empty) segments of all the lines are indexed in an STRtree, and
+    each point is only projected onto the segments of its line within
+    SEARCH_DISTANCE, or onto all of them if there are none.
+    """
+    distances = np.full(len(pts), np.nan)
+    # segments, by their first vertex
+    segments = np.flatnonzero(lengths > 0)
+    if len(pts) == 0 or len(segments) == 0:
+        return distances
+    tree = shapely.STRtree(
+        shapely.linestrings(np.stack([coords[segments], coords[segments + 1]], axis=1))
+    )
+    # the same point is often given for several lines (e.g. an intersection for
+    # both lines), so the tree is only queried once for each location
+    locations, location_index = np.unique(
+        pts[:, 0] + 1j * pts[:, 1], return_inverse=True
+    )
+    location_index = location_index.ravel()
+    query_index, tree_index = tree.query(
+        shapely.points(locations.real, locations.imag),
+        predicate="dwithin",
+        distance=SEARCH_DISTANCE,
+    )
+    # candidates of each location, for each of its points
+    location_points = np.argsort(location_index, kind="stable")
+    counts = np.bincount(location_index, minlength=len(locations))
+    first_points = np.cumsum(counts) - counts
+    repeats = counts[query_index]
+    pairs = np.repeat(np.arange(len(query_index)), repeats)
+    rank = np.arange(len(pairs)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    pt_index = location_points[first_points[query_index[pairs]] + rank]
+    tree_index = tree_index[pairs]
+    same_line = vertex_lines[segments[tree_index]] == point_lines[pt_index]
+    pt_index, seg_index = pt_index[same_line], segments[tree_index[same_line]]
+    # points far from their line are projected onto all its segments
+    has_candidates = np.zeros(len(pts), dtype=bool)
+    has_candidates[pt_index] = True
+    missing = np.flatnonzero(~has_candidates)
+    if len(missing):
+        segment_lines = vertex_lines[segments]
+        starts = np.searchsorted(segment_lines, point_lines[missing], side="left")
+        ends = np.searchsorted(segment_lines, point_lines[missing], side="right")
+        pt_index = np.concatenate([pt_index, np.repeat(missing, ends - starts)])
+        seg_index = np.concatenate(
+            [seg_index] + [segments[start:end] for start, end in zip(starts, ends)]
+        )
+    if len(pt_index) == 0:
+        return distances
+
+    # same operations as the JavaScript UDF
+    a, b, p = coords[seg_index], coords[seg_index + 1], pts[pt_index]
+    length = lengths[seg_index]
+    dot = (p[:, 0] - a[:, 0]) * (b[:, 0] - a[:, 0]) + (p[:, 1] - a[:, 1]) * (
+        b[:, 1] - a[:, 1]
+    )
+    t = np.maximum(0, np.minimum(1, dot / (length * length)))
+    delta = a + t[:, None] * (b - a) - p
+    error = np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+    # closest segment of each point, the first one in case of a tie
+    order = np.lexsort((seg_index, error, pt_index))
+    best = order[np.concatenate([[True], np.diff(pt_index[order]) != 0])]
+    distances[pt_index[best]] = cum[seg_index[best]] + t[best] * length[best]
+    return distances
+
+
+@vectorized(input=getattr(pandas, "DataFrame", None))
+def split_lines_udf(batch):
+    """Handler of the vectorized UDF.
+
+    Its arguments are the WKB of a line, an array with the WKB (as hex strings)
+    of its intersections with other lines, and the tolerance, which is the same
+    for every row. Only the points of the intersections are used, as with
+    `ST_DUMP(intersection, 0)` in BigQuery. Returns, for each line, an array of
+    segments as arrays of [x, y] coordinates.
+    """
+    lines = shapely.from_wkb(batch[0].to_numpy())
+    rows, wkbs = [], []
+    for row, intersections in enumerate(batch[1]):
+        for wkb in intersections or []:
+            rows.append(row)
+            wkbs.append(wkb)
+    parts, part_rows = shapely.get_parts(shapely.from_wkb(wkbs), return_index=True)
+    is_point = shapely.get_type_id(parts) == 0
+    points = parts[is_point]
+    point_rows = np.asarray(rows, dtype=int)[part_rows[is_point]]
+    # empty points have no coordinates
+    point_rows = point_rows[~shapely.is_empty(points)]
+    tolerance = float(batch[2].iloc[0]) if len(batch) else 1e-6
+    coords, ends, segment_lines = _split_batch(
+        lines, shapely.get_coordinates(points), point_rows, tolerance
+    )
+    coords = coords.tolist()
+    segments = [[] for _ in range(len(lines))]
+    starts = np.concatenate([[0], ends[:-1]])
+    for line, start, end in zip(segment_lines.tolist(), starts.tolist(), ends.tolist()):
+        segments[line].append(coords[start:end])
+    return pandas.Series(segments)
@@ -0,0 +1,39 @@
+import carto_extension as ce
+
+COMPONENT = {
+    "name": "component",
+    "procedureName": "__proc_component_1",
+    "inputs": [
+        {"name": "input_table", "type": "Table"},
+        {"name": "value", "type": "Number"},
+    ],
+    "outputs": [
+        {"name": "output_table", "type": "Table"},
+        {"name": "other_table", "type": "Table"},
+    ],
+}
+TESTS = [
+    {"id": 1, "inputs": {"input_table": "table1", "value": 1}},
+    {"id": "two", "inputs": {"input_table": "table2", "value": 2}},
+]
+
+
+def test_batch_script_maps_selects_to_outputs():
+    statements, selects = ce._batch_script(COMPONENT, TESTS, "temp")
+    assert len(statements) == 6
+    assert [selects[i][:2] for i in sorted(selects)] == [
+        (1, "output_table"),
+        (1, "other_table"),
+        ("two", "output_table"),
+        ("two", "other_table"),
+    ]
+    script_lines = "\n".join(statements).split("\n")
+    for i, (test_id, output_name, line) in selects.items():
+        assert statements[i].startswith("SELECT * FROM temp._table_")
+        # the line of each select in the script, as reported by BigQuery
+        assert script_lines[line - 1] == statements[i]
+    # outputs of the same test case are written to the same table
+    first_call = statements[0]
+    assert "temp._test_component_table1" in first_call
+    assert statements[1] == statements[2]
+    assert statements[1].split()[-1].rstrip(";") in first_call
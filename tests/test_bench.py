@@ -0,0 +1,23 @@
+import carto_extension as ce
+
+BASELINE = {"output_rows": 100, "seconds": 1.0, "bytes_processed": 1000}
+
+
+def test_output_rows_must_match():
+    result = dict(BASELINE, output_rows=99)
+    assert ce._bench_regressions(result, BASELINE, 1.5) == ["output_rows 99 != 100"]
+
+
+def test_wall_times_are_only_compared_on_request():
+    result = dict(BASELINE, seconds=2.0)
+    assert ce._bench_regressions(result, BASELINE, 1.5) == []
+    assert ce._bench_regressions(result, BASELINE, 1.5, timing=True) == [
+        "seconds 2.0 > 1.5 x 1.0"
+    ]
+
+
+def test_warehouse_statistics_are_compared():
+    result = dict(BASELINE, bytes_processed=2000)
+    assert ce._bench_regressions(result, BASELINE, 1.5) == [
+        "bytes_processed 2000 > 1.5 x 1000"
+    ]
@@ -0,0 +1,29 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import carto_extension as ce
+
+METADATA = {"components": [{"name": "split_line"}]}
+TEST_TABLES = {"_test_split_line_table1"}
+NOW = datetime.now(timezone.utc)
+OLD = NOW - timedelta(seconds=ce.CLEAN_MIN_AGE + 60)
+
+
+def leftover(table_id, created=OLD):
+    return ce._is_leftover_table(table_id, created, METADATA, TEST_TABLES)
+
+
+def test_output_tables_are_removed_when_old():
+    table_id = "_table_" + "0" * 32
+    assert leftover(table_id)
+    assert not leftover(table_id, NOW)
+    assert not leftover(table_id, datetime.fromtimestamp(time.time() - 60))
+
+
+def test_only_test_tables_of_the_extension_are_removed():
+    assert leftover("_test_split_line_removed")
+    assert leftover("_TEST_SPLIT_LINE_BENCH_GRID_LINES_1000")
+    assert not leftover("_test_split_line_table1")
+    assert not leftover("_test_other_component_table1")
+    assert not leftover("_test_split_lines")
+    assert not leftover("_table_other")
@@ -0,0 +1,48 @@
+import carto_extension as ce
+
+
+def test_row_key_ignores_order_and_rounds_floats():
+    a = {"id": 1, "value": 0.12341, "tags": ["b", "a"], "props": {"x": 1.0, "y": 2}}
+    b = {"props": {"y": 2, "x": 1.0002}, "tags": ["a", "b"], "value": 0.1234, "id": 1}
+    assert ce._row_key(a) == ce._row_key(b)
+    assert ce._row_key(a) != ce._row_key(dict(b, value=0.124))
+    assert ce._row_key(a, decimal_places=5) != ce._row_key(b, decimal_places=5)
+
+
+def test_row_key_keeps_repeated_items():
+    assert ce._row_key(["a", "a", "b"]) != ce._row_key(["a", "b", "b"])
+    assert ce._row_key([]) == ce._row_key([])
+    assert ce._row_key(-0.0001) == ce._row_key(0.0)
+
+
+def test_compare_outputs_ignores_row_order():
+    expected = [{"id": 1, "v": 1.0}, {"id": 2, "v": 2.0}, {"id": 2, "v": 2.0}]
+    result = iter([{"id": 2, "v": 2.0001}, {"id": 1, "v": 1.0}, {"id": 2, "v": 2.0}])
+    assert ce.compare_outputs(expected, result).equal
+
+
+def test_compare_outputs_reports_differences():
+    expected = [
+        {"id": 1, "name": "a", "v": 1.0},
+        {"id": 2, "name": "b", "v": 2.0},
+        {"id": 3, "name": "c", "v": 3.0},
+    ]
+    result = [
+        {"id": 1, "name": "a", "v": 1.0},
+        {"id": 2, "name": "b", "v": 2.5},
+        {"id": 4, "other": "d"},
+    ]
+    diff = ce.compare_outputs(expected, result)
+    assert not diff.equal
+    assert diff.changed == [(expected[1], result[1], ["v"])]
+    assert diff.missing == [expected[2]]
+    assert diff.extra == [result[2]]
+    report = diff.report()
+    assert report.startswith("1 changed row, 1 missing row, 1 unexpected row.")
+    assert "v: expected 2.0, got 2.5" in report
+
+
+def test_compare_outputs_counts_duplicates():
+    diff = ce.compare_outputs([{"id": 1}, {"id": 1}], [{"id": 1}])
+    assert diff.missing == [{"id": 1}]
+    assert not diff.extra
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import carto_extension as ce
+
+METADATA = {
+    "name": "component",
+    "inputs": [{"name": "input_table", "type": "Table"}, {"name": "value", "type": "Number"}],
+    "outputs": [{"name": "output_table", "type": "Table"}],
+}
+
+
+@pytest.fixture
+def component(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        ce, "build_cache", {"version": ce.BUILD_CACHE_VERSION, "entries": {}}
+    )
+    monkeypatch.setattr(
+        ce,
+        "_component_files",
+        lambda name, provider: [
+            str(tmp_path / "metadata.json"),
+            str(tmp_path / "fullrun.sql"),
+            str(tmp_path / "dryrun.sql"),
+        ],
+    )
+
+    def write(metadata=METADATA, fullrun="SELECT 1;", dryrun="SELECT 0;"):
+        (tmp_path / "metadata.json").write_text(json.dumps(metadata))
+        (tmp_path / "fullrun.sql").write_text(fullrun)
+        (tmp_path / "dryrun.sql").write_text(dryrun)
+        component = ce.load_component("component", "bigquery")["metadata"]
+        return ce._procedure_name_with_hash(component, "bigquery")
+
+    return write
+
+
+def test_code_hash_covers_the_procedure(component, monkeypatch):
+    code_hash = component()
+    assert component() == code_hash
+    assert component(fullrun="SELECT 2;") != code_hash
+    assert component(dryrun="SELECT 2;") != code_hash
+    number_output = dict(METADATA, outputs=[{"name": "output_table", "type": "Number"}])
+    assert component(number_output) != code_hash
+    assert component(dict(METADATA, cartoEnvVars=["apiKey"])) != code_hash
+    assert component(dict(METADATA, description="Changed")) == code_hash
+    # variables are hashed with the values they are deployed with
+    monkeypatch.delenv("CARTO_TEST_VALUE", raising=False)
+    code_hash = component(fullrun="SELECT '${CARTO_TEST_VALUE}';")
+    monkeypatch.setenv("CARTO_TEST_VALUE", "1")
+    assert component(fullrun="SELECT '${CARTO_TEST_VALUE}';") != code_hash
+    # and so is the template of the procedure
+    code_hash = component()
+    monkeypatch.setattr(ce, "get_procedure_code_bq", lambda component: "-- changed")
+    assert component() != code_hash
+
+
+def test_snowflake_procedures_are_dropped_with_their_signature(monkeypatch):
+    monkeypatch.setattr(
+        ce, "get_procedure_code_sf", lambda component: "-- procedure"
+    )
+    component = dict(METADATA, procedureName="__proc_component_2", cartoEnvVars=[])
+    metadata = {"name": "extension", "components": [component]}
+    signature = "(STRING,FLOAT,STRING,BOOLEAN,VARCHAR)"
+    code = ce.create_sql_code_sf(metadata, [f"__proc_component_1{signature}"])
+    assert f"LET procedure_entry VARCHAR := '__proc_component_1{signature}';" in code
+    assert f"'__proc_component_2{signature}'" in code
+
+
+def test_snowflake_procedures_of_older_versions_are_dropped(monkeypatch):
+    monkeypatch.setattr(
+        ce, "get_procedure_code_sf", lambda component: "-- procedure"
+    )
+    component = dict(METADATA, procedureName="__proc_component_2", cartoEnvVars=[])
+    metadata = {"name": "extension", "components": [component]}
+    # older entries list the component parameter types, so the procedure
+    # signature is looked up with SHOW PROCEDURES
+    code = ce.create_sql_code_sf(metadata, ["__proc_component_1(Table,Number)"])
+    assert "LET procedure_entry VARCHAR := '__proc_component_1(Table,Number)';" in code
+    assert "SHOW PROCEDURES LIKE" in code
+    code = ce.create_sql_code_sf(metadata)
+    assert "FOR installed_procedure IN installed_cursor DO" in code
+    assert "SHOW PROCEDURES LIKE" in code
@@ -0,0 +1,106 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import carto_extension as ce
+
+OUTPUTS = {
+    "output_table": [{"id": 2, "value": 0.5}, {"id": 1, "value": None}],
+    "other_table": [{"name": "a"}],
+}
+
+
+def _rewrite(filename, edit):
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        lines = f.readlines()
+    with gzip.open(filename, "wt", encoding="utf-8") as f:
+        f.writelines(edit(lines))
+
+
+@pytest.fixture
+def fixture_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / "1.ndjson.gz")
+    ce._write_fixture(filename, OUTPUTS)
+    monkeypatch.setattr(
+        ce, "_fixture_filename", lambda component, test_id, local=False: filename
+    )
+    return filename
+
+
+def test_edited_fixture_fails(fixture_file):
+    _rewrite(fixture_file, lambda lines: [line.replace("0.5", "0.7") for line in lines])
+    with pytest.raises(AssertionError, match="doesn't match its header"):
+        ce._verify_fixture(fixture_file)
+    # tests trust the header, `check` is the one that catches it
+    diff = ce._compare_output({"name": "c"}, 1, "output_table", OUTPUTS["output_table"])
+    assert diff.equal
+
+
+def test_fixture_with_extra_rows_fails(fixture_file):
+    _rewrite(fixture_file, lambda lines: lines + [json.dumps({"name": "b"}) + "\n"])
+    with pytest.raises(AssertionError, match="more rows"):
+        ce._verify_fixture(fixture_file)
+
+
+def test_unchanged_fixture_passes(fixture_file):
+    ce._verify_fixture(fixture_file)
+    diff = ce._compare_output({"name": "c"}, 1, "output_table", OUTPUTS["output_table"])
+    assert diff.equal
+
+
+def test_fixture_round_trip(tmp_path):
+    filename = str(tmp_path / "1.ndjson.gz")
+    ce._write_fixture(filename, OUTPUTS)
+    header = ce._read_fixture_header(filename)
+    assert {name: output["rows"] for name, output in header.items()} == {
+        "output_table": 2,
+        "other_table": 1,
+    }
+    assert header["output_table"]["hash"] == ce._output_hash(OUTPUTS["output_table"])[1]
+    rows = list(ce._read_fixture_rows(filename, "output_table"))
+    assert sorted(rows, key=lambda row: row["id"]) == sorted(
+        OUTPUTS["output_table"], key=lambda row: row["id"]
+    )
+    assert list(ce._read_fixture_rows(filename, "other_table")) == OUTPUTS["other_table"]
+
+
+def test_fixture_is_deterministic(tmp_path):
+    first, second = str(tmp_path / "1.ndjson.gz"), str(tmp_path / "2.ndjson.gz")
+    ce._write_fixture(first, OUTPUTS)
+    reordered = {name: rows[::-1] for name, rows in OUTPUTS.items()}
+    ce._write_fixture(second, reordered)
+    with open(first, "rb") as f, open(second, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_fixture_rows_substitute_variables(tmp_path, monkeypatch):
+    monkeypatch.setenv("CARTO_TEST_DATASET", "dataset")
+    filename = str(tmp_path / "1.ndjson.gz")
+    ce._write_fixture(filename, {"output_table": [{"table": "${CARTO_TEST_DATASET}.t"}]})
+    assert list(ce._read_fixture_rows(filename, "output_table")) == [
+        {"table": "dataset.t"}
+    ]
+
+
+def test_json_fixture(tmp_path):
+    filename = str(tmp_path / "1.json")
+    ce._write_fixture(filename, OUTPUTS)
+    with open(filename) as f:
+        assert json.load(f) == OUTPUTS
+
+
+def test_local_fixtures_are_kept_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(ce, "__file__", str(tmp_path / "carto_extension.py"))
+    component = {"name": "c"}
+    local_filename = ce._fixture_filename(component, 1, "json", local=True)
+    os.makedirs(os.path.dirname(local_filename))
+    ce._write_fixture(local_filename, OUTPUTS)
+    # only the local backend compares its results with the local fixtures
+    assert ce._compare_output(component, 1, "other_table", [{"name": "a"}], local=True).equal
+    assert ce._compare_output(component, 1, "other_table", [{"name": "b"}]) is None
+    # and falls back to the warehouse fixtures
+    warehouse_filename = ce._fixture_filename(component, 2, "json")
+    ce._write_fixture(warehouse_filename, OUTPUTS)
+    assert ce._compare_output(component, 2, "other_table", [{"name": "a"}], local=True).equal
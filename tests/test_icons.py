@@ -0,0 +1,21 @@
+import carto_extension as ce
+
+SVG = b'<?xml version="1.0"?>\n<svg>\n  <path d="M0 0"/>\n</svg>\n'
+
+
+def test_icons_with_the_same_content_are_encoded_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(ce, "encoded_images", {})
+    monkeypatch.setattr(
+        ce, "build_cache", {"version": ce.BUILD_CACHE_VERSION, "entries": {}}
+    )
+    built = []
+    cached = ce._cached
+    monkeypatch.setattr(
+        ce, "_cached", lambda paths, build: built.append(paths) or cached(paths, build)
+    )
+    for name in ["a.svg", "b.svg"]:
+        (tmp_path / name).write_bytes(SVG)
+    first = ce._encode_image(str(tmp_path / "a.svg"))
+    assert ce._encode_image(str(tmp_path / "b.svg")) == first
+    assert built == [[str(tmp_path / "a.svg")]]
+    assert first.startswith("data:image/svg+xml;base64,")
@@ -0,0 +1,33 @@
+import pytest
+
+import carto_extension as ce
+
+pytest.importorskip("snowflake.connector")
+
+
+class FakeCursor:
+    sfqid = "query-1"
+
+    def __init__(self, history):
+        self.history = history
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def fetchone(self):
+        return self.history
+
+    def close(self):
+        pass
+
+
+def test_snowflake_records_have_the_bigquery_statistics(monkeypatch):
+    monkeypatch.setattr(ce, "instrumentation", None)
+    connection = type("Connection", (), {"cursor": lambda self: FakeCursor((3, 2048, 15, 10))})
+    monkeypatch.setattr(ce, "sf_client", connection)
+    ce.start_instrumentation()
+    with ce._instrument("upload", "component") as record:
+        ce._record_query_sf(FakeCursor(None))
+    assert record["job_ids"] == ["query-1"]
+    assert record["bytes_processed"] == 2048
+    assert record["rows"] == 10
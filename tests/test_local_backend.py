@@ -0,0 +1,85 @@
+import pytest
+
+import carto_extension as ce
+
+COMPONENT = {
+    "name": "scale",
+    "procedureName": "__proc_scale",
+    "inputs": [{"name": "value", "type": "Number"}],
+    "outputs": [{"name": "output_table", "type": "Table"}],
+    "cartoEnvVars": ["factor"],
+}
+CODE = """
+EXECUTE IMMEDIATE '''
+CREATE TABLE ''' || output_table || ''' AS SELECT ''' || value || ''' * ''' || factor || ''' AS result
+''';
+"""
+
+
+@pytest.fixture
+def backend():
+    pytest.importorskip("duckdb")
+    backend = ce.LocalBackend()
+    backend.provider = "bigquery"
+    backend.procedures[COMPONENT["procedureName"]] = ce._local_statements(CODE)
+    return backend
+
+
+@pytest.mark.parametrize("env_vars", [{"factor": 3}, '{"factor": 3}'])
+def test_call_test_env_vars(backend, env_vars):
+    test = {"id": 1, "inputs": {"value": 2}, "env_vars": env_vars}
+    tables = backend.call_test(COMPONENT, test)
+    assert list(backend.fetch_table(tables["output_table"])) == [{"result": 6}]
+
+
+def test_split_sql_statements():
+    code = """
+    -- a comment; with a semicolon
+    SELECT 'a;b' AS x, "c;--d" AS y;  /* block; comment */
+    SELECT `weird;name` FROM t;
+    EXECUTE IMMEDIATE '''
+      SELECT 1; -- not a comment
+    ''';
+    """
+    assert ce._split_sql_statements(code) == [
+        "SELECT 'a;b' AS x, \"c;--d\" AS y",
+        "SELECT `weird;name` FROM t",
+        "EXECUTE IMMEDIATE '''\n      SELECT 1; -- not a comment\n    '''",
+    ]
+
+
+def test_evaluate_sql_concatenation():
+    expression = "'CREATE TABLE ' || output_table || \"\"\" AS SELECT \"\"\" || :value || ' AS v, ' || flag || ', ' || missing"
+    variables = {"output_table": "t", "value": 2.5, "flag": True, "missing": None}
+    assert (
+        ce._evaluate_sql_concatenation(expression, variables)
+        == "CREATE TABLE t AS SELECT 2.5 AS v, TRUE, NULL"
+    )
+    assert ce._evaluate_sql_concatenation(r"'it''s \'quoted\'\n'", {}) == "it's 'quoted'\n"
+
+
+@pytest.mark.parametrize(
+    "expression", ["'a' || UPPER(b)", "'a' 'b'", "'a' || unknown"]
+)
+def test_evaluate_sql_concatenation_unsupported(expression):
+    with pytest.raises(NotImplementedError):
+        ce._evaluate_sql_concatenation(expression, {"b": "x"})
+
+
+def test_local_sql():
+    sql = """CREATE TABLE `p.d.t`
+    OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))
+    AS SELECT r.* except (geom), SAFE_CAST(x AS int64) AS x, CAST(NULL AS GEOGRAPHY) AS g,
+    ST_GEOGPOINT(0, 0) AS p FROM r"""
+    assert ce._local_sql(sql, spatial=True).split() == (
+        'CREATE TABLE "p.d.t" AS SELECT r.* EXCLUDE (geom), TRY_CAST(x AS BIGINT) AS x, '
+        "CAST(NULL AS GEOMETRY) AS g, ST_Point(0, 0) AS p FROM r"
+    ).split()
+    assert "CAST(NULL AS VARCHAR)" in ce._local_sql(sql, spatial=False)
+
+
+def test_local_statements_reject_scripting():
+    with pytest.raises(NotImplementedError, match="DECLARE x INT64"):
+        ce._local_statements("DECLARE x INT64; SELECT 1;")
+    with pytest.raises(NotImplementedError):
+        ce._local_statements("CREATE TEMP FUNCTION f() AS (1);")
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+import carto_extension as ce
+
+
+@pytest.mark.parametrize(
+    "types, widened",
+    [
+        ((None, "INT64"), "INT64"),
+        (("INT64", None), "INT64"),
+        (("INT64", "FLOAT64"), "FLOAT64"),
+        (("DATE", "DATETIME"), "DATETIME"),
+        (("INT64", "STRING"), "STRING"),
+        (("GEOGRAPHY", "STRING"), "STRING"),
+        (("INT64", {"a": "INT64"}), "STRING"),
+        (({"a": "INT64"}, {"a": "FLOAT64", "b": "BOOL"}), {"a": "FLOAT64", "b": "BOOL"}),
+    ],
+)
+def test_widen_type(types, widened):
+    assert ce._widen_type(*types) == widened
+
+
+def write_table(tmp_path, rows):
+    filename = str(tmp_path / "table1.ndjson")
+    with open(filename, "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+    return filename
+
+
+def test_infer_schema(tmp_path):
+    pytest.importorskip("shapely")
+    filename = write_table(
+        tmp_path,
+        [
+            {"id": 1, "value": None, "geom": "POINT(0 0)", "props": {"a": 1}, "day": "2024-01-01"},
+            {"id": 2, "value": 1.5, "geom": None, "props": {"b": "x"}, "day": "2024-01-02 10:00"},
+            {"id": 3, "value": 2, "name": "POINT of sale", "empty": None},
+        ],
+    )
+    assert ce._infer_schema(filename) == {
+        "id": "INT64",
+        "value": "FLOAT64",
+        "geom": "GEOGRAPHY",
+        "props": {"a": "INT64", "b": "STRING"},
+        "day": "DATETIME",
+        "name": "STRING",
+        "empty": "STRING",
+    }
+
+
+def test_infer_schema_uses_the_sample(tmp_path):
+    filename = write_table(tmp_path, [{"v": 1}, {"v": 1}, {"v": "text"}])
+    assert ce._infer_schema(filename, sample_rows=2) == {"v": "INT64"}
+    assert ce._infer_schema(filename, sample_rows=3) == {"v": "STRING"}
+
+
+def test_infer_schema_is_cached(tmp_path, monkeypatch):
+    filename = write_table(tmp_path, [{"v": 1}])
+    assert ce._infer_schema(filename) == {"v": "INT64"}
+    assert os.path.exists(str(tmp_path / "table1.inferred_schema.json"))
+
+    def fail(*args):
+        raise AssertionError("schema inferred again")
+
+    monkeypatch.setattr(ce, "_sample_schema", fail)
+    assert ce._infer_schema(filename) == {"v": "INT64"}
+    monkeypatch.undo()
+    write_table(tmp_path, [{"v": 1.5}])
+    assert ce._infer_schema(filename) == {"v": "FLOAT64"}
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import carto_extension as ce
+
+np = pytest.importorskip("numpy")
+shapely = pytest.importorskip("shapely")
+
+SOURCE_FOLDER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "components",
+    "split_line",
+    "src",
+)
+
+
+@pytest.fixture(scope="module")
+def local():
+    return ce._load_local_engine("split_line", os.path.join(SOURCE_FOLDER, "local.py"))
+
+
+@pytest.fixture(scope="module")
+def split_lines(local):
+    # imported by local.py from the source folder
+    import split_lines
+
+    return split_lines.split_lines
+
+
+def coordinates(segments):
+    return [segment.tolist() for segment in segments]
+
+
+def test_split_lines(split_lines):
+    lines = [
+        shapely.LineString(coords)
+        for coords in [[(0, 0), (2, 0)], [(0, 0), (1, 0), (1, 1)], [(5, 5), (6, 5)]]
+    ]
+    points = [[(1, 0.5), (1.5, 0)], [(1, 0), (1, 0.5)], []]
+    assert [coordinates(segments) for segments in split_lines(lines, points)] == [
+        [[[0, 0], [1, 0]], [[1, 0], [1.5, 0]], [[1.5, 0], [2, 0]]],
+        [[[0, 0], [1, 0]], [[1, 0], [1, 0.5]], [[1, 0.5], [1, 1]]],
+        [[[5, 5], [6, 5]]],
+    ]
+
+
+def test_split_lines_merges_points_within_the_tolerance(split_lines):
+    line = shapely.linestrings([[(0, 0), (1, 0)]])
+    points = [[(0.5, 0), (0.5000001, 0), (1e-7, 0), (2, 0)]]
+    segments, = split_lines(line, points, tolerance=1e-6)
+    assert coordinates(segments) == [[[0, 0], [0.5, 0]], [[0.5, 0], [1, 0]]]
+    segments, = split_lines(line, points, tolerance=1e-9)
+    assert len(segments) == 4
+
+
+def test_split_lines_rejects_other_geometries(split_lines, local):
+    lines = shapely.from_wkt(["LINESTRING(0 0, 1 0)", "MULTILINESTRING((0 0, 1 0), (2 2, 3 3))"])
+    with pytest.raises(ValueError, match="got MultiLineString"):
+        split_lines(lines, [[], [(0.5, 0)]])
+    rows = [{"geoid": 1, "geom": "MULTILINESTRING((0 0, 1 0), (2 2, 3 3))"}]
+    with pytest.raises(ValueError, match="Only LINESTRING"):
+        local.split_line(rows)
+
+
+def test_fullrun(local):
+    rows = [
+        {"geoid": "a", "geom": "LINESTRING(0 0, 0.02 0)"},
+        {"geoid": "b", "geom": "LINESTRING(0.01 -0.01, 0.01 0.01)"},
+        {"geoid": "c", "geom": None},
+    ]
+    output = local.fullrun(
+        {"input_table": rows, "user_column": "geoid", "tolerance": 1e-6}
+    )["output_table"]
+    assert [(row["geoid"], row["segmentid"], row["geom"]) for row in output] == [
+        ("a", 0, "LINESTRING(0 0, 0.01 0)"),
+        ("a", 1, "LINESTRING(0.01 0, 0.02 0)"),
+        ("b", 0, "LINESTRING(0.01 -0.01, 0.01 0)"),
+        ("b", 1, "LINESTRING(0.01 0, 0.01 0.01)"),
+    ]
+    assert all(row["segment_wkt"] == row["geom"] for row in output)
+    # 0.01 degrees on a sphere of the mean radius of the Earth
+    assert output[0]["segment_length_km"] == pytest.approx(1.11195, abs=1e-5)
+
+
+def test_fullrun_options(local):
+    rows = [
+        {"id": 1, "geom": "LINESTRING(0 0, 0.02 0)"},
+        {"id": 1, "geom": "LINESTRING(0.01 -0.01, 0.01 0.01)"},
+    ]
+    output = local.split_line(rows, "id", include_segment_wkt=False)
+    # lines with the same ID are not split by each other
+    assert [sorted(row) for row in output] == [["geom", "id", "segment_length_km", "segmentid"]] * 2
+    with pytest.raises(KeyError, match="geoid"):
+        local.split_line(rows)
@@ -0,0 +1,55 @@
+import pytest
+
+import carto_extension as ce
+
+
+def test_template_renders_variables():
+    template = ce.Template("SELECT * FROM ${PROJECT}.${DATASET}.t WHERE a = '${PROJECT}'")
+    assert template.variables == {"PROJECT", "DATASET"}
+    lookup = {"PROJECT": "p", "DATASET": "d"}
+    assert template.render(lookup) == "SELECT * FROM p.d.t WHERE a = 'p'"
+    assert ce.Template("no variables").render({}) == "no variables"
+
+
+def test_template_reports_all_missing_variables():
+    lookup = ce.VariableLookup(PROJECT="p")
+    with pytest.raises(ValueError, match="Environment variables DATASET, TABLE are not set"):
+        ce.Template("${PROJECT}.${DATASET}.${TABLE}").render(lookup)
+
+
+def test_variable_lookup_reads_the_environment(monkeypatch):
+    monkeypatch.setenv("CARTO_TEST_VARIABLE", "value")
+    monkeypatch.delenv("CARTO_MISSING_VARIABLE", raising=False)
+    assert ce.substitute_vars("${CARTO_TEST_VARIABLE}") == "value"
+    with pytest.raises(ValueError, match="Environment variable CARTO_MISSING_VARIABLE is not set"):
+        ce.substitute_vars("${CARTO_MISSING_VARIABLE}")
+
+
+def test_substitute_lines():
+    lines = ['{"table": "${DATASET}.a"}\n', '{"value": "$ {x} ${}"}\n']
+    assert list(ce.substitute_lines(lines, {"DATASET": "d"})) == [
+        '{"table": "d.a"}\n',
+        '{"value": "$ {x} ${}"}\n',
+    ]
+
+
+def test_substitute_lines_reports_missing_variables_at_the_end():
+    lines = ce.substitute_lines(["${A}\n", "${B} ${C}\n"], {"A": "a", "B": None, "C": None})
+    assert next(lines) == "a\n"
+    assert next(lines) == "${B} ${C}\n"
+    with pytest.raises(ValueError, match="Environment variables B, C are not set"):
+        next(lines)
+
+
+def test_missing_variables_of_a_plain_dict():
+    with pytest.raises(ValueError, match="Environment variable DATASET is not set"):
+        ce.Template("${PROJECT}.${DATASET}").render({"PROJECT": "p"})
+    with pytest.raises(ValueError, match="Environment variable DATASET is not set"):
+        list(ce.substitute_lines(["${DATASET}\n"], {}))
+
+
+def test_templates_are_parsed_once():
+    text = "SELECT * FROM ${CARTO_TEST_DATASET}.cached"
+    assert ce.substitute_vars(text, {"CARTO_TEST_DATASET": "a"}) == "SELECT * FROM a.cached"
+    assert ce.substitute_vars(text, {"CARTO_TEST_DATASET": "b"}) == "SELECT * FROM b.cached"
+    assert ce._template(text) is ce._template(text)